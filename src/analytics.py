@@ -0,0 +1,235 @@
+"""Performance analytics
+* Metrics of many return series at once. The returns are a (series, bars)
+  matrix, e.g. one row per backtest of a sweep, and every metric is computed
+  for all the rows in one vectorized pass instead of a loop over the series.
+* Sharpe and Sortino ratios, maximum drawdown and its duration, rolling Sharpe
+  ratio, turnover and Kelly fraction. NaN returns, e.g. the padding of shorter
+  series, are skipped.
+* ReturnsAnalyzer records the bar returns and the traded value of a backtrader
+  run, to be stacked into the matrix.
+"""
+from array import array
+import numpy as np
+import pandas as pd
+import backtrader as bt
+
+# Annualization factor of the ratios
+TRADING_DAYS = 252
+# Number of minute bars of a regular US session, 9:30 to 16:00.
+SESSION_MINUTES = 390
+
+
+def periods_per_year(timeframe:int=bt.TimeFrame.Days, compression:int=1) -> float:
+    """Bars per year of a backtrader timeframe and compression, e.g.
+    252 * 78 for 5 minute bars. Intraday bars cover the regular session."""
+    minutes = TRADING_DAYS * SESSION_MINUTES
+    return {
+        bt.TimeFrame.Seconds: minutes * 60,
+        bt.TimeFrame.Minutes: minutes,
+        bt.TimeFrame.Days: TRADING_DAYS,
+        bt.TimeFrame.Weeks: 52,
+        bt.TimeFrame.Months: 12,
+        bt.TimeFrame.Years: 1,
+    }[timeframe] / compression
+
+
+def as_matrix(series) -> np.ndarray:
+    """(series, bars) float array of a matrix, a single series or a list of
+    series of different lengths, which are padded with NaN at the end."""
+    if isinstance(series, (pd.DataFrame, pd.Series, np.ndarray)):
+        matrix = np.asarray(series, dtype=float)
+        return matrix[None] if matrix.ndim == 1 else matrix
+    rows = [np.asarray(row, dtype=float) for row in series]
+    matrix = np.full((len(rows), max((row.shape[0] for row in rows), default=0)), np.nan)
+    for out, row in zip(matrix, rows):
+        out[:row.shape[0]] = row
+    return matrix
+
+
+def _moments(returns:np.ndarray) -> tuple:
+    """Count, mean and variance (ddof=0) of every row, skipping NaN."""
+    valid = ~np.isnan(returns)
+    count = valid.sum(axis=1)
+    x = np.where(valid, returns, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = x.sum(axis=1) / count
+        variance = np.where(valid, (returns - mean[:, None]) ** 2, 0.0).sum(axis=1) / count
+    return count, mean, variance
+
+
+def _ratio(numerator:np.ndarray, denominator:np.ndarray) -> np.ndarray:
+    """numerator / denominator, NaN where the denominator is 0."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(denominator > 0, numerator / denominator, np.nan)
+
+
+def sharpe(returns, riskfree:float=0.0, periods:int=TRADING_DAYS) -> np.ndarray:
+    """Annualized Sharpe ratio of every series.
+
+    Parameters
+    ----------
+    returns: array like
+        (series, bars) returns, see `as_matrix`.
+    riskfree: float
+        Annual risk free rate.
+    periods: int
+        Bars per year.
+
+    Returns
+    -------
+    numpy.ndarray
+        One ratio per series, NaN for a constant series.
+    """
+    _, mean, variance = _moments(as_matrix(returns))
+    return np.sqrt(periods) * _ratio(mean - riskfree / periods, np.sqrt(variance))
+
+
+def sortino(returns, riskfree:float=0.0, periods:int=TRADING_DAYS) -> np.ndarray:
+    """Annualized Sortino ratio of every series, the mean excess return over
+    the root mean square of the negative excess returns. See `sharpe`."""
+    excess = as_matrix(returns) - riskfree / periods
+    count, mean, _ = _moments(excess)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        downside = np.sqrt(np.nansum(np.minimum(excess, 0.0) ** 2, axis=1) / count)
+    return np.sqrt(periods) * _ratio(mean, downside)
+
+
+def drawdown(returns) -> tuple:
+    """Maximum drawdown and longest drawdown of every series.
+
+    Returns
+    -------
+    tuple
+        (maximum drawdown as a fraction of the peak, longest number of bars
+        below the peak) arrays with one value per series.
+    """
+    matrix = as_matrix(returns)
+    if matrix.shape[1] == 0:
+        return np.zeros(matrix.shape[0]), np.zeros(matrix.shape[0], dtype=int)
+    # Number of returns up to every bar, the NaN bars do not last.
+    count = np.pad(np.cumsum(~np.isnan(matrix), axis=1), ((0, 0), (1, 0)))
+    matrix = np.nan_to_num(matrix)
+    wealth = np.cumprod(1 + matrix, axis=1)
+    # The initial wealth of 1 is the first peak.
+    peak = np.maximum(np.maximum.accumulate(wealth, axis=1), 1.0)
+    depth = 1 - wealth / peak
+    bars = np.arange(matrix.shape[1])
+    # Position of the last bar at the peak, -1 before the first one
+    last_peak = np.maximum.accumulate(np.where(depth <= 0, bars, -1), axis=1)
+    duration = count[:, 1:] - np.take_along_axis(count, last_peak + 1, axis=1)
+    return depth.max(axis=1), duration.max(axis=1)
+
+
+def rolling_sharpe(returns, window:int=TRADING_DAYS // 4, riskfree:float=0.0,
+                   periods:int=TRADING_DAYS) -> np.ndarray:
+    """Annualized Sharpe ratio of the last `window` bars of every bar, from
+    running sums in O(bars) per series.
+
+    Returns
+    -------
+    numpy.ndarray
+        (series, bars) ratios, NaN for the first `window` - 1 bars.
+    """
+    matrix = np.nan_to_num(as_matrix(returns)) - riskfree / periods
+    out = np.full(matrix.shape, np.nan)
+    if matrix.shape[1] < window:
+        return out
+    sums = np.cumsum(np.pad(matrix, ((0, 0), (1, 0))), axis=1)
+    squares = np.cumsum(np.pad(matrix ** 2, ((0, 0), (1, 0))), axis=1)
+    mean = (sums[:, window:] - sums[:, :-window]) / window
+    variance = np.maximum((squares[:, window:] - squares[:, :-window]) / window - mean ** 2, 0.0)
+    out[:, window - 1:] = np.sqrt(periods) * _ratio(mean, np.sqrt(variance))
+    return out
+
+
+def turnover(traded, periods:int=TRADING_DAYS) -> np.ndarray:
+    """Annualized turnover of every series.
+
+    Parameters
+    ----------
+    traded: array like
+        (series, bars) value traded per bar as a fraction of the portfolio
+        value, e.g. recorded by `ReturnsAnalyzer`.
+    periods: int
+        Bars per year.
+    """
+    _, mean, _ = _moments(np.abs(as_matrix(traded)))
+    return periods * mean
+
+
+def kelly_fraction(returns, riskfree:float=0.0, periods:int=TRADING_DAYS) -> np.ndarray:
+    """Kelly fraction of every series on its own, the mean excess return over
+    the variance of the returns."""
+    _, mean, variance = _moments(as_matrix(returns))
+    return _ratio(mean - riskfree / periods, variance)
+
+
+def summary(returns, traded=None, riskfree:float=0.0, periods:int=TRADING_DAYS,
+            index=None) -> pd.DataFrame:
+    """All the metrics of every series.
+
+    Parameters
+    ----------
+    returns: array like
+        (series, bars) returns, see `as_matrix`.
+    traded: array like
+        (series, bars) traded fractions, see `turnover`. No turnover column if
+        not specified.
+    riskfree: float
+        Annual risk free rate.
+    periods: int
+        Bars per year.
+    index: list
+        Labels of the series.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Total return, Sharpe and Sortino ratios, maximum drawdown and its
+        duration in bars, Kelly fraction and turnover, one row per series.
+    """
+    matrix = as_matrix(returns)
+    max_drawdown, duration = drawdown(matrix)
+    df = pd.DataFrame({
+        "return": np.prod(1 + np.nan_to_num(matrix), axis=1) - 1,
+        "sharpe": sharpe(matrix, riskfree, periods),
+        "sortino": sortino(matrix, riskfree, periods),
+        "max_drawdown": max_drawdown,
+        "drawdown_duration": duration,
+        "kelly": kelly_fraction(matrix, riskfree, periods),
+    }, index=index)
+    if traded is not None:
+        df["turnover"] = turnover(traded, periods)
+    return df
+
+
+class ReturnsAnalyzer(bt.Analyzer):
+    """Record the portfolio value and the traded value of every bar, including
+    the warm-up bars.
+
+    `get_analysis` returns a dict with the bar to bar 'returns' and the
+    'traded' value as a fraction of the portfolio value of the bars after the
+    first one, the rows of `summary`.
+    """
+    def start(self):
+        self.values = array("d")
+        self.traded = array("d")
+        self.pending = 0.0
+
+    def notify_order(self, order):
+        if order.status == order.Completed:
+            self.pending += abs(order.executed.size * order.executed.price)
+
+    def next(self):
+        value = self.strategy.broker.getvalue()
+        self.values.append(value)
+        self.traded.append(self.pending / value if value else 0.0)
+        self.pending = 0.0
+
+    def get_analysis(self):
+        values = np.frombuffer(self.values, dtype=float)
+        return {
+            "values": values,
+            "returns": values[1:] / values[:-1] - 1,
+            "traded": np.frombuffer(self.traded, dtype=float)[1:],
+        }
@@ -0,0 +1,352 @@
+"""Benchmarks
+* Deterministic synthetic OHLCV data in the layout of the YahooFinance downloads,
+  daily or minute bars.
+* Times `strategies.run` per strategy, `utils.download_yf` against a stub
+  ticker, `utils.plot_candle_stick` rendering to a file, daily or minute bars,
+  and the vectorized engines. Every case runs in a fresh process so its peak
+  RSS is its own.
+* The results are saved to a JSON baseline. The compare mode runs the cases of
+  a baseline again and flags the cases that got slower, or use more memory, by
+  more than a threshold.
+* The scaling mode reports the runtime and peak RSS of a multi-asset backtest
+  against the number of assets.
+
+python -m src.bench --save baseline.json
+python -m src.bench --compare baseline.json --threshold 0.2
+python -m src.bench --assets 10 100 500 --years 10 --budget 256
+python -m src.bench --cases plot_candle_stick:1m --rows 1000000
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from functools import partial
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+from src.analytics import SESSION_MINUTES
+from src.profiling import peak_rss
+
+
+def synthetic_ohlcv(rows:int, freq:str="1d", seed:int=0, start:str="1970-01-02") -> pd.DataFrame:
+    """Random walk OHLCV bars with the columns and index of `yf.Ticker.history`.
+
+    Parameters
+    ----------
+    rows: int
+        Number of bars.
+    freq: str
+        '1d' for one bar per business day or '1m' for the minute bars of the
+        regular sessions of the business days.
+    seed: int
+        Seed of the random numbers. The same seed gives the same bars.
+    start: str
+        First business day.
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    if freq == "1d":
+        index = pd.bdate_range(start, periods=rows, name="Date")
+        sigma = 2e-2
+    elif freq == "1m":
+        days = pd.bdate_range(start, periods=-(-rows // SESSION_MINUTES))
+        minutes = pd.to_timedelta(np.arange(SESSION_MINUTES) + 9 * 60 + 30, unit="min")
+        index = pd.DatetimeIndex(
+            (days.values[:, None] + minutes.values[None, :]).ravel()[:rows], name="Datetime"
+        )
+        sigma = 1e-3
+    else:
+        raise ValueError("Unknown frequency %s, expected '1d' or '1m'" % freq)
+    close = 40 * np.exp(np.cumsum(rng.normal(0, sigma, rows)))
+    open_ = close * np.exp(rng.normal(0, sigma / 2, rows))
+    return pd.DataFrame({
+        "Open": open_,
+        "High": np.maximum(open_, close) * (1 + rng.uniform(0, sigma, rows)),
+        "Low": np.minimum(open_, close) * (1 - rng.uniform(0, sigma, rows)),
+        "Close": close,
+        "Volume": rng.integers(100000, 1000000, rows),
+        "Dividends": 0.0,
+        "Stock Splits": 0.0,
+    }, index=index.tz_localize("America/New_York"))
+
+
+class _StubTicker:
+    """Stand-in for `yf.Ticker` serving synthetic bars without the network."""
+    def __init__(self, df:pd.DataFrame):
+        self.df = df
+
+    def history(self, period:str=None, interval:str="1d", start=None, **kwargs) -> pd.DataFrame:
+        if start is not None:
+            return self.df[self.df.index >= start].copy()
+        return self.df.copy()
+
+
+def _quiet(function):
+    """Call a function, sending the console output of the strategies nowhere."""
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        handlers = [handler for handler in logging.getLogger().handlers
+                    if isinstance(handler, logging.StreamHandler)]
+        streams = [handler.setStream(devnull) for handler in handlers]
+        try:
+            return function()
+        finally:
+            for handler, stream in zip(handlers, streams):
+                handler.setStream(stream)
+
+
+def _run_case(strategy:str, rows:int, folder:str):
+    from src import strategies
+    filepath = os.path.join(folder, "synthetic_1d.csv")
+    synthetic_ohlcv(rows).to_csv(filepath)
+    return partial(_quiet, partial(
+        strategies.run, getattr(strategies, strategy), filepath, fromdate=None, todate=None
+    ))
+
+
+def _download_case(cached:bool, rows:int, folder:str):
+    from src import utils
+    stub = _StubTicker(synthetic_ohlcv(rows))
+    utils.yf.Ticker = lambda ticker: stub
+    if not cached:
+        return partial(utils.download_yf, "SYN", "max", path=folder)
+    cache = os.path.join(folder, "cache")
+    # Fill the cache, the timed calls read it without downloading.
+    utils.download_yf("SYN", "max", cache=cache)
+    return partial(utils.download_yf, "SYN", "max", cache=cache)
+
+
+def _plot_case(freq:str, rows:int, folder:str):
+    from src import utils
+    df = synthetic_ohlcv(rows, freq=freq)
+    return partial(utils.plot_candle_stick, df, filepath=os.path.join(folder, "candle_stick.png"))
+
+
+def _vectorized_case(strategy:str, rows:int, folder:str):
+    from src import vectorized
+    from src.feeds import load_yahoo_csv
+    filepath = os.path.join(folder, "synthetic_1d.csv")
+    synthetic_ohlcv(rows).to_csv(filepath)
+    df = load_yahoo_csv(filepath)
+    return partial(vectorized.backtest, strategy, df)
+
+
+def _pairs_case(rows:int, folder:str):
+    from src import pairs
+    tickers = ["T%i" % i for i in range(20)]
+    prices = pd.DataFrame({
+        ticker: synthetic_ohlcv(rows, seed=seed)["Close"].values
+        for seed, ticker in enumerate(tickers)
+    })
+    pair_list = [(y, x) for i, y in enumerate(tickers) for x in tickers[i + 1:]]
+    return partial(pairs.spread_positions, prices, pair_list, hedge_window=60)
+
+
+def _feed_case(rows:int, folder:str):
+    import backtrader as bt
+    from src.feeds import ArrayData, compile_yahoo_csv, file_timeframe
+    filepath = os.path.join(folder, "synthetic_1m.csv")
+    synthetic_ohlcv(rows, freq="1m").to_csv(filepath)
+    compile_yahoo_csv(filepath)
+    timeframe, compression = file_timeframe(filepath)
+
+    def case():
+        data = ArrayData(dataname=filepath, timeframe=timeframe, compression=compression)
+        bt.Cerebro().adddata(data)
+        data._start()
+        data.preload()
+    return case
+
+
+# Name: (setup, default number of bars). The setup creates the data of the
+# case and returns the function to time.
+CASES = {
+    "run:TestStrategy": (partial(_run_case, "TestStrategy"), 10000),
+    "run:MaStrategy": (partial(_run_case, "MaStrategy"), 10000),
+    "run:KDJStrategy": (partial(_run_case, "KDJStrategy"), 10000),
+    "download_yf": (partial(_download_case, False), 10000),
+    "download_yf:cached": (partial(_download_case, True), 10000),
+    "plot_candle_stick": (partial(_plot_case, "1d"), 1000),
+    "plot_candle_stick:1m": (partial(_plot_case, "1m"), 1000000),
+    "vectorized:TestStrategy": (partial(_vectorized_case, "TestStrategy"), 10000),
+    "vectorized:MaStrategy": (partial(_vectorized_case, "MaStrategy"), 10000),
+    "vectorized:KDJStrategy": (partial(_vectorized_case, "KDJStrategy"), 10000),
+    "pairs:spread_positions": (_pairs_case, 10000),
+    "feeds:ArrayData": (_feed_case, 1000000),
+}
+
+
+def _measure(name:str, rows:int, repeat:int) -> dict:
+    """Time a case in the current process, best of `repeat` calls."""
+    with tempfile.TemporaryDirectory() as folder:
+        case = CASES[name][0](rows, folder)
+        seconds = np.inf
+        for _ in range(repeat):
+            start = time.perf_counter()
+            case()
+            seconds = min(seconds, time.perf_counter() - start)
+    return {
+        "rows": rows,
+        "seconds": seconds,
+        "bars_per_sec": rows / seconds,
+        "peak_rss_mb": peak_rss(),
+    }
+
+
+def benchmark(names:list=None, rows:dict=None, repeat:int=3) -> dict:
+    """Run benchmark cases, each in a new process.
+
+    Parameters
+    ----------
+    names: list
+        Names of the cases in `CASES`. All cases if not specified.
+    rows: dict
+        Number of bars per case name. Defaults to the number in `CASES`.
+    repeat: int
+        Number of timed calls per case. The fastest call is kept.
+
+    Returns
+    -------
+    dict
+        Rows, seconds, bars per second and peak RSS in MB per case name.
+    """
+    names = names or list(CASES)
+    rows = rows or {}
+    results = {}
+    for name in names:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            results[name] = executor.submit(
+                _measure, name, rows.get(name, CASES[name][1]), repeat
+            ).result()
+    return results
+
+
+def compare(baseline:dict, results:dict, threshold:float=0.1) -> list:
+    """Cases that are slower or use more memory than in the baseline.
+
+    Parameters
+    ----------
+    baseline: dict
+        Results of `benchmark` saved earlier.
+    results: dict
+        Results of `benchmark` of the same cases.
+    threshold: float
+        Tolerated relative change, e.g. 0.1 flags a case with 10% fewer bars
+        per second or 10% more memory than in the baseline.
+
+    Returns
+    -------
+    list
+        (name, metric, baseline value, new value) of every regression.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        if result["bars_per_sec"] < base["bars_per_sec"] * (1 - threshold):
+            regressions.append((name, "bars_per_sec", base["bars_per_sec"], result["bars_per_sec"]))
+        if result["peak_rss_mb"] > base["peak_rss_mb"] * (1 + threshold):
+            regressions.append((name, "peak_rss_mb", base["peak_rss_mb"], result["peak_rss_mb"]))
+    return regressions
+
+
+def _portfolio_run(paths:list, budget:int) -> dict:
+    from src import strategies
+    start = time.perf_counter()
+    _quiet(partial(strategies.run, strategies.MomentumStrategy, paths,
+                   fromdate=None, todate=None, budget=budget))
+    return {"seconds": time.perf_counter() - start, "peak_rss_mb": peak_rss()}
+
+
+def scaling(assets:list=(10, 100, 500), years:int=10, budget:int=None) -> dict:
+    """Time `strategies.run` of `MomentumStrategy` on synthetic daily bars
+    against the number of assets, each number in a new process.
+
+    Parameters
+    ----------
+    assets: list
+        Numbers of assets.
+    years: int
+        Years of daily bars of every asset.
+    budget: int
+        Memory budget in MB of `strategies.run`. No budget if not specified.
+
+    Returns
+    -------
+    dict
+        Bars, seconds, bars per second (of all the assets) and peak RSS in MB
+        per number of assets.
+    """
+    rows = 252 * years
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        from src.feeds import compile_yahoo_csv
+        paths = []
+        for seed in range(max(assets)):
+            paths.append(os.path.join(folder, "synthetic%i_1d.csv" % seed))
+            synthetic_ohlcv(rows, seed=seed).to_csv(paths[-1])
+            # Compiled once, like the data files of repeated backtests
+            compile_yahoo_csv(paths[-1])
+        for n in assets:
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                result = executor.submit(_portfolio_run, paths[:n], budget).result()
+            result.update(bars=rows, bars_per_sec=n * rows / result["seconds"])
+            results[n] = result
+    return results
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("--cases", nargs="*", choices=list(CASES), help="Default: all cases")
+    parser.add_argument("--rows", type=int, help="Number of bars of every case")
+    parser.add_argument("--repeat", default=3, type=int)
+    parser.add_argument("--save", type=str, help="Write the results to this JSON baseline")
+    parser.add_argument("--compare", type=str, help="Compare with this JSON baseline")
+    parser.add_argument("--threshold", default=0.1, type=float)
+    parser.add_argument("--assets", nargs="+", type=int, help="Numbers of assets of the scaling mode")
+    parser.add_argument("--years", default=10, type=int, help="Years of daily bars of the scaling mode")
+    parser.add_argument("--budget", type=int, help="Memory budget in MB of the scaling mode")
+    args = parser.parse_args()
+    if args.assets is not None:
+        for n, result in scaling(args.assets, args.years, args.budget).items():
+            print("%6i assets %8i bars %10.3f s %14.0f bars/s %8.1f MB" % (
+                n, result["bars"], result["seconds"], result["bars_per_sec"], result["peak_rss_mb"]
+            ))
+        sys.exit(0)
+    baseline = None
+    names = args.cases
+    rows = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)["cases"]
+        # Run the cases of the baseline with the same data sizes.
+        names = names or [name for name in baseline if name in CASES]
+        rows = {name: baseline[name]["rows"] for name in names if name in baseline}
+    if args.rows is not None:
+        rows = {name: args.rows for name in (names or CASES)}
+    results = benchmark(names, rows, args.repeat)
+    for name, result in results.items():
+        print("%-24s %10i bars %10.3f s %14.0f bars/s %8.1f MB" % (
+            name, result["rows"], result["seconds"], result["bars_per_sec"], result["peak_rss_mb"]
+        ))
+    if args.save is not None:
+        with open(args.save, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cases": results,
+            }, f, indent=2)
+    if baseline is not None:
+        regressions = compare(baseline, results, args.threshold)
+        for name, metric, before, after in regressions:
+            print("REGRESSION %-24s %s %.1f -> %.1f" % (name, metric, before, after))
+        sys.exit(1 if regressions else 0)
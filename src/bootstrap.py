@@ -0,0 +1,161 @@
+"""Bootstrap
+* Confidence intervals of the Sharpe ratio, the maximum drawdown and the
+  terminal value of a backtest, from stationary block bootstrap resamples of
+  its daily returns (Politis and Romano). Blocks of geometric random length
+  keep the autocorrelation of the returns within a block.
+* The paths are generated as (paths, bars) index arrays and evaluated with
+  `analytics` in one batched NumPy computation per chunk of paths, so the
+  memory is bounded by the chunk size.
+* Every chunk has its own random generator spawned from the seed, so a seeded
+  run gives the same paths with or without the process pool.
+
+python -m src.bootstrap --strategy KDJStrategy --dataname data/tenb_*_1d.csv --paths 20000 --seed 0
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import os
+import numpy as np
+import pandas as pd
+
+from src import analytics
+
+# Returns of the workers, set by _init_worker
+_RETURNS = None
+
+
+def stationary_indices(rng:np.random.Generator, paths:int, bars:int, block:float) -> np.ndarray:
+    """Row indices of stationary bootstrap paths.
+
+    Every bar starts a new block at a random bar with probability 1 / `block`
+    and otherwise continues the block with the next bar, wrapping around at the
+    end of the series.
+
+    Parameters
+    ----------
+    rng: numpy.random.Generator
+        Random generator.
+    paths: int
+        Number of paths.
+    bars: int
+        Number of bars of the series and of every path.
+    block: float
+        Mean block length in bars. 1 resamples the bars independently.
+
+    Returns
+    -------
+    numpy.ndarray
+        (paths, bars) int64 indices.
+    """
+    starts = rng.integers(0, bars, size=(paths, bars))
+    new = rng.random((paths, bars)) < 1.0 / block
+    new[:, 0] = True
+    position = np.arange(bars)
+    # Position of the start of the block of every bar
+    first = np.maximum.accumulate(np.where(new, position, 0), axis=1)
+    return (np.take_along_axis(starts, first, axis=1) + position - first) % bars
+
+
+def returns_from_values(values:np.ndarray) -> np.ndarray:
+    """Bar to bar returns of a portfolio value series, e.g. the equity of a
+    vectorized backtest or the values recorded by `analytics.ReturnsAnalyzer`."""
+    values = np.asarray(values, dtype=float)
+    return values[1:] / values[:-1] - 1
+
+
+def _init_worker(returns:np.ndarray) -> None:
+    global _RETURNS
+    _RETURNS = returns
+
+
+def _run_chunk(job:tuple) -> np.ndarray:
+    """Sharpe ratio, maximum drawdown and terminal wealth of a chunk of paths."""
+    seed, paths, block, periods = job
+    rng = np.random.default_rng(seed)
+    samples = _RETURNS[stationary_indices(rng, paths, _RETURNS.shape[0], block)]
+    return np.column_stack([
+        analytics.sharpe(samples, periods=periods),
+        analytics.drawdown(samples)[0],
+        np.prod(1 + samples, axis=1),
+    ])
+
+
+def bootstrap(returns:np.ndarray, paths:int=10000, block:float=20, seed:int=None,
+              chunk:int=1000, processes:int=1, initial:float=1.0,
+              periods:int=analytics.TRADING_DAYS) -> pd.DataFrame:
+    """Distributions of the metrics of a backtest over bootstrap paths.
+
+    Parameters
+    ----------
+    returns: numpy.ndarray
+        Daily returns of the backtest, e.g. `returns_from_values` of its
+        portfolio values or the P&L of `pairs.spread_positions` of a pair.
+        NaN returns are dropped.
+    paths: int
+        Number of bootstrap paths.
+    block: float
+        Mean block length in bars, see `stationary_indices`.
+    seed: int
+        Seed of the random numbers. The same seed and chunk size give the same
+        paths with any number of processes. Random if not specified.
+    chunk: int
+        Paths per batch. The memory of a batch is about 4 * chunk * bars * 8 bytes.
+    processes: int
+        Number of worker processes. With 1 the chunks run in the calling process.
+    initial: float
+        Initial portfolio value of the terminal values.
+    periods: int
+        Bars per year of the Sharpe ratio.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns sharpe, max_drawdown and terminal, one row per path, e.g.
+        `df.quantile([0.025, 0.5, 0.975])` for the 95% confidence intervals.
+    """
+    returns = np.asarray(returns, dtype=float)
+    returns = np.ascontiguousarray(returns[~np.isnan(returns)])
+    if returns.shape[0] < 2:
+        raise ValueError("At least 2 returns are needed, got %i" % returns.shape[0])
+    sizes = [min(chunk, paths - first) for first in range(0, paths, chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    jobs = [(seeds[i], size, block, periods) for i, size in enumerate(sizes)]
+    if processes == 1:
+        global _RETURNS
+        _init_worker(returns)
+        results = [_run_chunk(job) for job in jobs]
+        _RETURNS = None
+    else:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                 initargs=(returns,)) as executor:
+            results = list(executor.map(_run_chunk, jobs))
+    out = np.concatenate(results) if results else np.empty((0, 3))
+    out[:, 2] *= initial
+    return pd.DataFrame(out, columns=["sharpe", "max_drawdown", "terminal"])
+
+
+if __name__ == '__main__':
+    from src import strategies, sweep
+    from src.feeds import load_yahoo_csv
+    parser = ArgumentParser()
+    parser.add_argument("--strategy", type=str)
+    parser.add_argument("--dataname", type=str, help="csv file or glob pattern")
+    parser.add_argument("--engine", default="vectorized", choices=["cerebro", "vectorized"])
+    parser.add_argument("--paths", default=10000, type=int)
+    parser.add_argument("--block", default=20, type=float)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--chunk", default=1000, type=int)
+    parser.add_argument("--processes", default=1, type=int)
+    args = parser.parse_args()
+    paths = glob.glob(args.dataname)
+    if len(paths) == 0:
+        parser.error("No file matches --dataname %s" % args.dataname)
+    df = load_yahoo_csv(max(paths, key=os.path.getmtime))
+    value, values, _, _ = sweep.ENGINES[args.engine](getattr(strategies, args.strategy), df, {})
+    returns = returns_from_values(values)
+    samples = bootstrap(returns, paths=args.paths, block=args.block, seed=args.seed,
+                        chunk=args.chunk, processes=args.processes, initial=values[0])
+    print("Backtest: Sharpe %.2f, Max Drawdown %.2f%%, Final Value %.2f" % (
+        analytics.sharpe(returns)[0], 100 * analytics.drawdown(returns)[0][0], value
+    ))
+    print(samples.quantile([0.025, 0.05, 0.5, 0.95, 0.975]).to_string())
@@ -0,0 +1,235 @@
+"""On-disk OHLC cache
+* Columnar store of the bars downloaded from YahooFinance, one folder per ticker
+  and interval. Every column is a raw binary file which is appended to when new
+  bars are downloaded and memory mapped when read.
+* The row count in meta.json is the commit point: it is rewritten atomically
+  after the columns are appended, so an interrupted append is ignored.
+"""
+import json
+import os
+import re
+import numpy as np
+import pandas as pd
+
+# Time after which a bar of the given interval may have changed
+_INTERVALS = {
+    "1m": pd.Timedelta(minutes=1),
+    "2m": pd.Timedelta(minutes=2),
+    "5m": pd.Timedelta(minutes=5),
+    "15m": pd.Timedelta(minutes=15),
+    "30m": pd.Timedelta(minutes=30),
+    "60m": pd.Timedelta(hours=1),
+    "90m": pd.Timedelta(minutes=90),
+    "1h": pd.Timedelta(hours=1),
+    "1d": pd.Timedelta(days=1),
+    "5d": pd.Timedelta(days=5),
+    "1wk": pd.Timedelta(weeks=1),
+    "1mo": pd.Timedelta(days=28),
+    "3mo": pd.Timedelta(days=90),
+}
+_PERIOD = re.compile(r"^(\d+)(d|wk|mo|y)$")
+
+
+def period_start(period:str, now:pd.Timestamp) -> pd.Timestamp:
+    """First timestamp of a YahooFinance period, e.g. '2y' or 'ytd'.
+
+    Returns
+    -------
+    pandas.Timestamp
+        None for the period 'max'.
+    """
+    period = period.lower()
+    if period == "max":
+        return None
+    if period == "ytd":
+        return pd.Timestamp(year=now.year, month=1, day=1, tz=now.tz)
+    match = _PERIOD.match(period)
+    if match is None:
+        raise ValueError("Unknown period %s" % period)
+    n, unit = int(match.group(1)), match.group(2)
+    offset = {
+        "d": pd.DateOffset(days=n),
+        "wk": pd.DateOffset(weeks=n),
+        "mo": pd.DateOffset(months=n),
+        "y": pd.DateOffset(years=n),
+    }[unit]
+    return now - offset
+
+
+def _to_ns(index:pd.DatetimeIndex) -> np.ndarray:
+    """UTC nanoseconds of a datetime index."""
+    return index.values.astype("datetime64[ns]").view("int64")
+
+
+class OHLCCache:
+    """Incremental on-disk cache of YahooFinance OHLC data.
+
+    Parameters
+    ----------
+    root: str
+        Folder of the cache.
+    """
+    def __init__(self, root:str):
+        self.root = root
+
+    def _folder(self, ticker:str, interval:str) -> str:
+        return os.path.join(self.root, ticker.upper(), interval)
+
+    def _column_path(self, folder:str, column:str) -> str:
+        return os.path.join(folder, "%s.bin" % column.replace(" ", "_"))
+
+    def meta(self, ticker:str, interval:str) -> dict:
+        """Metadata of a cached ticker and interval, None if not cached."""
+        path = os.path.join(self._folder(ticker, interval), "meta.json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def _save_meta(self, folder:str, meta:dict) -> None:
+        path = os.path.join(folder, "meta.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(path + ".tmp", path)
+
+    def read(self, ticker:str, interval:str, start:pd.Timestamp=None) -> pd.DataFrame:
+        """Read the cached bars from `start` on without copying the columns.
+
+        Parameters
+        ----------
+        ticker: str
+            Ticker.
+        interval: str
+            Data interval, e.g. '1d'.
+        start: pandas.Timestamp
+            First timestamp to return. If not specified then all bars are returned.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Same layout as `yf.Ticker.history`. Empty if nothing is cached.
+        """
+        meta = self.meta(ticker, interval)
+        if meta is None:
+            return pd.DataFrame()
+        folder = self._folder(ticker, interval)
+        rows = meta["rows"]
+
+        def load(path, dtype):
+            if rows == 0:
+                return np.empty(0, dtype=dtype)
+            return np.memmap(path, dtype=dtype, mode="r", shape=(rows,))
+
+        stamps = load(os.path.join(folder, "index.bin"), "int64")
+        first = 0 if start is None else int(np.searchsorted(stamps, _to_ns(pd.DatetimeIndex([start]))[0]))
+        index = pd.DatetimeIndex(np.asarray(stamps[first:]).view("datetime64[ns]"), name=meta["index_name"])
+        if meta["tz"] is not None:
+            index = index.tz_localize("UTC").tz_convert(meta["tz"])
+        columns = {
+            column: load(self._column_path(folder, column), "float64")[first:]
+            for column in meta["columns"]
+        }
+        return pd.DataFrame(columns, index=index, copy=False)
+
+    def write(self, ticker:str, interval:str, df:pd.DataFrame, position:int, **meta) -> None:
+        """Write bars at a row position, dropping the cached rows from there on.
+
+        Parameters
+        ----------
+        ticker: str
+            Ticker.
+        interval: str
+            Data interval, e.g. '1d'.
+        df: pandas.DataFrame
+            Bars as returned by `yf.Ticker.history`.
+        position: int
+            Row position of the first bar. 0 rewrites the cache.
+        meta:
+            Metadata to update, e.g. the time of the download.
+        """
+        folder = self._folder(ticker, interval)
+        os.makedirs(folder, exist_ok=True)
+        current = self.meta(ticker, interval) if position > 0 else None
+        if current is None:
+            position = 0
+            tz = getattr(df.index, "tz", None)
+            current = {
+                "columns": list(df.columns),
+                "tz": None if tz is None else str(tz),
+                "index_name": df.index.name,
+            }
+        columns = [("index.bin", _to_ns(df.index))] + [
+            (os.path.basename(self._column_path(folder, column)),
+             df[column].values.astype("float64") if column in df else np.zeros(df.shape[0]))
+            for column in current["columns"]
+        ]
+        for filename, values in columns:
+            path = os.path.join(folder, filename)
+            with open(path, "r+b" if position > 0 and os.path.exists(path) else "wb") as f:
+                f.seek(position * values.itemsize)
+                f.write(np.ascontiguousarray(values).tobytes())
+                f.truncate()
+        current.update(meta)
+        current["rows"] = position + df.shape[0]
+        self._save_meta(folder, current)
+
+    def history(self, ticker_obj, ticker:str, period:str, interval:str="1d") -> pd.DataFrame:
+        """Return the bars of a period, downloading only what is not cached.
+
+        * Nothing is downloaded when the cache covers the period and the last
+          download is more recent than one interval.
+        * Otherwise the bars from the second last cached bar on are downloaded
+          and replace the cached ones, because the last cached bar may have been
+          incomplete.
+        * Everything is downloaded again when the cache does not reach back to
+          the start of the period or when the close of the second last cached
+          bar changed, e.g. because of a dividend adjustment.
+
+        Parameters
+        ----------
+        ticker_obj: yfinance.Ticker
+            Object to download the data with.
+        ticker: str
+            Ticker.
+        period: str
+            Length of the data, e.g. '2y', '1mo'.
+        interval: str
+            Data interval, e.g. '1d' for daily data.
+
+        Returns
+        -------
+        pandas.DataFrame
+        """
+        now = pd.Timestamp.now(tz="UTC")
+        start = period_start(period, now)
+        meta = self.meta(ticker, interval)
+        covered = meta is not None and (
+            meta["covered_from"] is None if start is None
+            else meta["covered_from"] is None or meta["covered_from"] <= start.value
+        )
+        if not covered or meta["rows"] == 0:
+            df = ticker_obj.history(period=period, interval=interval, auto_adjust=True)
+            self.write(ticker, interval, df, 0, fetched_at=now.value,
+                       covered_from=None if start is None else start.value)
+            return self.read(ticker, interval, start)
+        step = _INTERVALS.get(interval, pd.Timedelta(minutes=1))
+        if now.value - meta["fetched_at"] >= step.value:
+            cached = self.read(ticker, interval, None)
+            # Download from the last complete bar on to check for adjustments.
+            position = max(meta["rows"] - 2, 0)
+            anchor = cached.index[position]
+            new = ticker_obj.history(start=anchor, interval=interval, auto_adjust=True)
+            new = new[new.index >= anchor]
+            if new.shape[0] > 0 and new.index[0] == anchor and not np.isclose(
+                    new["Close"].iloc[0], cached["Close"].iloc[position]):
+                # The history was adjusted, download it again.
+                df = ticker_obj.history(period=period, interval=interval, auto_adjust=True)
+                self.write(ticker, interval, df, 0, fetched_at=now.value,
+                           covered_from=None if start is None else start.value)
+            else:
+                if new.shape[0] == 0 or new.index[0] != anchor:
+                    # Keep the cached bars before the first downloaded bar.
+                    position = int(np.searchsorted(_to_ns(cached.index), _to_ns(new.index[:1]))[0]) \
+                        if new.shape[0] > 0 else meta["rows"]
+                self.write(ticker, interval, new, position, fetched_at=now.value)
+        return self.read(ticker, interval, start)
@@ -0,0 +1,254 @@
+"""Backtest daemon
+* Long running process serving backtest jobs over a local Unix socket, so a
+  job does not pay for the interpreter start, the imports and the data load
+  of a `strategies.py` run.
+* The loaded data files and the indicator cache (see `indicator_cache.py`)
+  stay in memory between the jobs. A data file is loaded again when it
+  changes on disk.
+* A job is one JSON line, e.g. {"strategy": "KDJStrategy", "dataname":
+  "data/tenb_20210527_20230526_1d.csv", "params": {"period": 9}}, and the
+  reply is one JSON line with the final value, the number of trades, the
+  metrics of `analytics.summary` and the time spent in the daemon.
+* The bench mode compares the latency of the jobs sent to a daemon with cold
+  `python -m src.strategies` runs.
+
+python -m src.daemon --serve --socket /tmp/backtest.sock
+python -m src.daemon --bench --socket /tmp/backtest.sock --strategy KDJStrategy --dataname data/tenb_20210527_20230526_1d.csv
+"""
+from argparse import ArgumentParser
+from collections import OrderedDict
+from datetime import datetime
+import json
+import os
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+import numpy as np
+
+# Default path of the socket
+SOCKET = "/tmp/quantitative_trading.sock"
+# Project folder, the working directory of the `python -m` processes of bench
+_PROJECT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Date range of the cold `strategies.py` runs, the defaults of strategies.run
+FROMDATE = "2021-05-27"
+TODATE = "2023-05-26"
+
+
+class _Daemon(socketserver.UnixStreamServer):
+    """Unix socket server running the jobs one at a time with warm state.
+
+    Parameters
+    ----------
+    path: str
+        Path of the socket.
+    max_datas: int
+        Number of data files kept in memory, least recently used first out.
+    budget: int
+        Bytes of the indicator cache.
+    """
+    def __init__(self, path:str, max_datas:int=64, budget:int=256 * 2 ** 20):
+        # Imported by the daemon only, the client stays light.
+        from src import indicator_cache
+        if os.path.exists(path):
+            # Only a stale socket left by a stopped daemon is removed.
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                try:
+                    probe.connect(path)
+                except ConnectionRefusedError:
+                    os.remove(path)
+                else:
+                    raise RuntimeError("A daemon is already listening on %s" % path)
+        super(_Daemon, self).__init__(path, _Handler)
+        self.max_datas = max_datas
+        self.datas = OrderedDict()
+        self.cache = indicator_cache.configure(budget=budget)
+        self.jobs = 0
+
+    def data(self, dataname:str, fromdate:datetime, todate:datetime):
+        """Frame of a data file, loaded once per version of the file."""
+        from src.feeds import load_yahoo_csv
+        stat = os.stat(dataname)
+        key = (dataname, fromdate, todate)
+        version = (stat.st_size, stat.st_mtime_ns)
+        if key in self.datas and self.datas[key][0] == version:
+            self.datas.move_to_end(key)
+            return self.datas[key][1]
+        df = load_yahoo_csv(dataname, fromdate=fromdate, todate=todate)
+        self.datas[key] = (version, df)
+        self.datas.move_to_end(key)
+        while len(self.datas) > self.max_datas:
+            self.datas.popitem(last=False)
+        return df
+
+    def run_job(self, job:dict) -> dict:
+        """Backtest a job, see `submit`."""
+        import backtrader as bt
+        from src import analytics, strategies, sweep
+        start = time.perf_counter()
+        command = job.get("cmd", "backtest")
+        if command == "stats":
+            return {"jobs": self.jobs, "datas": len(self.datas), "indicator_cache": self.cache.stats()}
+        if command == "shutdown":
+            # shutdown() blocks until serve_forever returns, which waits for this job.
+            threading.Thread(target=self.shutdown).start()
+            return {"shutdown": True}
+        strategy = getattr(strategies, job["strategy"], None)
+        if not (isinstance(strategy, type) and issubclass(strategy, bt.Strategy)):
+            raise ValueError("%s is not a strategy of src.strategies" % job["strategy"])
+        engine = job.get("engine", "cerebro")
+        params = dict(job.get("params", {}))
+        if engine == "cerebro" and "printlog" in strategy.params._getkeys():
+            params.setdefault("printlog", False)
+        fromdate, todate = (datetime.fromisoformat(job[key]) if job.get(key) else None
+                            for key in ("fromdate", "todate"))
+        df = self.data(job["dataname"], fromdate, todate)
+        value, values, trades, traded = sweep.ENGINES[engine](strategy, df, params)
+        metrics = analytics.summary(values[1:] / values[:-1] - 1, traded[1:]).iloc[0]
+        self.jobs += 1
+        out = {"value": value, "trades": int(trades)}
+        out.update({key: float(value) for key, value in metrics.items()})
+        out["seconds"] = time.perf_counter() - start
+        return out
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """Reply to every JSON line of a connection with a JSON line."""
+    def handle(self):
+        for line in self.rfile:
+            try:
+                reply = self.server.run_job(json.loads(line))
+            except Exception as e:
+                reply = {"error": "%s: %s" % (type(e).__name__, e)}
+            self.wfile.write((json.dumps(reply) + "\n").encode())
+            self.wfile.flush()
+
+
+def serve(path:str=SOCKET, max_datas:int=64, budget:int=256 * 2 ** 20) -> None:
+    """Serve backtest jobs on a Unix socket until a shutdown job."""
+    with _Daemon(path, max_datas, budget) as server:
+        try:
+            server.serve_forever()
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def submit(jobs:list, path:str=SOCKET) -> list:
+    """Send jobs to a daemon on one connection and return its replies.
+
+    Parameters
+    ----------
+    jobs: list
+        Dicts with the strategy name ('strategy'), the path of the csv file
+        ('dataname'), and optionally the strategy parameters ('params'), the
+        engine ('engine', 'cerebro' or 'vectorized' as in `sweep.sweep`) and
+        the ISO 'fromdate' and 'todate'. {'cmd': 'stats'} returns the counters
+        of the daemon and {'cmd': 'shutdown'} stops it.
+    path: str
+        Path of the socket.
+
+    Returns
+    -------
+    list
+        One dict per job with the final value, the number of trades, the
+        metrics of `analytics.summary` and the seconds spent in the daemon, or
+        with the 'error' of the job.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(path)
+        with client.makefile("rwb") as stream:
+            replies = []
+            for job in jobs:
+                stream.write((json.dumps(job) + "\n").encode())
+                stream.flush()
+                replies.append(json.loads(stream.readline()))
+    return replies
+
+
+def wait(path:str=SOCKET, timeout:float=30.0) -> None:
+    """Wait until a daemon accepts connections on a socket."""
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            submit([{"cmd": "stats"}], path)
+            return
+        except (FileNotFoundError, ConnectionRefusedError):
+            if time.perf_counter() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def bench(strategy:str, dataname:str, jobs:int=20, cold:int=3, path:str=SOCKET) -> dict:
+    """Latency of backtests sent to a daemon against cold command line runs.
+
+    The daemon is started on `path` if no daemon is listening there, and
+    stopped at the end in that case. The jobs backtest the date range of the
+    cold runs.
+
+    Returns
+    -------
+    dict
+        Median, minimum and maximum seconds of the cold runs and of the jobs
+        measured by the client, the first job included.
+    """
+    started = None
+    try:
+        submit([{"cmd": "stats"}], path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        started = subprocess.Popen([sys.executable, "-m", "src.daemon", "--serve", "--socket", path],
+                                   cwd=_PROJECT_FOLDER)
+        wait(path)
+    try:
+        warm = []
+        for _ in range(jobs):
+            start = time.perf_counter()
+            reply = submit([{"strategy": strategy, "dataname": os.path.abspath(dataname),
+                             "fromdate": FROMDATE, "todate": TODATE}], path)[0]
+            warm.append(time.perf_counter() - start)
+            if "error" in reply:
+                raise RuntimeError(reply["error"])
+        cold_runs = []
+        for _ in range(cold):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-m", "src.strategies", "--strategy", strategy,
+                            "--dataname", os.path.abspath(dataname)],
+                           check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                           cwd=_PROJECT_FOLDER)
+            cold_runs.append(time.perf_counter() - start)
+    finally:
+        if started is not None:
+            submit([{"cmd": "shutdown"}], path)
+            started.wait()
+    return {
+        name: {"median": float(np.median(seconds)), "min": float(np.min(seconds)),
+               "max": float(np.max(seconds)), "runs": len(seconds)}
+        for name, seconds in (("cold", cold_runs), ("daemon", warm))
+    }
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("--serve", action="store_true", help="Run the daemon")
+    parser.add_argument("--bench", action="store_true", help="Compare the daemon with cold runs")
+    parser.add_argument("--socket", default=SOCKET, type=str)
+    parser.add_argument("--strategy", type=str)
+    parser.add_argument("--dataname", type=str)
+    parser.add_argument("--params", default="{}", type=str, help="JSON strategy parameters")
+    parser.add_argument("--engine", default="cerebro", choices=["cerebro", "vectorized"])
+    parser.add_argument("--jobs", default=20, type=int)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.socket)
+    elif args.bench:
+        for name, stats in bench(args.strategy, args.dataname, args.jobs, path=args.socket).items():
+            print("%-6s median %8.3f s, min %8.3f s, max %8.3f s (%i runs)" % (
+                name, stats["median"], stats["min"], stats["max"], stats["runs"]
+            ))
+    else:
+        print(json.dumps(submit([{
+            "strategy": args.strategy, "dataname": os.path.abspath(args.dataname),
+            "params": json.loads(args.params), "engine": args.engine,
+        }], args.socket)[0]))
@@ -0,0 +1,152 @@
+"""Statistical factor model
+* Walk-forward principal component factor model of the Statistical Factor Model
+  notebook. For every day t the model is built on the daily returns of the
+  previous `lookback` - 1 days of the stocks without missing values, the stocks
+  are ranked by their expected return and the `topN` worst are shorted and the
+  best are bought.
+* The window sums, cross products and missing value counts are updated as the
+  window slides instead of re-slicing the window. Missing values are handled
+  with a mask, the window itself is never copied.
+"""
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from scipy.sparse.linalg import eigsh
+
+FactorModel = namedtuple("FactorModel", ["t", "hasData", "mean", "eigenvalues", "loadings"])
+
+
+def _top_eigen(cov:np.ndarray, k:int, v0:np.ndarray=None) -> tuple:
+    """Largest k eigenvalues (descending) and eigenvectors of a symmetric matrix.
+
+    The truncated Lanczos solver is warm started with `v0`, e.g. the first
+    eigenvector of the previous day. Small matrices are solved densely.
+    """
+    m = cov.shape[0]
+    if k + 1 >= m:
+        values, vectors = np.linalg.eigh(cov)
+        order = np.argsort(values)[::-1][:k]
+    else:
+        values, vectors = eigsh(cov, k=k, which="LA", v0=v0)
+        order = np.argsort(values)[::-1]
+    return values[order], vectors[:, order]
+
+
+def factor_models(dailyret, lookback:int=252, numFactors:int=5, refresh:int=252):
+    """Fit the principal component factor model of every backtest day.
+
+    Parameters
+    ----------
+    dailyret: pandas.DataFrame or numpy.ndarray
+        Daily returns, one row per day and one column per stock.
+    lookback: int
+        Lookback period. The model of day t uses the returns of the days
+        t - lookback + 1 to t - 1.
+    numFactors: int
+        Number of principal components.
+    refresh: int
+        Recompute the window sums from scratch every `refresh` days to stop
+        the rounding errors of the incremental updates from accumulating.
+
+    Yields
+    ------
+    FactorModel
+        Day t, positions of the stocks without missing values in the window,
+        their mean return, the eigenvalues of their return covariance and the
+        (stocks, numFactors) loadings.
+    """
+    R = np.asarray(dailyret, dtype=float)
+    missing = np.isnan(R)
+    filled = np.where(missing, 0.0, R)
+    n = lookback - 1
+    v0 = None
+    previous = None
+    for step, t in enumerate(range(lookback + 1, R.shape[0])):
+        lo, hi = t - lookback + 1, t
+        if step % refresh == 0:
+            window = filled[lo:hi]
+            sums = window.sum(axis=0)
+            gram = window.T @ window
+            nmissing = missing[lo:hi].sum(axis=0)
+        else:
+            new, old = filled[hi - 1], filled[lo - 1]
+            sums += new - old
+            gram += np.outer(new, new) - np.outer(old, old)
+            nmissing += missing[hi - 1].astype(int) - missing[lo - 1]
+        hasData = np.flatnonzero(nmissing == 0)
+        mean = sums[hasData] / n
+        cov = (gram[np.ix_(hasData, hasData)] - n * np.outer(mean, mean)) / (n - 1)
+        if previous is not None and v0 is not None:
+            # Warm start with yesterday's first eigenvector on today's stocks
+            v0 = np.zeros(hasData.shape[0])
+            _, today, yesterday = np.intersect1d(hasData, previous, return_indices=True)
+            v0[today] = first[yesterday]
+            if not v0.any():
+                v0 = None
+        eigenvalues, loadings = _top_eigen(cov, min(numFactors, hasData.shape[0]), v0)
+        first, previous, v0 = loadings[:, 0], hasData, loadings[:, 0]
+        yield FactorModel(t, hasData, mean, eigenvalues, loadings)
+
+
+def positions_table(dailyret, lookback:int=252, topN:int=50) -> np.ndarray:
+    """Positions of the notebook's principal component regression strategy.
+
+    The notebook regresses the returns of every stock on a constant and the
+    principal component scores of the window and sums the fitted returns. The
+    scores are centered and the constant is a regressor, so the summed fit of
+    a stock equals its summed return over the window, whatever the number of
+    factors. The expected returns are therefore the window sums, which are
+    updated as the window slides. The loadings of `factor_models` are not
+    needed and it is not called; use it where the factors themselves are
+    needed.
+
+    Like the notebook, the `topN` stocks with the lowest expected return are
+    shorted and the stocks ranked -topN to -2 are bought.
+
+    Parameters
+    ----------
+    dailyret: pandas.DataFrame or numpy.ndarray
+        Daily returns, one row per day and one column per stock.
+    lookback: int
+        Lookback period.
+    topN: int
+        Number of stocks to short.
+
+    Returns
+    -------
+    numpy.ndarray
+        Positions (-1, 0 or 1) with the shape of `dailyret`.
+    """
+    R = np.asarray(dailyret, dtype=float)
+    missing = np.isnan(R)
+    # Running sums with a leading zero row, window sum = csum[hi] - csum[lo]
+    csum = np.zeros((R.shape[0] + 1, R.shape[1]))
+    np.cumsum(np.where(missing, 0.0, R), axis=0, out=csum[1:])
+    cmissing = np.zeros((R.shape[0] + 1, R.shape[1]), dtype=int)
+    np.cumsum(missing, axis=0, out=cmissing[1:])
+    positionsTable = np.zeros(R.shape)
+    for t in range(lookback + 1, R.shape[0]):
+        lo, hi = t - lookback + 1, t
+        hasData = np.flatnonzero(cmissing[hi] - cmissing[lo] == 0)
+        Rexp = csum[hi, hasData] - csum[lo, hasData]
+        idxSort = Rexp.argsort()
+        positionsTable[t, hasData[idxSort[np.arange(0, topN)]]] = -1
+        positionsTable[t, hasData[idxSort[np.arange(-topN, -1)]]] = 1
+    return positionsTable
+
+
+def portfolio_returns(positionsTable:np.ndarray, dailyret) -> np.ndarray:
+    """Daily returns of the positions, computed as in the notebook.
+
+    The positions of the previous day are applied to the returns of the day and
+    the P&L is divided by the gross capital of the previous day.
+
+    Returns
+    -------
+    numpy.ndarray
+    """
+    positions = np.array(positionsTable, dtype=float)
+    capital = np.nansum(np.abs(pd.DataFrame(positions).shift().values), axis=1)
+    positions[capital == 0, ] = 0
+    capital[capital == 0] = 1
+    return np.nansum(pd.DataFrame(positions).shift().values * np.asarray(dailyret), axis=1) / capital
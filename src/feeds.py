@@ -0,0 +1,416 @@
+"""Data feeds
+* Helpers to load the YahooFinance csv files used by the backtests.
+* The csv files are parsed once and compiled into NumPy arrays next to the file
+  (in a '.feedcache' folder). The compiled arrays are memory mapped by the later
+  loads and invalidated when the size, modification time and content hash of
+  the csv file change.
+* ArrayData hands the compiled arrays to backtrader without parsing any line.
+* load_panel aligns several datas on one date index as compact float32 column
+  arrays, which ArrayData delivers bar by bar for multi-asset backtests.
+"""
+from argparse import ArgumentParser
+from array import array
+from datetime import datetime
+import functools
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import backtrader as bt
+
+# Backtrader stamps daily bars with the end of the session.
+_SESSION_END = pd.Timedelta(
+    hours=23, minutes=59, seconds=59, microseconds=999990
+)
+# Interval at the end of the file names of utils.download_yf, e.g. '_5m.csv'
+_INTERVAL = re.compile(r"_(\d+)(m|h|d|wk|mo)\.csv$")
+# Column names of the loaded OHLCV frame.
+OHLCV = ["open", "high", "low", "close", "volume"]
+# Folder of the compiled arrays, relative to the folder of the csv file.
+CACHE_FOLDER = ".feedcache"
+# Backtrader date number (days since 0001-01-01, plus 1) of 1970-01-01
+_EPOCH_DATENUM = 719163.0
+_NS_PER_DAY = 86400e9
+
+
+def file_timeframe(filepath:str) -> tuple:
+    """Backtrader timeframe and compression of a csv file named like the files
+    of `utils.download_yf`, e.g. (bt.TimeFrame.Minutes, 5) of
+    'spy_20230501_20230526_5m.csv'. Days for the other file names."""
+    match = _INTERVAL.search(os.path.basename(filepath))
+    if match is None:
+        return bt.TimeFrame.Days, 1
+    n, unit = int(match.group(1)), match.group(2)
+    return {
+        "m": (bt.TimeFrame.Minutes, n),
+        "h": (bt.TimeFrame.Minutes, 60 * n),
+        "d": (bt.TimeFrame.Days, n),
+        "wk": (bt.TimeFrame.Weeks, n),
+        "mo": (bt.TimeFrame.Months, n),
+    }[unit]
+
+
+def _is_daily(filepath:str) -> bool:
+    return file_timeframe(filepath)[0] >= bt.TimeFrame.Days
+
+
+def _parse_yahoo_csv(filepath:str, daily:bool=True) -> tuple:
+    """Parse a YahooFinance csv file.
+
+    Parameters
+    ----------
+    filepath: str
+        Path of the csv file.
+    daily: bool
+        Daily or longer bars, which are stamped with the end of the session.
+        Intraday bars keep their time.
+
+    Returns
+    -------
+    tuple
+        (index, values) where index is an int64 array of the bar datetimes in
+        nanoseconds and values is a float64 (rows, 5) OHLCV array.
+    """
+    df = pd.read_csv(filepath, usecols=range(6))
+    df.columns = ["datetime"] + OHLCV
+    stamps = df["datetime"].astype(str)
+    # Local wall clock time, e.g. '2021-05-27 00:00:00' of '2021-05-27 00:00:00-04:00'
+    wall = pd.to_datetime(stamps.str.slice(0, 19), format="%Y-%m-%d %H:%M:%S")
+    utc = pd.to_datetime(stamps, utc=True, format="%Y-%m-%d %H:%M:%S%z").dt.tz_localize(None)
+    values = np.ascontiguousarray(df.loc[:, OHLCV].values, dtype=float)
+    return _stamp(wall, utc, daily), values
+
+
+def _stamp(wall, utc, daily:bool=True) -> np.ndarray:
+    """Backtrader datetimes in nanoseconds of bars with the given local wall
+    clock and UTC naive times: daily bars are moved to the end of the session,
+    intraday bars are UTC naive."""
+    wall = pd.DatetimeIndex(wall)
+    utc = pd.DatetimeIndex(utc)
+    if not daily:
+        return np.asarray(utc).astype("datetime64[ns]").view("int64")
+    eos = wall.normalize() + _SESSION_END
+    return np.asarray(eos.where(eos > utc, utc)).astype("datetime64[ns]").view("int64")
+
+
+def _sha1(filepath:str) -> str:
+    digest = hashlib.sha1()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def compile_yahoo_csv(filepath:str, cachedir:str=None, daily:bool=None) -> tuple:
+    """Return the arrays of a YahooFinance csv file, compiling them if needed.
+
+    Parameters
+    ----------
+    filepath: str
+        Path of the csv file.
+    cachedir: str
+        Folder of the compiled arrays. Defaults to a '.feedcache' folder next
+        to the csv file.
+    daily: bool
+        Stamp the bars as daily bars, see `_parse_yahoo_csv`. Defaults to the
+        interval in the file name, see `file_timeframe`.
+
+    Returns
+    -------
+    tuple
+        Memory mapped (index, values) arrays, see `_parse_yahoo_csv`.
+    """
+    daily = _is_daily(filepath) if daily is None else daily
+    cachedir = cachedir or os.path.join(os.path.dirname(os.path.abspath(filepath)), CACHE_FOLDER)
+    base = os.path.join(cachedir, os.path.basename(filepath) + ("" if daily else ".intraday"))
+    stat = os.stat(filepath)
+    meta = None
+    if os.path.exists(base + ".json"):
+        with open(base + ".json") as f:
+            meta = json.load(f)
+    if meta is not None and (meta["size"], meta["mtime_ns"]) != (stat.st_size, stat.st_mtime_ns):
+        # Touched or rewritten, compare the content.
+        sha1 = _sha1(filepath)
+        if sha1 != meta["sha1"]:
+            meta = None
+        else:
+            meta.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+            with open(base + ".json", "w") as f:
+                json.dump(meta, f)
+    if meta is None:
+        os.makedirs(cachedir, exist_ok=True)
+        index, values = _parse_yahoo_csv(filepath, daily)
+        np.save(base + ".index.npy", index)
+        np.save(base + ".values.npy", values)
+        meta = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha1": _sha1(filepath)}
+        with open(base + ".json", "w") as f:
+            json.dump(meta, f)
+    return (np.load(base + ".index.npy", mmap_mode="r"),
+            np.load(base + ".values.npy", mmap_mode="r"))
+
+
+def load_yahoo_csv(filepath:str, fromdate:datetime=None, todate:datetime=None,
+                   cache:bool=True, daily:bool=None) -> pd.DataFrame:
+    """Load a YahooFinance csv file written by `utils.download_yf`.
+
+    The bars are stamped the same way `bt.feeds.GenericCSVData` stamps them in
+    `strategies.run`, i.e. daily bars are moved to the end of the session of
+    their local date and all timestamps are UTC naive, so the `fromdate` and
+    `todate` filters select exactly the bars that backtrader would.
+
+    Parameters
+    ----------
+    filepath: str
+        Path of the csv file.
+    fromdate: datetime
+        Drop bars before this datetime. If not specified then no bar is dropped.
+    todate: datetime
+        Drop bars after this datetime. If not specified then no bar is dropped.
+    cache: bool
+        Use the compiled arrays of `compile_yahoo_csv` instead of parsing the file.
+    daily: bool
+        Stamp the bars as daily bars. Defaults to the interval in the file
+        name, see `file_timeframe`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns open, high, low, close and volume indexed by the bar datetime.
+    """
+    daily = _is_daily(filepath) if daily is None else daily
+    index, values = compile_yahoo_csv(filepath, daily=daily) if cache else _parse_yahoo_csv(filepath, daily)
+    first, last = bar_window(index, fromdate, todate)
+    return pd.DataFrame(
+        np.asarray(values[first:last]),
+        index=pd.DatetimeIndex(np.asarray(index[first:last]).view("datetime64[ns]"), name="datetime"),
+        columns=OHLCV
+    )
+
+
+def bar_window(index:np.ndarray, fromdate:datetime=None, todate:datetime=None) -> tuple:
+    """First and last (exclusive) positions of the bars between two datetimes.
+
+    Like backtrader, bars before `fromdate` are skipped and the data ends at the
+    first bar after `todate`.
+    """
+    index = np.asarray(index)
+    if index.shape[0] == 0:
+        return 0, 0
+    first, last = 0, index.shape[0]
+    if todate is not None:
+        after = index > pd.Timestamp(todate).value
+        if after.any():
+            last = int(after.argmax())
+    if fromdate is not None:
+        before = index[:last] < pd.Timestamp(fromdate).value
+        first = int(before.argmin()) if not before.all() else last
+    return first, last
+
+
+def load_panel(datanames, fromdate:datetime=None, todate:datetime=None, join:str="inner",
+               dtype=np.float32, cachedir:str=None) -> tuple:
+    """Load several datas as one panel of column arrays sharing one date index.
+
+    Parameters
+    ----------
+    datanames: list or pandas.DataFrame
+        Paths of YahooFinance csv files, or a frame with (ticker, column)
+        columns as returned by `utils.download_many`.
+    fromdate: datetime
+        Drop bars before this datetime. If not specified then no bar is dropped.
+    todate: datetime
+        Drop bars after this datetime. If not specified then no bar is dropped.
+    join: str
+        'inner' keeps the bars of all datas, 'outer' keeps the bars of any data
+        and the missing bars are NaN.
+    dtype: numpy.dtype
+        Type of the values. float32 takes half the memory of float64 and keeps
+        about 7 significant digits of the prices.
+    cachedir: str
+        Folder of the compiled arrays of the csv files, see `compile_yahoo_csv`.
+
+    Returns
+    -------
+    tuple
+        (names, index, values) where names are the file names or tickers,
+        index is the int64 array of the bar datetimes in nanoseconds and values
+        is a (datas, 5, bars) OHLCV array, so every column of a data is
+        contiguous. `values[i].T` is the (bars, 5) array of the i-th data,
+        e.g. for `ArrayData(dataname=(index, values[i].T))`.
+    """
+    if isinstance(datanames, pd.DataFrame):
+        names = list(datanames.columns.get_level_values(0).unique())
+        datas = []
+        for name in names:
+            df = datanames[name].dropna(subset=["Close"])
+            stamps = df.index
+            if stamps.tz is None:
+                index = _stamp(stamps, stamps)
+            else:
+                index = _stamp(stamps.tz_localize(None), stamps.tz_convert("UTC").tz_localize(None))
+            datas.append((index, df.loc[:, ["Open", "High", "Low", "Close", "Volume"]].values))
+    else:
+        names = [os.path.basename(path) for path in datanames]
+        datas = [compile_yahoo_csv(path, cachedir) for path in datanames]
+    if len(datas) == 0:
+        raise ValueError("No data to load")
+    if join == "inner":
+        index = functools.reduce(np.intersect1d, [np.asarray(i) for i, _ in datas])
+    elif join == "outer":
+        index = functools.reduce(np.union1d, [np.asarray(i) for i, _ in datas])
+    else:
+        raise ValueError("Unknown join %s, expected 'inner' or 'outer'" % join)
+    first, last = bar_window(index, fromdate, todate)
+    index = index[first:last]
+    values = np.full((len(datas), len(OHLCV), index.shape[0]), np.nan, dtype=dtype)
+    for panel, (own, own_values) in zip(values, datas):
+        own = np.asarray(own)
+        position = np.searchsorted(index, own).clip(max=max(index.shape[0] - 1, 0))
+        found = index[position] == own if index.shape[0] else np.zeros(own.shape, dtype=bool)
+        panel[:, position[found]] = np.asarray(own_values)[found].T
+    return names, index, values
+
+
+class ArrayData(bt.feed.DataBase):
+    """Data feed of OHLCV arrays.
+
+    The `dataname` is either the path of a YahooFinance csv file, which is
+    compiled with `compile_yahoo_csv` (pass the `timeframe` and `compression`
+    of intraday files, see `file_timeframe`), a frame as returned by
+    `load_yahoo_csv` or an (index, values) tuple of an int64 nanosecond index
+    and a (bars, 5) OHLCV array, e.g. a data of `load_panel`. When preloading
+    the lines are filled with whole arrays, otherwise one bar is copied per
+    call of `_load`, so the arrays keep their dtype. Bars outside of
+    `fromdate` and `todate` are dropped like in `bt.feeds.GenericCSVData`.
+    """
+    params = (
+        # Folder of the compiled arrays (see compile_yahoo_csv)
+        ('cachedir', None),
+        # Frame of `load_yahoo_csv` the dataname is a window of, e.g. the whole
+        # series of a walk-forward. The cached indicators (see indicator_cache)
+        # are computed on the history and shared by all its windows.
+        ('history', None),
+    )
+
+    def start(self):
+        super(ArrayData, self).start()
+        if isinstance(self.p.dataname, pd.DataFrame):
+            df = self.p.dataname
+            index = df.index.values.astype("datetime64[ns]").view("int64")
+            values = df.loc[:, OHLCV].values
+        elif isinstance(self.p.dataname, tuple):
+            index, values = self.p.dataname
+        else:
+            index, values = compile_yahoo_csv(self.p.dataname, self.p.cachedir,
+                                              daily=self.p.timeframe >= bt.TimeFrame.Days)
+        self._index = index
+        self._values = values
+        self._columns = None
+        self._bar = 0
+
+    def _select(self) -> None:
+        """Select the bars of the date range and convert them to line values."""
+        first, last = bar_window(self._index, self.p.fromdate, self.p.todate)
+        self._first = first
+        index = np.asarray(self._index[first:last])
+        values = np.asarray(self._values[first:last])
+        n = index.shape[0]
+        columns = {
+            "datetime": index / _NS_PER_DAY + _EPOCH_DATENUM,
+            "openinterest": np.broadcast_to(np.nan, (n,)),
+        }
+        for i, name in enumerate(OHLCV):
+            columns[name] = values[:, i]
+        self._columns = [(getattr(self.lines, name), columns[name])
+                         for name in self.getlinealiases()]
+
+    def history_window(self) -> tuple:
+        """(history, position of the first bar of the data in the history),
+        None without history."""
+        if self.p.history is None or self._columns is None or self._columns[0][1].shape[0] == 0:
+            return None
+        history = self.p.history.index.values.astype("datetime64[ns]").view("int64")
+        return self.p.history, int(np.searchsorted(history, self._index[self._first]))
+
+    def preload(self):
+        if self._filters or self._ffilters:
+            # Filters need the bars one by one.
+            return super(ArrayData, self).preload()
+        self._select()
+        for line, values in self._columns:
+            line.array.extend(array("d", np.ascontiguousarray(values, dtype=float).tobytes()))
+        # All bars are loaded, _load must not deliver them again.
+        self._bar = self._columns[0][1].shape[0]
+        self._last()
+        self.home()
+
+    def _load(self):
+        if self._columns is None:
+            self._select()
+        if self._bar >= self._columns[0][1].shape[0]:
+            return False
+        for line, values in self._columns:
+            # float64 like the preloaded values, the line may be a plain deque
+            line[0] = float(values[self._bar])
+        self._bar += 1
+        return True
+
+
+def benchmark(rows:int=2000000) -> dict:
+    """Compare the time to preload a synthetic YahooFinance csv file with
+    GenericCSVData, with ArrayData compiling the file and with ArrayData using
+    the compiled arrays.
+
+    Parameters
+    ----------
+    rows: int
+        Number of minute bars in the synthetic file.
+
+    Returns
+    -------
+    dict
+        Seconds per method.
+    """
+    rng = np.random.default_rng(0)
+    stamps = pd.date_range("2010-01-04 09:30", periods=rows, freq="min", tz="America/New_York")
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 1e-3, rows)))
+    df = pd.DataFrame({
+        "Open": close, "High": close * 1.001, "Low": close * 0.999, "Close": close,
+        "Volume": rng.integers(100, 10000, rows), "Dividends": 0.0, "Stock Splits": 0.0,
+    }, index=pd.DatetimeIndex(stamps, name="Datetime"))
+    timings = {}
+    with tempfile.TemporaryDirectory() as folder:
+        filepath = os.path.join(folder, "synthetic_1m.csv")
+        df.to_csv(filepath)
+
+        def load(data):
+            # Time the preloading only, not the event loop of Cerebro.
+            bt.Cerebro().adddata(data)
+            start = time.perf_counter()
+            data._start()
+            data.preload()
+            return time.perf_counter() - start
+
+        # Minute bars keep their time.
+        timeframe, compression = file_timeframe(filepath)
+        timings["GenericCSVData"] = load(bt.feeds.GenericCSVData(
+            dataname=filepath, dtformat='%Y-%m-%d %H:%M:%S%z', datetime=0, time=-1,
+            open=1, high=2, low=3, close=4, volume=5, openinterest=-1,
+            timeframe=timeframe, compression=compression
+        ))
+        for method in ["ArrayData (compile)", "ArrayData (cached)"]:
+            timings[method] = load(ArrayData(dataname=filepath, timeframe=timeframe,
+                                             compression=compression))
+    return timings
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("--rows", default=2000000, type=int)
+    args = parser.parse_args()
+    for method, seconds in benchmark(args.rows).items():
+        print("%-20s %8.2f s" % (method, seconds))
@@ -0,0 +1,262 @@
+"""Indicator cache
+* Memoize indicator series by (data fingerprint, indicator, parameters), so an
+  indicator is computed once per dataset instead of once per backtest, e.g. the
+  SMA of MaStrategy across a sweep of other parameters or the KDJ lines of a
+  ticker that is backtested again.
+* The series are computed with the array functions of `vectorized.py`, which
+  reproduce the backtrader indicators, and handed to the strategy as
+  `Precomputed` indicators.
+* Least recently used series are evicted above a memory budget. With a folder
+  the series are also written as .npy files and memory mapped, so the worker
+  processes of a sweep share them.
+* The indicators of an `ArrayData` window of a longer history, e.g. a fold of
+  a walk-forward, are computed on the history and sliced, so the rolling
+  windows are computed once for all the folds.
+* The cache is off unless `configure` is called, and only preloaded datas are
+  cached.
+"""
+from array import array
+from collections import OrderedDict
+import hashlib
+import os
+import numpy as np
+import backtrader as bt
+
+from src import vectorized
+from src.feeds import ArrayData
+
+# Cache used by the strategies, set by configure
+_CACHE = None
+
+
+class IndicatorCache:
+    """LRU cache of indicator series.
+
+    Parameters
+    ----------
+    folder: str
+        Folder of the memory mapped series, shared by the processes using the
+        same folder. The series are kept in memory only if not specified.
+    budget: int
+        Bytes of series kept by the process. The folder is trimmed to the
+        same size.
+    """
+    def __init__(self, folder:str=None, budget:int=256 * 2 ** 20):
+        self.folder = folder
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if folder is not None:
+            os.makedirs(folder, exist_ok=True)
+
+    def _path(self, key:tuple) -> str:
+        return os.path.join(self.folder, "%s.npy" % hashlib.sha1(repr(key).encode()).hexdigest())
+
+    def get(self, key:tuple, compute) -> np.ndarray:
+        """Return the series of a key, calling `compute` on a miss.
+
+        Parameters
+        ----------
+        key: tuple
+            (data fingerprint, indicator name, parameters...).
+        compute: callable
+            Function without arguments returning the (lines, bars) array of
+            the indicator.
+
+        Returns
+        -------
+        numpy.ndarray
+            Read only (lines, bars) array.
+        """
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        path = self._path(key) if self.folder is not None else None
+        if path is not None and os.path.exists(path):
+            # Computed by another process
+            self.hits += 1
+            os.utime(path)
+            values = np.load(path, mmap_mode="r")
+        else:
+            self.misses += 1
+            values = np.ascontiguousarray(compute(), dtype=float)
+            if path is not None:
+                tmp = "%s.%i.tmp" % (path, os.getpid())
+                with open(tmp, "wb") as f:
+                    np.save(f, values)
+                os.replace(tmp, path)
+                self._trim_folder()
+                values = np.load(path, mmap_mode="r")
+            else:
+                values.setflags(write=False)
+        self.entries[key] = values
+        self.nbytes += values.nbytes
+        while self.nbytes > self.budget and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+            self.evictions += 1
+        return values
+
+    def _trim_folder(self) -> None:
+        """Delete the least recently used files above the budget."""
+        files = []
+        for name in os.listdir(self.folder):
+            if name.endswith(".npy"):
+                stat = os.stat(os.path.join(self.folder, name))
+                files.append((stat.st_mtime_ns, stat.st_size, name))
+        total = sum(size for _, size, _ in files)
+        # Keep the newest file, i.e. the one just written.
+        for _, size, name in sorted(files)[:-1]:
+            if total <= self.budget:
+                break
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except FileNotFoundError:
+                # Deleted by another process
+                pass
+            total -= size
+
+    def stats(self) -> dict:
+        """Hit, miss and eviction counters and the bytes in memory."""
+        return {"hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "nbytes": self.nbytes}
+
+
+def configure(folder:str=None, budget:int=256 * 2 ** 20) -> IndicatorCache:
+    """Turn the indicator cache of the strategies on, see `IndicatorCache`."""
+    cache = IndicatorCache(folder, budget)
+    set_cache(cache)
+    return cache
+
+
+def get_cache() -> IndicatorCache:
+    """The cache of the strategies, None when it is off."""
+    return _CACHE
+
+
+def set_cache(cache:IndicatorCache) -> IndicatorCache:
+    """Replace the cache of the strategies, None turns it off.
+
+    Returns
+    -------
+    IndicatorCache
+        The previous cache.
+    """
+    global _CACHE
+    previous, _CACHE = _CACHE, cache
+    return previous
+
+
+def fingerprint(line) -> str:
+    """SHA1 of the values of a preloaded data line."""
+    return _digest(np.frombuffer(line.array, dtype=float))
+
+
+def _digest(values:np.ndarray) -> str:
+    return hashlib.sha1(np.ascontiguousarray(values, dtype=float).tobytes()).hexdigest()
+
+
+def cacheable(data) -> bool:
+    """Whether the indicators of a data can be cached, i.e. the cache is on
+    and the data is preloaded."""
+    return _CACHE is not None and data.buflen() > 0
+
+
+class Precomputed(bt.Indicator):
+    """Indicator copying a precomputed series into its line."""
+    lines = ('value',)
+    params = (
+        # Series with one value per bar of the data
+        ('values', None),
+        # Bars before the first value
+        ('minperiod', 1),
+    )
+
+    def __init__(self):
+        self.addminperiod(self.p.minperiod)
+
+    def next(self):
+        self.lines.value[0] = self.p.values[len(self) - 1]
+
+    def once(self, start, end):
+        self.lines.value.array[start:end] = array("d", np.asarray(self.p.values[start:end]).tobytes())
+
+
+def _line(data, line:str) -> np.ndarray:
+    return np.frombuffer(getattr(data, line).array, dtype=float)
+
+
+def _source(data, line:str) -> tuple:
+    """Series the indicators of a data line are computed on.
+
+    Returns
+    -------
+    tuple
+        (values, fingerprint, position of the first bar of the data in the
+        values). The values of the history of an `ArrayData` window, so the
+        indicators are computed once for all the windows, otherwise the line.
+    """
+    window = data.history_window() if isinstance(data, ArrayData) else None
+    if window is None:
+        return _line(data, line), fingerprint(getattr(data, line)), 0
+    history, offset = window
+    values = np.ascontiguousarray(history[line].values, dtype=float)
+    return values, _digest(values), offset
+
+
+def _slice(series:np.ndarray, offset:int, bars:int, period:int) -> np.ndarray:
+    """Values of the bars of a window of a rolling `period` series. The first
+    `period` - 1 values are NaN, as if the series were computed on the window."""
+    if offset == 0 and series.shape[0] == bars:
+        return series
+    out = np.array(series[offset:offset + bars])
+    out[:period - 1] = np.nan
+    return out
+
+
+def sma(data, period:int) -> Precomputed:
+    """Cached `bt.indicators.MovingAverageSimple` of the close."""
+    close, key, offset = _source(data, "close")
+    values = _CACHE.get((key, "SMA", period), lambda: vectorized.sma(close, period)[None])
+    values = _slice(values[0], offset, data.buflen(), period)
+    return Precomputed(data, values=values, minperiod=period, plotname="SMA(%i)" % period)
+
+
+def kdj(data, period:int=9, period_k:int=3, period_d:int=3) -> tuple:
+    """Cached K, D and J lines of `KDJStrategy`. The highest high and lowest
+    low are cached on their own, so they are shared by the KDJ lines of every
+    `period_k` and `period_d`.
+
+    Returns
+    -------
+    tuple
+        (K, D, J) indicators.
+    """
+    high, high_key, offset = _source(data, "high")
+    low, low_key, _ = _source(data, "low")
+    close, close_key, _ = _source(data, "close")
+    bars = data.buflen()
+
+    def compute():
+        high_n = _CACHE.get((high_key, "Highest", period),
+                            lambda: vectorized.rolling_max(high, period)[None])
+        low_n = _CACHE.get((low_key, "Lowest", period),
+                           lambda: vectorized.rolling_min(low, period)[None])
+        # The smoothing of K and D starts at the first bar of the window.
+        return np.stack(vectorized.kdj_from_range(
+            _slice(high_n[0], offset, bars, period), _slice(low_n[0], offset, bars, period),
+            close[offset:offset + bars], period_k=period_k, period_d=period_d
+        ))
+
+    values = _CACHE.get((high_key, low_key, close_key, "KDJ", period, period_k, period_d,
+                         offset, bars), compute)
+    # The EMA of K starts after the range, the EMA of D after K.
+    minperiod = period + period_k - 1
+    K = Precomputed(data, values=values[0], minperiod=minperiod, plotname="K")
+    D = Precomputed(data, values=values[1], minperiod=minperiod + period_d - 1, plotname="D")
+    J = Precomputed(data, values=values[2], minperiod=minperiod + period_d - 1, plotname="J")
+    return K, D, J
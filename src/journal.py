@@ -0,0 +1,159 @@
+"""Trade journal
+* Records the orders, fills and trades of a strategy into a preallocated NumPy
+  ring buffer and writes them to a JSON lines file in batches, instead of
+  formatting a log line per event.
+* A strategy without a journal records nothing, so a disabled journal costs a
+  single `is None` check per order notification.
+"""
+from argparse import ArgumentParser
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import backtrader as bt
+
+# Event kinds
+CREATED, FILLED, REJECTED, CLOSED = range(4)
+KINDS = ["created", "filled", "rejected", "closed"]
+
+EVENT = np.dtype([
+    ("kind", "u1"),
+    # Bar number, i.e. len(strategy). The bar the order was created at for
+    # the created events.
+    ("bar", "i8"),
+    # Backtrader date number of the bar, a datetime in `to_frame`
+    ("datetime", "f8"),
+    # 1 for buy, -1 for sell
+    ("side", "i1"),
+    ("price", "f8"),
+    ("size", "f8"),
+    ("value", "f8"),
+    ("comm", "f8"),
+    ("pnl", "f8"),
+    ("pnlcomm", "f8"),
+])
+
+
+class Journal:
+    """Array backed event recorder.
+
+    Parameters
+    ----------
+    path: str
+        JSON lines file the events are appended to. If not specified then only
+        the last `capacity` events are kept in memory.
+    capacity: int
+        Number of events in the ring buffer. When the buffer is full the events
+        are written to `path`, or the oldest events are overwritten.
+    """
+    def __init__(self, path:str=None, capacity:int=4096):
+        self.path = path
+        self.buffer = np.zeros(capacity, dtype=EVENT)
+        self.capacity = capacity
+        # Number of recorded events and number of events written to path
+        self.count = 0
+        self.flushed = 0
+
+    def record(self, kind:int, bar:int, dt:float, side:int, price:float=np.nan,
+               size:float=np.nan, value:float=np.nan, comm:float=np.nan,
+               pnl:float=np.nan, pnlcomm:float=np.nan) -> None:
+        """Record one event."""
+        if self.path is not None and self.count - self.flushed == self.capacity:
+            self.flush()
+        self.buffer[self.count % self.capacity] = (
+            kind, bar, dt, side, price, size, value, comm, pnl, pnlcomm
+        )
+        self.count += 1
+
+    def order(self, strategy, order) -> None:
+        """Record an order notification of a strategy."""
+        side = 1 if order.isbuy() else -1
+        if order.status == order.Submitted:
+            # Submitted is notified at the next bar, plen is the length of the
+            # data when the order was created.
+            self.record(CREATED, order.plen, order.created.dt, side,
+                        order.created.price, order.created.size)
+        elif order.status == order.Completed:
+            self.record(FILLED, len(strategy), strategy.datetime[0], side,
+                        order.executed.price, order.executed.size,
+                        order.executed.value, order.executed.comm)
+        elif order.status in [order.Canceled, order.Margin, order.Rejected]:
+            self.record(REJECTED, len(strategy), strategy.datetime[0], side,
+                        order.created.price, order.created.size)
+
+    def trade(self, strategy, trade) -> None:
+        """Record a closed trade of a strategy."""
+        # The size and value of a closed trade are 0, record the entry price.
+        self.record(CLOSED, len(strategy), strategy.datetime[0], 1 if trade.long else -1,
+                    trade.price, comm=trade.commission, pnl=trade.pnl, pnlcomm=trade.pnlcomm)
+
+    def _pending(self) -> np.ndarray:
+        """Events in the buffer that are not written yet, oldest first."""
+        first = max(self.flushed, self.count - self.capacity)
+        positions = np.arange(first, self.count) % self.capacity
+        return self.buffer[positions]
+
+    def to_frame(self) -> pd.DataFrame:
+        """Events in the buffer that are not written yet as a frame."""
+        df = pd.DataFrame(self._pending())
+        df["kind"] = pd.Categorical.from_codes(df["kind"], KINDS)
+        df["datetime"] = [bt.num2date(dt) for dt in df["datetime"]]
+        return df
+
+    def flush(self) -> None:
+        """Append the events in the buffer to the JSON lines file."""
+        if self.path is None or self.count == self.flushed:
+            return
+        lines = self.to_frame().to_json(orient="records", lines=True, date_format="iso",
+                                        date_unit="us")
+        with open(self.path, "a") as f:
+            f.write(lines if lines.endswith("\n") else lines + "\n")
+        self.flushed = self.count
+
+
+def benchmark(rows:int=200000) -> dict:
+    """Compare the bars per second of the strategies with the journal on and off.
+
+    Parameters
+    ----------
+    rows: int
+        Number of bars in the synthetic data.
+
+    Returns
+    -------
+    dict
+        Bars per second per (strategy, journal) combination.
+    """
+    from src import strategies
+    from src.feeds import ArrayData
+
+    rng = np.random.default_rng(0)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 1e-2, rows)))
+    df = pd.DataFrame({
+        "open": close * np.exp(rng.normal(0, 5e-3, rows)), "high": close * 1.01,
+        "low": close * 0.99, "close": close, "volume": 1e6,
+    }, index=pd.date_range("2000-01-01", periods=rows, freq="min", name="datetime"))
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for strategy in [strategies.TestStrategy, strategies.MaStrategy, strategies.KDJStrategy]:
+            for journal in [None, os.path.join(folder, "%s.jsonl" % strategy.__name__)]:
+                cerebro = bt.Cerebro(stdstats=False)
+                cerebro.addstrategy(strategy, printlog=False, journal=journal)
+                cerebro.adddata(ArrayData(dataname=df))
+                start = time.perf_counter()
+                cerebro.run()
+                label = "on" if journal else "off"
+                results[(strategy.__name__, label)] = rows / (time.perf_counter() - start)
+    return results
+
+
+if __name__ == '__main__':
+    # The project folder, for the src imports of `python src/journal.py`
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    parser = ArgumentParser()
+    parser.add_argument("--rows", default=200000, type=int)
+    args = parser.parse_args()
+    for (strategy, journal), speed in benchmark(args.rows).items():
+        print("%-14s journal %-3s %10.0f bars/s" % (strategy, journal, speed))
@@ -0,0 +1,262 @@
+"""Kelly allocation
+* Rolling version of the Kelly formula notebook, F = C⁻¹ M, where M and C are
+  the mean and covariance of the excess returns.
+* The window sums and cross products are updated with every bar in O(N²)
+  instead of recomputing the covariance of the whole window.
+* The fractions are solved with a Cholesky factorization of the (optionally
+  shrunk) covariance instead of an explicit inverse, and can be capped to a
+  maximum leverage.
+* KellySizer sizes the orders of a backtrader strategy with the fractions.
+"""
+import numpy as np
+import pandas as pd
+from scipy.linalg import LinAlgError, cho_factor, cho_solve
+import backtrader as bt
+
+from src.analytics import TRADING_DAYS
+
+
+class RollingMoments:
+    """Mean and covariance of the last `window` rows of a stream of vectors.
+
+    Parameters
+    ----------
+    n: int
+        Length of the vectors, e.g. the number of assets.
+    window: int
+        Number of rows in the window.
+    refresh: int
+        Recompute the sums from the window every `refresh` rows to stop the
+        rounding errors of the incremental updates from accumulating. Defaults
+        to `window`.
+    """
+    def __init__(self, n:int, window:int, refresh:int=None):
+        self.window = window
+        self.refresh = refresh or window
+        self.buffer = np.zeros((window, n))
+        self.sums = np.zeros(n)
+        self.gram = np.zeros((n, n))
+        self.count = 0
+
+    @property
+    def nobs(self) -> int:
+        """Number of rows in the window."""
+        return min(self.count, self.window)
+
+    def update(self, x:np.ndarray) -> None:
+        """Add a row to the window, dropping the oldest one when it is full."""
+        row = self.count % self.window
+        if self.count >= self.window:
+            old = self.buffer[row]
+            self.sums -= old
+            self.gram -= np.outer(old, old)
+        self.buffer[row] = x
+        self.count += 1
+        if self.count % self.refresh == 0:
+            window = self.buffer[:self.nobs]
+            self.sums = window.sum(axis=0)
+            self.gram = window.T @ window
+        else:
+            self.sums += self.buffer[row]
+            self.gram += np.outer(self.buffer[row], self.buffer[row])
+
+    def mean(self) -> np.ndarray:
+        return self.sums / self.nobs
+
+    def cov(self) -> np.ndarray:
+        """Sample covariance (ddof=1), like `pandas.DataFrame.cov`."""
+        n = self.nobs
+        mean = self.sums / n
+        return (self.gram - n * np.outer(mean, mean)) / (n - 1)
+
+
+def kelly_fractions(mean:np.ndarray, cov:np.ndarray, shrinkage:float=0.0,
+                    max_leverage:float=None) -> np.ndarray:
+    """Kelly fractions C⁻¹ M.
+
+    Parameters
+    ----------
+    mean: numpy.ndarray
+        Mean excess returns M.
+    cov: numpy.ndarray
+        Covariance of the returns C.
+    shrinkage: float
+        Weight of the diagonal of C in the shrunk covariance
+        (1 - shrinkage) * C + shrinkage * diag(C). 0 solves with C itself.
+    max_leverage: float
+        Scale the fractions down so that the sum of their absolute values is at
+        most `max_leverage`. Not capped if not specified.
+
+    Returns
+    -------
+    numpy.ndarray
+    """
+    if shrinkage:
+        cov = (1 - shrinkage) * cov + shrinkage * np.diag(np.diag(cov))
+    try:
+        F = cho_solve(cho_factor(cov), mean)
+    except LinAlgError:
+        # Singular covariance, e.g. duplicated assets.
+        F = np.linalg.lstsq(cov, mean, rcond=None)[0]
+    if max_leverage is not None:
+        leverage = np.abs(F).sum()
+        if leverage > max_leverage:
+            F = F * (max_leverage / leverage)
+    return F
+
+
+class KellyAllocator:
+    """Rolling Kelly fractions of a stream of daily returns.
+
+    Parameters
+    ----------
+    n: int
+        Number of assets.
+    window: int
+        Number of daily returns the mean and covariance are estimated on.
+    minperiod: int
+        Number of daily returns before the first fractions. Defaults to `window`.
+    riskfree: float
+        Annual risk free rate. The notebook assumes 4%.
+    shrinkage: float
+        Covariance shrinkage, see `kelly_fractions`.
+    max_leverage: float
+        Leverage cap, see `kelly_fractions`.
+    fraction: float
+        Multiplier of the fractions, e.g. 0.5 for half Kelly.
+    """
+    def __init__(self, n:int, window:int=252, minperiod:int=None, riskfree:float=0.04,
+                 shrinkage:float=0.0, max_leverage:float=None, fraction:float=1.0):
+        self.moments = RollingMoments(n, window)
+        self.minperiod = max(minperiod or window, 2)
+        self.riskfree = riskfree
+        self.shrinkage = shrinkage
+        self.max_leverage = max_leverage
+        self.fraction = fraction
+
+    def update(self, returns:np.ndarray) -> None:
+        """Add the daily returns of one day. Days with a missing return are skipped."""
+        returns = np.asarray(returns, dtype=float)
+        if not np.isnan(returns).any():
+            self.moments.update(returns)
+
+    def fractions(self) -> np.ndarray:
+        """Kelly fractions of the current window, None before `minperiod` returns.
+
+        The annualization of M and C in the notebook cancels out, so the
+        fractions are computed from the daily moments.
+        """
+        if self.moments.nobs < self.minperiod:
+            return None
+        mean = self.moments.mean() - self.riskfree / TRADING_DAYS
+        # The fractions are linear in M.
+        return kelly_fractions(self.fraction * mean, self.moments.cov(),
+                               self.shrinkage, self.max_leverage)
+
+
+def allocate(dailyret:pd.DataFrame, **kwargs) -> pd.DataFrame:
+    """Kelly fractions of every day, computed from the returns up to that day.
+
+    Parameters
+    ----------
+    dailyret: pandas.DataFrame
+        Daily returns, one column per asset, e.g. `df.pct_change()`.
+    kwargs:
+        Parameters of `KellyAllocator`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Fractions with the shape of `dailyret`, NaN before `minperiod` returns.
+    """
+    allocator = KellyAllocator(dailyret.shape[1], **kwargs)
+    out = np.full(dailyret.shape, np.nan)
+    for t, returns in enumerate(np.asarray(dailyret, dtype=float)):
+        allocator.update(returns)
+        F = allocator.fractions()
+        if F is not None:
+            out[t] = F
+    return pd.DataFrame(out, index=dailyret.index, columns=dailyret.columns)
+
+
+class KellySizer(bt.Sizer):
+    """Size the buy orders to the rolling Kelly fraction of the portfolio value.
+
+    The fractions are estimated on the close to close returns of all the datas
+    of the strategy. A buy order tops the position up to its fraction, and is
+    skipped before `minperiod` returns or when the fraction is negative. A sell
+    order closes the position.
+    """
+    params = (
+        ('window', 252),
+        ('minperiod', 60),
+        ('riskfree', 0.04),
+        ('shrinkage', 0.0),
+        # Sum of the absolute fractions. With 1 the orders are paid in cash.
+        ('max_leverage', 1.0),
+        ('fraction', 1.0),
+        # Share of the cash kept for a gap up of the next open, above which
+        # the broker rejects the order for margin.
+        ('reserve', 0.02),
+    )
+
+    def __init__(self):
+        self.allocator = None
+        # Closes of the last bar added to the allocator, and the bar
+        self.closes = None
+        self.seen = 0
+
+    def set(self, strategy, broker):
+        super(KellySizer, self).set(strategy, broker)
+        # Bars without orders are added by the analyzer, so the sizer never
+        # looks back and works with the short lines of exactbars.
+        strategy._addanalyzer(_KellyUpdate, sizer=self, _name="kellysizer")
+
+    def _update(self) -> None:
+        """Add the return of the current bar to the allocator, once per bar."""
+        bar = len(self.strategy)
+        if bar == self.seen:
+            return
+        datas = self.strategy.datas
+        if self.allocator is None:
+            self.allocator = KellyAllocator(
+                len(datas), window=self.p.window, minperiod=self.p.minperiod,
+                riskfree=self.p.riskfree, shrinkage=self.p.shrinkage,
+                max_leverage=self.p.max_leverage, fraction=self.p.fraction
+            )
+        closes = np.array([data.close[0] for data in datas])
+        # The first bar has no return.
+        if self.closes is not None:
+            self.allocator.update(closes / self.closes - 1)
+        self.closes = closes
+        self.seen = bar
+
+    def _getsizing(self, comminfo, cash, data, isbuy):
+        position = self.broker.getposition(data).size
+        if not isbuy:
+            return max(position, 0)
+        self._update()
+        F = self.allocator.fractions()
+        if F is None:
+            return 0
+        price = data.close[0]
+        cash *= 1 - self.p.reserve
+        # Lines overload ==, compare the datas by identity.
+        i = next(i for i, d in enumerate(self.strategy.datas) if d is data)
+        target = int(F[i] * self.broker.getvalue() / price)
+        size = min(max(target - position, 0), comminfo.getsize(price, cash))
+        while size > 0 and comminfo.getoperationcost(size, price) + \
+                comminfo.getcommission(size, price) > cash:
+            size -= 1
+        return size
+
+
+class _KellyUpdate(bt.Analyzer):
+    """Add the return of every bar to the allocator of a KellySizer, after the
+    orders of the bar are sized."""
+    params = (
+        ('sizer', None),
+    )
+
+    def next(self):
+        self.p.sizer._update()
@@ -0,0 +1,314 @@
+"""Live bars
+* Streaming counterparts of the strategies for paper trading. The indicator
+  state is updated in constant time per bar (amortized for the highest high and
+  lowest low) instead of recomputing the indicators over the history.
+* Bars come from a replayed csv file, from a csv file that is tailed as it
+  grows (e.g. written by `utils.download_yf`) or from a queue.
+* The time from the arrival of a bar to the decision is measured per bar.
+* Replaying a csv file gives the same decisions as `KDJStrategy` in `run`.
+
+python -m src.live --dataname 'data/tenb_*_1d.csv' --strategy KDJ --tail 1
+"""
+from argparse import ArgumentParser
+from collections import deque, namedtuple
+from datetime import datetime
+import glob
+import io
+import math
+import os
+import queue
+import time
+import numpy as np
+import pandas as pd
+
+from src.feeds import _is_daily, _parse_yahoo_csv, load_yahoo_csv
+
+# received is the time.perf_counter() of the arrival of the bar.
+Bar = namedtuple("Bar", ["datetime", "open", "high", "low", "close", "volume", "received"])
+Decision = namedtuple("Decision", ["datetime", "side", "close", "latency"])
+
+BUY, SELL = "buy", "sell"
+
+
+class RollingExtreme:
+    """Highest (or lowest) value of the last `period` values with a monotonic
+    deque, O(1) amortized per value."""
+    def __init__(self, period:int, highest:bool=True):
+        self.period = period
+        self.sign = 1.0 if highest else -1.0
+        # (position, signed value), signed values decreasing
+        self.window = deque()
+        self.count = 0
+
+    def update(self, x:float) -> float:
+        """Add a value. Returns the extreme, NaN until `period` values."""
+        signed = self.sign * x
+        while self.window and self.window[-1][1] <= signed:
+            self.window.pop()
+        self.window.append((self.count, signed))
+        if self.window[0][0] <= self.count - self.period:
+            self.window.popleft()
+        self.count += 1
+        if self.count < self.period:
+            return math.nan
+        return self.sign * self.window[0][1]
+
+
+class StreamingSMA:
+    """Simple moving average with a running sum."""
+    def __init__(self, period:int):
+        self.period = period
+        self.window = deque()
+        self.total = 0.0
+
+    def update(self, x:float) -> float:
+        """Add a value. Returns the average, NaN until `period` values."""
+        self.window.append(x)
+        self.total += x
+        if len(self.window) > self.period:
+            self.total -= self.window.popleft()
+        if len(self.window) < self.period:
+            return math.nan
+        return self.total / self.period
+
+
+class StreamingEMA:
+    """Exponential moving average, seeded and updated like
+    `bt.indicators.ExponentialMovingAverage`."""
+    def __init__(self, period:int):
+        self.period = period
+        self.alpha = 2.0 / (1 + period)
+        self.alpha1 = 1.0 - self.alpha
+        self.seed = []
+        self.value = math.nan
+
+    def update(self, x:float) -> float:
+        """Add a value. NaN values before the first valid one are skipped.
+        Returns the average, NaN until `period` valid values."""
+        if self.seed is not None:
+            if not math.isnan(x) or self.seed:
+                self.seed.append(x)
+            if len(self.seed) == self.period:
+                self.value = math.fsum(self.seed) / self.period
+                self.seed = None
+            return self.value
+        self.value = self.value * self.alpha1 + x * self.alpha
+        return self.value
+
+
+class StreamingKDJ:
+    """K, D and J lines of `KDJStrategy`, updated bar by bar."""
+    def __init__(self, period:int=9, period_k:int=3, period_d:int=3):
+        self.highest = RollingExtreme(period, highest=True)
+        self.lowest = RollingExtreme(period, highest=False)
+        self.K = StreamingEMA(period_k)
+        self.D = StreamingEMA(period_d)
+
+    def update(self, high:float, low:float, close:float) -> tuple:
+        """Add a bar. Returns (K, D, J), NaN during the warm-up."""
+        high_n = self.highest.update(high)
+        low_n = self.lowest.update(low)
+        den = high_n - low_n
+        if math.isnan(den):
+            rsv = math.nan
+        else:
+            # bt.DivByZero returns 0 when the denominator is 0
+            rsv = 100 * ((close - low_n) / den if den != 0 else 0.0)
+        K = self.K.update(rsv)
+        D = self.D.update(K)
+        return K, D, 3 * K - 2 * D
+
+
+class KDJSignal:
+    """Decisions of `KDJStrategy`: buy when J crosses above D and sell when J
+    is below D or was above D on the previous bar. The orders are assumed to
+    be filled at the next open, like in `run`."""
+    def __init__(self, period:int=9, period_k:int=3, period_d:int=3):
+        self.kdj = StreamingKDJ(period, period_k, period_d)
+        self.previous = math.nan
+        self.position = False
+
+    def on_bar(self, bar:Bar) -> str:
+        """Returns BUY, SELL or None."""
+        _, D, J = self.kdj.update(bar.high, bar.low, bar.close)
+        condition1, condition2 = self.previous, J - D
+        self.previous = condition2
+        if not self.position:
+            if condition1 < 0 and condition2 > 0:
+                self.position = True
+                return BUY
+        elif condition1 > 0 or condition2 < 0:
+            self.position = False
+            return SELL
+        return None
+
+
+class SMASignal:
+    """Decisions of `MaStrategy`: buy when the close is above its simple moving
+    average and sell when it is below. Unlike `MaStrategy` the decisions do
+    not wait for its informational indicators."""
+    def __init__(self, maperiod:int=15):
+        self.sma = StreamingSMA(maperiod)
+        self.position = False
+
+    def on_bar(self, bar:Bar) -> str:
+        """Returns BUY, SELL or None."""
+        sma = self.sma.update(bar.close)
+        if not self.position:
+            if bar.close > sma:
+                self.position = True
+                return BUY
+        elif bar.close < sma:
+            self.position = False
+            return SELL
+        return None
+
+
+SIGNALS = {
+    "KDJ": KDJSignal,
+    "MA": SMASignal,
+}
+
+
+def _bars(df) -> iter:
+    """Bars of a frame as returned by `feeds.load_yahoo_csv`."""
+    for dt, row in zip(df.index, df.values):
+        yield Bar(dt.to_pydatetime(), row[0], row[1], row[2], row[3], row[4], time.perf_counter())
+
+
+def replay(filepath:str, fromdate:datetime=None, todate:datetime=None) -> iter:
+    """Bars of a YahooFinance csv file, filtered like `strategies.run`."""
+    return _bars(load_yahoo_csv(filepath, fromdate=fromdate, todate=todate))
+
+
+def _newest(pattern:str) -> str:
+    paths = glob.glob(pattern)
+    return max(paths, key=os.path.getmtime) if paths else None
+
+
+def tail_csv(pattern:str, poll:float=1.0, timeout:float=None) -> iter:
+    """Bars of a YahooFinance csv file as it grows.
+
+    The file is polled and only the lines appended since the last poll are
+    read, from the offset the previous read stopped at. A file that is
+    replaced or rewritten (its last read line changed), e.g. by
+    `utils.download_yf`, is read again from the start and only the bars after
+    the last delivered one are delivered. A delivered bar is final, later
+    revisions of it are ignored.
+
+    Parameters
+    ----------
+    pattern: str
+        Path of the file or glob pattern, e.g. 'data/tenb_*_1d.csv' as the
+        file names of `utils.download_yf` contain the last date. The most
+        recently modified matching file is read.
+    poll: float
+        Seconds between the checks of the file.
+    timeout: float
+        Stop after this many seconds without a new bar. Never stops if not
+        specified.
+    """
+    # Read file, bytes read, its header and last line, last delivered bar
+    path, offset, header, tail, last = None, 0, None, b"", None
+    idle = time.perf_counter()
+    while timeout is None or time.perf_counter() - idle < timeout:
+        newest = _newest(pattern)
+        if newest is not None:
+            if newest != path or os.path.getsize(newest) < offset:
+                path, offset, header, tail = newest, 0, None, b""
+            with open(path, "rb") as f:
+                f.seek(offset - len(tail))
+                if f.read(len(tail)) != tail:
+                    # Rewritten in place, read it again.
+                    offset, header, tail = 0, None, b""
+                    f.seek(0)
+                chunk = f.read()
+            # Only the complete lines, the rest is read at the next poll
+            chunk = chunk[:chunk.rfind(b"\n") + 1]
+            if chunk:
+                offset += len(chunk)
+                tail = chunk[chunk.rfind(b"\n", 0, -1) + 1:]
+                if header is None:
+                    header, _, chunk = chunk.partition(b"\n")
+                if chunk:
+                    text = (header + b"\n" + chunk).decode()
+                    index, values = _parse_yahoo_csv(io.StringIO(text), _is_daily(path))
+                    first = 0 if last is None else int(np.searchsorted(index, last, side="right"))
+                    for stamp, row in zip(index[first:], values[first:]):
+                        last = stamp
+                        idle = time.perf_counter()
+                        yield Bar(pd.Timestamp(stamp).to_pydatetime(),
+                                  row[0], row[1], row[2], row[3], row[4], time.perf_counter())
+        time.sleep(poll)
+
+
+def queue_bars(source:queue.Queue) -> iter:
+    """Bars put into a queue, e.g. by a market data thread, until None is put.
+    The bars are (datetime, open, high, low, close, volume) tuples."""
+    while True:
+        item = source.get()
+        if item is None:
+            return
+        yield Bar(*item[:6], time.perf_counter())
+
+
+def stream(bars:iter, signal, latencies:list=None) -> iter:
+    """Decisions of a signal on a stream of bars.
+
+    Parameters
+    ----------
+    bars: iterable
+        Bars, e.g. from `replay`, `tail_csv` or `queue_bars`.
+    signal: KDJSignal or SMASignal
+        Streaming strategy.
+    latencies: list
+        If specified then the seconds from the arrival to the decision of
+        every bar, with or without an order, are appended to it.
+
+    Yields
+    ------
+    Decision
+        Bar datetime, BUY or SELL, close and seconds from the arrival of the
+        bar to the decision.
+    """
+    for bar in bars:
+        side = signal.on_bar(bar)
+        latency = time.perf_counter() - bar.received
+        if latencies is not None:
+            latencies.append(latency)
+        if side is not None:
+            yield Decision(bar.datetime, side, bar.close, latency)
+
+
+def latency_percentiles(latencies:list, q:tuple=(50, 90, 99, 100)) -> dict:
+    """Percentiles of the latencies in microseconds, e.g. {'p50': 3.2, ...}."""
+    if len(latencies) == 0:
+        return {}
+    values = np.percentile(np.asarray(latencies) * 1e6, q)
+    return {"p%g" % p: float(v) for p, v in zip(q, values)}
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("--dataname", type=str, help="csv file or glob pattern")
+    parser.add_argument("--strategy", default="KDJ", choices=list(SIGNALS))
+    parser.add_argument("--tail", default=0, type=int, help="Follow the file as it grows")
+    parser.add_argument("--poll", default=1.0, type=float)
+    parser.add_argument("--timeout", type=float)
+    args = parser.parse_args()
+    if args.tail != 0:
+        bars = tail_csv(args.dataname, poll=args.poll, timeout=args.timeout)
+    else:
+        bars = replay(_newest(args.dataname))
+    latencies = []
+    try:
+        for decision in stream(bars, SIGNALS[args.strategy](), latencies):
+            print("%s, %s, %.2f, %.1f us" % (
+                decision.datetime.isoformat(), decision.side.upper(), decision.close,
+                decision.latency * 1e6
+            ))
+    except KeyboardInterrupt:
+        pass
+    print("Latency (us): %s" % ", ".join(
+        "%s %.1f" % item for item in latency_percentiles(latencies).items()
+    ))
@@ -0,0 +1,157 @@
+"""Pair trading
+* Vectorized version of the Bollinger band spread strategy of the pair-trading
+  notebook for many pairs at once. Every quantity is a (days, pairs) array, so
+  there is no loop over the pairs nor over the days.
+* The hedge ratio is either fitted once on a training set, like in the notebook,
+  or on a rolling window. Rolling hedge ratios and Bollinger bands are computed
+  from running sums in O(days) per pair instead of refitting an OLS per day.
+"""
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+from src import analytics
+
+PairsResult = namedtuple("PairsResult", [
+    "hedge_ratio", "spread", "zscore", "positions_y", "positions_x", "pnl"
+])
+
+
+def _rolling_sum(a:np.ndarray, window:int) -> np.ndarray:
+    """Sum of the last `window` rows. NaN until the window is full and for
+    windows with a missing value."""
+    missing = np.isnan(a)
+    csum = np.zeros((a.shape[0] + 1,) + a.shape[1:])
+    np.cumsum(np.where(missing, 0.0, a), axis=0, out=csum[1:])
+    cmissing = np.zeros((a.shape[0] + 1,) + a.shape[1:], dtype=int)
+    np.cumsum(missing, axis=0, out=cmissing[1:])
+    out = np.full(a.shape, np.nan)
+    if a.shape[0] >= window:
+        out[window - 1:] = csum[window:] - csum[:-window]
+        out[window - 1:][cmissing[window:] - cmissing[:-window] > 0] = np.nan
+    return out
+
+
+def _ffill(a:np.ndarray) -> np.ndarray:
+    """Forward fill the NaN values of every column."""
+    rows = np.where(np.isnan(a), 0, np.arange(a.shape[0])[:, None])
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    return np.take_along_axis(a, rows, axis=0)
+
+
+def hedge_ratios(y:np.ndarray, x:np.ndarray, window:int=None, train=None) -> np.ndarray:
+    """OLS hedge ratios (without intercept) of y on x for every pair.
+
+    Parameters
+    ----------
+    y: numpy.ndarray
+        (days, pairs) prices of the first legs.
+    x: numpy.ndarray
+        (days, pairs) prices of the second legs.
+    window: int
+        Rolling window. The ratio of day t is fitted on the days t - window + 1
+        to t. If not specified then one ratio per pair is fitted on `train`.
+    train: array like
+        Rows of the training set, e.g. np.arange(0, 252 * 2). All rows if not
+        specified.
+
+    Returns
+    -------
+    numpy.ndarray
+        (days, pairs) rolling or (1, pairs) fixed hedge ratios.
+    """
+    if window is None:
+        rows = slice(None) if train is None else train
+        return np.nansum(y[rows] * x[rows], axis=0, keepdims=True) / \
+            np.nansum(x[rows] * x[rows], axis=0, keepdims=True)
+    return _rolling_sum(y * x, window) / _rolling_sum(x * x, window)
+
+
+def bollinger_zscore(spread:np.ndarray, window:int) -> np.ndarray:
+    """Z-score of the spread in its rolling mean and standard deviation."""
+    # Shift by the first value of every column to limit the cancellation of
+    # the running sums of squares.
+    anchor = _ffill(spread[::-1])[-1]
+    shifted = spread - anchor
+    s1 = _rolling_sum(shifted, window)
+    s2 = _rolling_sum(shifted * shifted, window)
+    mean = s1 / window
+    var = np.maximum(s2 - s1 * mean, 0) / (window - 1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (shifted - mean) / np.sqrt(var)
+
+
+def spread_positions(prices:pd.DataFrame, pairs:list, window:int=30, entry:float=1,
+                     exit:float=0.5, hedge_window:int=None, train=None) -> PairsResult:
+    """Backtest the Bollinger band spread strategy on many pairs.
+
+    The spread y - hedge_ratio * x is shorted (-1 y, +1 x) when its z-score is
+    at least `entry` and the short is exited when the z-score drops to `exit`.
+    It is bought (+1 y, -1 x) when the z-score is at most -`entry` and the long
+    is exited when the z-score rises to -`exit`. Positions are carried forward
+    until an exit, and the positions of a day earn the returns of the next day.
+
+    Parameters
+    ----------
+    prices: pandas.DataFrame
+        Close prices, one column per ticker.
+    pairs: list
+        (y, x) tickers, e.g. [('GLD', 'GDX')].
+    window: int
+        Lookback window of the Bollinger bands.
+    entry: float
+        Entry z-score threshold.
+    exit: float
+        Exit z-score threshold.
+    hedge_window: int
+        Rolling window of the hedge ratios, see `hedge_ratios`.
+    train: array like
+        Training rows of the fixed hedge ratios, see `hedge_ratios`.
+
+    Returns
+    -------
+    PairsResult
+        Frames with one column per pair, named 'y/x'.
+    """
+    names = ["%s/%s" % pair for pair in pairs]
+    y = prices.loc[:, [pair[0] for pair in pairs]].values.astype(float)
+    x = prices.loc[:, [pair[1] for pair in pairs]].values.astype(float)
+    hedge_ratio = hedge_ratios(y, x, window=hedge_window, train=train)
+    spread = y - hedge_ratio * x
+    zscore = bollinger_zscore(spread, window)
+    with np.errstate(invalid="ignore"):
+        # Exits are applied after entries, as in the notebook.
+        short = np.where(zscore <= exit, 0.0, np.where(zscore >= entry, 1.0, np.nan))
+        long = np.where(zscore >= -exit, 0.0, np.where(zscore <= -entry, 1.0, np.nan))
+    short = np.nan_to_num(_ffill(short))
+    long = np.nan_to_num(_ffill(long))
+    positions_y = long - short
+    positions_x = short - long
+    returns_y = y[1:] / y[:-1] - 1
+    returns_x = x[1:] / x[:-1] - 1
+    pnl = np.full(y.shape, np.nan)
+    pnl[1:] = positions_y[:-1] * returns_y + positions_x[:-1] * returns_x
+
+    def frame(a):
+        return pd.DataFrame(np.broadcast_to(a, y.shape), index=prices.index, columns=names)
+
+    return PairsResult(frame(hedge_ratio), frame(spread), frame(zscore),
+                       frame(positions_y), frame(positions_x), frame(pnl))
+
+
+def sharpe_ratio(pnl:pd.DataFrame, rows=None) -> pd.Series:
+    """Annualized Sharpe ratio of every pair, as computed in the notebook.
+
+    Parameters
+    ----------
+    pnl: pandas.DataFrame
+        Daily P&L, e.g. `PairsResult.pnl`.
+    rows: array like
+        Rows to use, e.g. the test set. All rows if not specified.
+
+    Returns
+    -------
+    pandas.Series
+    """
+    values = pnl.values if rows is None else pnl.values[rows]
+    return pd.Series(analytics.sharpe(values.T, periods=analytics.TRADING_DAYS), index=pnl.columns)
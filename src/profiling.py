@@ -0,0 +1,138 @@
+"""Profiling
+* Split the wall time of a Cerebro run into the data load, the indicator
+  precompute and the event loop, and time the next() calls of every strategy
+  and the precompute of every indicator.
+* The strategies are replaced by timed subclasses and the datas by timed
+  methods only for the profiled run, so a run without profiling is unchanged.
+* Optionally dump a cProfile pstats file of the run.
+"""
+import cProfile
+import resource
+import sys
+import time
+import backtrader as bt
+
+
+def peak_rss() -> float:
+    """Peak resident set size of the process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes on Linux
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def _timed(method, timings:dict, key:str):
+    """Wrap a method to add its wall time to timings[key]."""
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            timings[key] = timings.get(key, 0.0) + time.perf_counter() - start
+    return wrapper
+
+
+def profiled(strategy):
+    """Subclass of a strategy recording the time of its __init__ (where the
+    indicators are created), of the precompute of every indicator and of its
+    next() calls in the `profile` attribute."""
+    class Profiled(strategy):
+        def __init__(self):
+            start = time.perf_counter()
+            super(Profiled, self).__init__()
+            self.profile = {
+                "init": time.perf_counter() - start,
+                "next": 0.0,
+                "next_calls": 0,
+                "indicators": {},
+            }
+            timings = self.profile["indicators"]
+            for i, indicator in enumerate(self._lineiterators[bt.LineIterator.IndType]):
+                # Top level indicators only, their time includes their own
+                # indicators, e.g. the moving averages of MACDHisto.
+                key = "%i %s" % (i, type(indicator).__name__)
+                indicator._once = _timed(indicator._once, timings, key)
+                indicator._next = _timed(indicator._next, timings, key)
+            self._once = _timed(self._once, self.profile, "precompute")
+
+        def next(self):
+            start = time.perf_counter()
+            super(Profiled, self).next()
+            self.profile["next"] += time.perf_counter() - start
+            self.profile["next_calls"] += 1
+
+    Profiled.__name__ = strategy.__name__
+    Profiled.__qualname__ = strategy.__qualname__
+    return Profiled
+
+
+def profile_run(cerebro:bt.Cerebro, pstats:str=None) -> dict:
+    """Run Cerebro with profiling.
+
+    Parameters
+    ----------
+    cerebro: bt.Cerebro
+        Engine with its strategies and datas added.
+    pstats: str
+        Path of the cProfile stats file to write, e.g. 'run.pstats'. cProfile
+        is not enabled if not specified. It slows the run down, so the
+        timings of a run with pstats are inflated.
+
+    Returns
+    -------
+    dict
+        Seconds of the whole run, the data load, the indicators (creation and
+        precompute), the event loop (the rest), bars, bars per second, peak
+        RSS in MB and the timings per strategy.
+    """
+    timings = {}
+    for entry in cerebro.strats:
+        for i, (strategy, args, kwargs) in enumerate(entry):
+            entry[i] = (profiled(strategy), args, kwargs)
+    for data in cerebro.datas:
+        data._start = _timed(data._start, timings, "data_load")
+        data.preload = _timed(data.preload, timings, "data_load")
+    profiler = cProfile.Profile() if pstats is not None else None
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    results = cerebro.run()
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(pstats)
+    total = time.perf_counter() - start
+    strategies = {}
+    for i, strategy in enumerate(results):
+        strategy.profile.setdefault("precompute", 0.0)
+        strategies["%i %s" % (i, type(strategy).__name__)] = strategy.profile
+    indicators = sum(s["init"] + s["precompute"] for s in strategies.values())
+    bars = max(len(data) for data in cerebro.datas)
+    return {
+        "total": total,
+        "data_load": timings.get("data_load", 0.0),
+        "indicators": indicators,
+        "event_loop": total - timings.get("data_load", 0.0) - indicators,
+        "bars": bars,
+        "bars_per_sec": bars / total,
+        "peak_rss_mb": peak_rss(),
+        "strategies": strategies,
+    }
+
+
+def format_report(report:dict) -> str:
+    """Text table of the report of `profile_run`."""
+    lines = [
+        "Wall time          %10.4f s" % report["total"],
+        "  data load        %10.4f s" % report["data_load"],
+        "  indicators       %10.4f s" % report["indicators"],
+        "  event loop       %10.4f s" % report["event_loop"],
+        "Bars               %10i (%.0f bars/s)" % (report["bars"], report["bars_per_sec"]),
+        "Peak memory        %10.1f MB" % report["peak_rss_mb"],
+    ]
+    for name, profile in report["strategies"].items():
+        lines.append("Strategy %s" % name)
+        lines.append("  __init__         %10.4f s" % profile["init"])
+        lines.append("  precompute       %10.4f s" % profile["precompute"])
+        lines.append("  next()           %10.4f s (%i calls)" % (profile["next"], profile["next_calls"]))
+        for indicator, seconds in sorted(profile["indicators"].items(), key=lambda item: -item[1]):
+            lines.append("    %-26s %10.4f s" % (indicator, seconds))
+    return "\n".join(lines)
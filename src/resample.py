@@ -0,0 +1,247 @@
+"""Minute bar resampling
+* Aggregate minute OHLCV bars to 5m, 15m, 1h or 1d bars without loading the
+  whole history: the bars are read in chunks from a YahooFinance csv file or
+  from the on-disk OHLC cache (see `cache.OHLCCache`) and the bar that is still
+  open at the end of a chunk is carried into the next chunk.
+* Open is the first open, high the highest high, low the lowest low, close
+  the last close and volume the sum of the volumes of the bucket. The buckets
+  are in the local time of the exchange, intraday buckets are aligned to the
+  session open (9:30 for the US markets) like the YahooFinance bars.
+* Every timeframe is appended to a csv file in the layout and with the file
+  name of `utils.download_yf`, so the files can be passed to `strategies.run`.
+  The memory depends on the chunk size only.
+
+python -m src.resample --source data/spy_20230501_20230526_1m.csv --ticker SPY --path data
+"""
+from argparse import ArgumentParser
+import os
+import numpy as np
+import pandas as pd
+
+from src.cache import OHLCCache
+
+# Columns of the csv files written by utils.download_yf
+COLUMNS = ["Open", "High", "Low", "Close", "Volume", "Dividends", "Stock Splits"]
+# Length of the intraday timeframes
+TIMEFRAMES = {
+    "5m": pd.Timedelta(minutes=5),
+    "15m": pd.Timedelta(minutes=15),
+    "30m": pd.Timedelta(minutes=30),
+    "1h": pd.Timedelta(hours=1),
+}
+_NS_PER_DAY = 86400 * 10 ** 9
+_NS_PER_MINUTE = 60 * 10 ** 9
+
+
+def csv_chunks(filepath:str, chunksize:int=200000) -> iter:
+    """Bars of a YahooFinance csv file, `chunksize` rows at a time.
+
+    Yields
+    ------
+    tuple
+        (wall, offset, values) where wall is the int64 local wall clock time in
+        nanoseconds, offset the UTC offset in minutes and values the float64
+        (rows, 5) OHLCV array.
+    """
+    for df in pd.read_csv(filepath, usecols=range(6), chunksize=chunksize):
+        # e.g. '2023-05-26 09:30:00-04:00', without offset for naive times
+        stamps = df.iloc[:, 0].astype(str)
+        wall = pd.to_datetime(stamps.str.slice(0, 19), format="%Y-%m-%d %H:%M:%S")
+        suffix = stamps.str.slice(19)
+        hours = pd.to_numeric(suffix.str.slice(1, 3), errors="coerce").fillna(0)
+        minutes = pd.to_numeric(suffix.str.slice(4, 6), errors="coerce").fillna(0)
+        sign = np.where(suffix.str.startswith("-"), -1, 1)
+        yield (wall.values.astype("datetime64[ns]").view("int64"),
+               (sign * (60 * hours + minutes)).values.astype("int64"),
+               df.iloc[:, 1:6].values.astype(float))
+
+
+def cache_chunks(root:str, ticker:str, interval:str="1m", chunksize:int=200000) -> iter:
+    """Bars of the on-disk OHLC cache, `chunksize` rows at a time, see
+    `csv_chunks`. The cached columns are memory mapped, only the rows of a
+    chunk are read."""
+    df = OHLCCache(root).read(ticker, interval)
+    for first in range(0, df.shape[0], chunksize):
+        chunk = df.iloc[first:first + chunksize]
+        index = chunk.index
+        utc = index.values.astype("datetime64[ns]").view("int64")
+        wall = utc if index.tz is None else \
+            index.tz_localize(None).values.astype("datetime64[ns]").view("int64")
+        yield (wall, (wall - utc) // _NS_PER_MINUTE,
+               chunk.loc[:, COLUMNS[:5]].values.astype(float))
+
+
+class Resampler:
+    """Aggregate a stream of bar chunks to one timeframe.
+
+    Parameters
+    ----------
+    timeframe: str
+        '5m', '15m', '30m', '1h' or '1d'.
+    origin: str
+        Local time the intraday buckets are aligned to, e.g. the session open.
+    """
+    def __init__(self, timeframe:str, origin:str="09:30"):
+        if timeframe == "1d":
+            self.length = _NS_PER_DAY
+            self.origin = 0
+        elif timeframe in TIMEFRAMES:
+            self.length = TIMEFRAMES[timeframe].value
+            self.origin = pd.Timedelta(origin + ":00").value
+        else:
+            raise ValueError("Unknown timeframe %s, expected one of %s" % (
+                timeframe, list(TIMEFRAMES) + ["1d"]))
+        self.timeframe = timeframe
+        # (bucket, offset, open, high, low, close, volume) of the open bar
+        self.partial = None
+
+    def _buckets(self, wall:np.ndarray) -> np.ndarray:
+        """Local start time of the bucket of every bar."""
+        return (wall - self.origin) // self.length * self.length + self.origin
+
+    def update(self, wall:np.ndarray, offset:np.ndarray, values:np.ndarray) -> tuple:
+        """Add a chunk of bars, in time order after the previous chunk.
+
+        Returns
+        -------
+        tuple
+            (bucket, offset, values) of the bars completed by the chunk, see
+            `csv_chunks`.
+        """
+        valid = ~np.isnan(values[:, 3])
+        wall, offset, values = wall[valid], offset[valid], values[valid]
+        if wall.shape[0] == 0:
+            return self._empty()
+        buckets = self._buckets(wall)
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        ends = np.r_[starts[1:], buckets.shape[0]] - 1
+        bars = np.column_stack([
+            values[starts, 0],
+            np.maximum.reduceat(values[:, 1], starts),
+            np.minimum.reduceat(values[:, 2], starts),
+            values[ends, 3],
+            np.add.reduceat(values[:, 4], starts),
+        ])
+        keys = buckets[starts]
+        offsets = offset[starts]
+        if self.partial is not None:
+            bucket, first_offset, bar = self.partial
+            if bucket == keys[0]:
+                # The bar open at the end of the previous chunk goes on.
+                bars[0] = [bar[0], max(bar[1], bars[0, 1]), min(bar[2], bars[0, 2]),
+                           bars[0, 3], bar[4] + bars[0, 4]]
+                offsets[0] = first_offset
+            else:
+                keys = np.r_[bucket, keys]
+                offsets = np.r_[first_offset, offsets]
+                bars = np.vstack([bar, bars])
+        # The last bar may go on in the next chunk.
+        self.partial = (keys[-1], offsets[-1], bars[-1])
+        return keys[:-1], offsets[:-1], bars[:-1]
+
+    def flush(self) -> tuple:
+        """Complete the open bar at the end of the stream, see `update`."""
+        if self.partial is None:
+            return self._empty()
+        bucket, offset, bar = self.partial
+        self.partial = None
+        return np.array([bucket]), np.array([offset]), bar[None]
+
+    @staticmethod
+    def _empty() -> tuple:
+        return np.empty(0, dtype="int64"), np.empty(0, dtype="int64"), np.empty((0, 5))
+
+
+def _format_offset(minutes:int) -> str:
+    return "%s%02i:%02i" % ("-" if minutes < 0 else "+", abs(minutes) // 60, abs(minutes) % 60)
+
+
+class _CsvWriter:
+    """Append bars to a csv file in the layout of `utils.download_yf`."""
+    def __init__(self, filepath:str, timeframe:str):
+        self.filepath = filepath
+        self.first = None
+        self.last = None
+        self.rows = 0
+        with open(filepath, "w") as f:
+            f.write(",".join(["Date" if timeframe == "1d" else "Datetime"] + COLUMNS) + "\n")
+
+    def write(self, buckets:np.ndarray, offsets:np.ndarray, bars:np.ndarray) -> None:
+        if buckets.shape[0] == 0:
+            return
+        unique, inverse = np.unique(offsets, return_inverse=True)
+        stamps = np.char.add(
+            np.char.replace(np.datetime_as_string(buckets.view("datetime64[ns]"), unit="s"), "T", " "),
+            np.array([_format_offset(minutes) for minutes in unique])[inverse]
+        )
+        df = pd.DataFrame(bars, columns=COLUMNS[:5], index=stamps)
+        df["Dividends"] = 0.0
+        df["Stock Splits"] = 0.0
+        df.to_csv(self.filepath, mode="a", header=False)
+        self.first = self.first if self.first is not None else buckets[0]
+        self.last = buckets[-1]
+        self.rows += buckets.shape[0]
+
+
+def resample(chunks:iter, ticker:str, path:str, timeframes:list=("5m", "15m", "1h", "1d"),
+             origin:str="09:30") -> dict:
+    """Aggregate minute bars to several timeframes in one pass.
+
+    Parameters
+    ----------
+    chunks: iterable
+        Chunks of minute bars in time order, from `csv_chunks` or `cache_chunks`.
+    ticker: str
+        Ticker of the file names.
+    path: str
+        Folder of the csv files.
+    timeframes: list
+        Timeframes of `Resampler`.
+    origin: str
+        Local time the intraday buckets are aligned to.
+
+    Returns
+    -------
+    dict
+        Path of the csv file of every timeframe, e.g.
+        'spy_20230501_20230526_5m.csv'. None for a timeframe without bars.
+    """
+    os.makedirs(path, exist_ok=True)
+    resamplers = {timeframe: Resampler(timeframe, origin) for timeframe in timeframes}
+    writers = {
+        timeframe: _CsvWriter(os.path.join(path, ".%s_%s.csv.tmp" % (ticker.lower(), timeframe)), timeframe)
+        for timeframe in timeframes
+    }
+    for wall, offset, values in chunks:
+        for timeframe, resampler in resamplers.items():
+            writers[timeframe].write(*resampler.update(wall, offset, values))
+    out = {}
+    for timeframe, resampler in resamplers.items():
+        writer = writers[timeframe]
+        writer.write(*resampler.flush())
+        if writer.rows == 0:
+            os.remove(writer.filepath)
+            out[timeframe] = None
+            continue
+        first, last = (pd.Timestamp(stamp).strftime("%Y%m%d") for stamp in (writer.first, writer.last))
+        filepath = os.path.join(path, "%s_%s_%s_%s.csv" % (ticker.lower(), first, last, timeframe))
+        os.replace(writer.filepath, filepath)
+        out[timeframe] = filepath
+    return out
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("--source", type=str, help="csv file of minute bars")
+    parser.add_argument("--cache", type=str, help="Folder of the OHLC cache, instead of a csv file")
+    parser.add_argument("--ticker", type=str)
+    parser.add_argument("--path", default=".", type=str, help="Folder of the resampled csv files")
+    parser.add_argument("--timeframes", nargs="+", default=["5m", "15m", "1h", "1d"])
+    parser.add_argument("--chunksize", default=200000, type=int)
+    args = parser.parse_args()
+    if args.cache is not None:
+        chunks = cache_chunks(args.cache, args.ticker, chunksize=args.chunksize)
+    else:
+        chunks = csv_chunks(args.source, chunksize=args.chunksize)
+    for timeframe, filepath in resample(chunks, args.ticker, args.path, args.timeframes).items():
+        print("%-4s %s" % (timeframe, filepath))
@@ -0,0 +1,143 @@
+"""Cointegration screener
+* Look for cointegrated pairs in a universe of tickers with the Engle-Granger
+  test of the exit-strategy notebook.
+* The O(N²) pairs are prefiltered with one vectorized correlation matrix of the
+  prices and only the survivors are tested, on a process pool. The price window
+  is written once to a temporary folder (in /dev/shm when available) and memory
+  mapped by the workers, like in `sweep.py`.
+* The test results are cached in a JSON file keyed by the pair, the window and
+  the hash of the prices of both tickers, so screening again only tests the
+  pairs whose data changed. The file keeps the results of the last screen only.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from statsmodels.tsa.stattools import coint
+
+COLUMNS = ["y", "x", "correlation", "tstat", "pvalue", "hedge_ratio"]
+
+# Price window memory mapped by every worker process, set by _init_worker.
+_PRICES = None
+
+
+def correlated_pairs(prices:np.ndarray, threshold:float=0.9) -> tuple:
+    """Column positions (i, j), i < j, of the pairs whose correlation is at
+    least `threshold`, and their correlation."""
+    corr = np.corrcoef(prices, rowvar=False)
+    i, j = np.triu_indices(prices.shape[1], k=1)
+    keep = corr[i, j] >= threshold
+    return i[keep], j[keep], corr[i[keep], j[keep]]
+
+
+def _column_hashes(prices:np.ndarray) -> list:
+    """SHA1 of the values of every column."""
+    return [hashlib.sha1(np.ascontiguousarray(prices[:, k]).tobytes()).hexdigest()
+            for k in range(prices.shape[1])]
+
+
+def engle_granger(y:np.ndarray, x:np.ndarray) -> tuple:
+    """Engle-Granger cointegration test of y on x.
+
+    Returns
+    -------
+    tuple
+        (t-statistic, p-value, hedge ratio) where the hedge ratio is the slope
+        of the OLS regression of y on x and a constant.
+    """
+    tstat, pvalue, _ = coint(y, x)
+    hedge_ratio = np.polyfit(x, y, 1)[0]
+    return tstat, pvalue, hedge_ratio
+
+
+def _init_worker(path:str) -> None:
+    global _PRICES
+    _PRICES = np.load(path, mmap_mode="r")
+
+
+def _run_job(job:tuple) -> tuple:
+    i, j = job
+    return engle_granger(np.asarray(_PRICES[:, i]), np.asarray(_PRICES[:, j]))
+
+
+def _load_cache(path:str) -> dict:
+    if path is None or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_cache(path:str, cache:dict) -> None:
+    with open(path + ".tmp", "w") as f:
+        json.dump(cache, f)
+    os.replace(path + ".tmp", path)
+
+
+def screen(prices:pd.DataFrame, window:int=252, threshold:float=0.9, processes:int=None,
+           cache:str=None) -> pd.DataFrame:
+    """Rank the pairs of a universe by the p-value of their cointegration test.
+
+    Only the tickers without missing prices in the window are screened. The
+    test regresses the ticker of the earlier column on the ticker of the later
+    one, e.g. GLD on GDX for the columns ['GLD', 'GDX'].
+
+    Parameters
+    ----------
+    prices: pandas.DataFrame
+        Close prices, one column per ticker.
+    window: int
+        Number of most recent rows to test. All rows if not specified.
+    threshold: float
+        Minimum correlation of the prices of a pair to be tested.
+    processes: int
+        Number of worker processes. Defaults to the number of CPUs. With 1 the
+        tests run in the calling process.
+    cache: str
+        Path of the JSON file of the cached results. Nothing is cached if not
+        specified. The results of the pairs and windows of earlier screens
+        that are not part of this screen are dropped from the file.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per tested pair with the tickers, the correlation, the
+        t-statistic, the p-value and the hedge ratio, sorted by p-value.
+    """
+    window_prices = prices if window is None else prices.iloc[-window:]
+    complete = window_prices.columns[window_prices.notna().all().values]
+    values = np.ascontiguousarray(window_prices.loc[:, complete].values, dtype=float)
+    tickers = list(complete)
+    if len(tickers) < 2:
+        return pd.DataFrame(columns=COLUMNS)
+    i, j, corr = correlated_pairs(values, threshold)
+    hashes = _column_hashes(values)
+    keys = ["%s|%s|%s|%s|%s" % (tickers[a], tickers[b], window, hashes[a], hashes[b])
+            for a, b in zip(i, j)]
+    cached = _load_cache(cache)
+    pending = [(a, b, key) for a, b, key in zip(i, j, keys) if key not in cached]
+    jobs = [(a, b) for a, b, _ in pending]
+    if jobs:
+        processes = processes or os.cpu_count()
+        if processes == 1:
+            tests = [engle_granger(values[:, a], values[:, b]) for a, b in jobs]
+        else:
+            shm = "/dev/shm" if os.path.isdir("/dev/shm") else None
+            with tempfile.TemporaryDirectory(dir=shm) as folder:
+                path = os.path.join(folder, "prices.npy")
+                np.save(path, values)
+                chunksize = max(1, len(jobs) // (processes * 4))
+                with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                         initargs=(path,)) as executor:
+                    tests = list(executor.map(_run_job, jobs, chunksize=chunksize))
+        for (_, _, key), test in zip(pending, tests):
+            cached[key] = [float(v) for v in test]
+    if cache is not None and (jobs or len(cached) > len(keys)):
+        # Only the results of this screen are kept. The window of a rolling
+        # screen moves every day, so the older results are never read again.
+        _save_cache(cache, {key: cached[key] for key in keys})
+    rows = [[tickers[a], tickers[b], c] + cached[key] for a, b, c, key in zip(i, j, corr, keys)]
+    table = pd.DataFrame(rows, columns=COLUMNS)
+    return table.sort_values("pvalue", kind="stable").reset_index(drop=True)
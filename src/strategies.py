@@ -3,17 +3,26 @@
 """
 from __future__ import (absolute_import, division, print_function, unicode_literals)
 from datetime import datetime
+import glob
 import os
 import sys
 import logging
 from argparse import ArgumentParser
-from matplotlib import pyplot as plt
+import numpy as np
+import pandas as pd
 
 import backtrader as bt
 
-# Set project folder
-_PROJECT_FOLDER = "/Users/wtai/Projects/Quantitative_trading/"
-sys.path.append(_PROJECT_FOLDER)
+# Project folder, the parent of the folder of this file
+_PROJECT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if not __package__:
+    # Run as a script, `python src/strategies.py`. Imported as src.strategies
+    # the project folder is already importable and sys.path is left alone.
+    sys.path.insert(0, _PROJECT_FOLDER)
+
+from src import analytics, indicator_cache
+from src.feeds import ArrayData, bar_window, compile_yahoo_csv, file_timeframe, load_panel
+from src.journal import Journal
 
 # Logger
 logging.basicConfig(level=logging.INFO)
@@ -28,12 +37,19 @@ class TestStrategy(bt.Strategy):
     # Parameters
     params = (
         ('exitbars', 5),
+        ('printlog', True),
+        # Path of the JSON lines trade journal (see journal.Journal)
+        ('journal', None),
     )
+    # Parameter grid of run(optimize=1)
+    optgrid = {'exitbars': range(1, 11)}
     
-    def log(self, txt:str, dt:datetime=None) -> None:
-        """Print text to console."""
-        dt = dt or self.datas[0].datetime.date(0)
-        print("%s, %s" % (dt.isoformat(), txt))
+    def log(self, txt:str, *args, dt:datetime=None) -> None:
+        """Print text to console. The text is only formatted with `args` when
+        it is printed."""
+        if self.params.printlog:
+            dt = dt or self.datas[0].datetime.date(0)
+            print("%s, %s" % (dt.isoformat(), txt % args if args else txt))
     
     def __init__(self):
         # Keep a reference to the "close" line in the data[0] data series.
@@ -42,6 +58,8 @@ class TestStrategy(bt.Strategy):
         self.order = None
         self.buyprice = None
         self.buycomm = None
+        # Trade journal
+        self.journal = Journal(self.params.journal) if self.params.journal else None
     
     def notify_order(self, order):
         """The strategy is notified on the change of order status. The status change
@@ -62,6 +80,8 @@ class TestStrategy(bt.Strategy):
         ---------
         * What is the 'Margin' order status?
         """
+        if self.journal is not None:
+            self.journal.order(self, order)
         if order.status in [order.Submitted, order.Accepted]:
             # Do nothing when a order is submitted to or accepted by the broker.
             return
@@ -70,26 +90,26 @@ class TestStrategy(bt.Strategy):
             if order.isbuy():
                 # Buy order executed
                 self.log(
-                    'BUY EXECUTED, Price: %.2f, Cost: %.2f, Comm %.2f' % 
-                    (order.executed.price,
-                     order.executed.value,
-                     order.executed.comm)
+                    'BUY EXECUTED, Price: %.2f, Cost: %.2f, Comm %.2f',
+                    order.executed.price,
+                    order.executed.value,
+                    order.executed.comm
                 )
                 self.buyprice = order.executed.price
                 self.buycomm = order.executed.comm
             elif order.issell():
                 # Sell order executed
                 self.log(
-                    'SELL EXECUTED, Price: %.2f, Cost: %.2f, Comm: %.2f' % 
-                    (order.executed.price,
-                     order.executed.value,
-                     order.executed.comm)
+                    'SELL EXECUTED, Price: %.2f, Cost: %.2f, Comm: %.2f',
+                    order.executed.price,
+                    order.executed.value,
+                    order.executed.comm
                 )
             # Keep a reference of the system clock when an order is executed.
             # The bar_executed can be understood as the elapsed periods
             # since the backtesting started.
             self.bar_executed = len(self)
-            self.log("ORDER EXECUTED at %i-th bar" % self.bar_executed)
+            self.log("ORDER EXECUTED at %i-th bar", self.bar_executed)
         elif order.status in [order.Canceled, order.Margin, order.Rejected]:
             self.log("Order Canceled/Margin/Rejected")
         # Set the pending order to none when the order status is Completed,
@@ -109,9 +129,11 @@ class TestStrategy(bt.Strategy):
         """
         if not trade.isclosed:
             return
+        if self.journal is not None:
+            self.journal.trade(self, trade)
         self.log(
-            "Operation profit, Gross %.2f, Net %.2f" %
-            (trade.pnl, trade.pnlcomm)
+            "Operation profit, Gross %.2f, Net %.2f",
+            trade.pnl, trade.pnlcomm
         )
 
     def next(self):
@@ -123,7 +145,7 @@ class TestStrategy(bt.Strategy):
         ---------
         * What is the system clock?
         """
-        self.log("Close, %.2f" % self.dataclose[0])
+        self.log("Close, %.2f", self.dataclose[0])
         if self.order is not None:
             # Do nothing at the bar when there is a pending order.
             # The order can be a buy or a sell order.
@@ -144,7 +166,7 @@ class TestStrategy(bt.Strategy):
                     # at the next bar openning price regardless what it is.
                     # In contrast, a limit order is only executed when the
                     # price hit the price set with the order.
-                    self.log("BUY CREATE, %.2f" % self.dataclose[0])
+                    self.log("BUY CREATE, %.2f", self.dataclose[0])
                     self.order = self.buy()
         else:
             # Check if the exit criteria is met when hold shares.
@@ -152,9 +174,14 @@ class TestStrategy(bt.Strategy):
                 # Sell the stock after holding it for 5 periods since the last
                 # recorded bar. Create a sell order using the closing price of
                 # the current bar. Update the order reference.
-                self.log("SELL CREATED. %.2f" % self.dataclose[0])
+                self.log("SELL CREATED. %.2f", self.dataclose[0])
                 self.order = self.sell()
 
+    def stop(self):
+        """Write the trade journal."""
+        if self.journal is not None:
+            self.journal.flush()
+
 
 class MaStrategy(bt.Strategy):
     """Moving Average Strategy.
@@ -164,13 +191,18 @@ class MaStrategy(bt.Strategy):
         # 3 weeks moving average
         ('maperiod', 15),
         ('printlog', False),
+        # Path of the JSON lines trade journal (see journal.Journal)
+        ('journal', None),
     )
+    # Parameter grid of run(optimize=1)
+    optgrid = {'maperiod': range(10, 31)}
     
-    def log(self, txt:str, dt:datetime=None, doprint:bool=False) -> None:
-        """Print text to console."""
+    def log(self, txt:str, *args, dt:datetime=None, doprint:bool=False) -> None:
+        """Print text to console. The text is only formatted with `args` when
+        it is printed."""
         if self.params.printlog or doprint:
             dt = dt or self.datas[0].datetime.date(0)
-            print("%s, %s" % (dt.isoformat(), txt))
+            print("%s, %s" % (dt.isoformat(), txt % args if args else txt))
     
     def __init__(self):
         # Keep a reference to the "close" line in the data[0] data series.
@@ -179,10 +211,15 @@ class MaStrategy(bt.Strategy):
         self.order = None
         self.buyprice = None
         self.buycomm = None
+        # Trade journal
+        self.journal = Journal(self.params.journal) if self.params.journal else None
         # Trading indicator
-        self.sma = bt.indicators.MovingAverageSimple(
-            self.datas[0], period=self.params.maperiod
-        )
+        if indicator_cache.cacheable(self.datas[0]):
+            self.sma = indicator_cache.sma(self.datas[0], self.params.maperiod)
+        else:
+            self.sma = bt.indicators.MovingAverageSimple(
+                self.datas[0], period=self.params.maperiod
+            )
         # Informational indicators (for plotting)
         bt.indicators.ExponentialMovingAverage(self.datas[0], period=25)
         bt.indicators.WeightedMovingAverage(self.datas[0], period=25, subplot=True)
@@ -211,6 +248,8 @@ class MaStrategy(bt.Strategy):
         ---------
         * What is the 'Margin' order status?
         """
+        if self.journal is not None:
+            self.journal.order(self, order)
         if order.status in [order.Submitted, order.Accepted]:
             # Do nothing when a order is submitted to or accepted by the broker.
             return
@@ -219,26 +258,26 @@ class MaStrategy(bt.Strategy):
             if order.isbuy():
                 # Buy order executed
                 self.log(
-                    'BUY EXECUTED, Price: %.2f, Cost: %.2f, Comm %.2f' % 
-                    (order.executed.price,
-                     order.executed.value,
-                     order.executed.comm)
+                    'BUY EXECUTED, Price: %.2f, Cost: %.2f, Comm %.2f',
+                    order.executed.price,
+                    order.executed.value,
+                    order.executed.comm
                 )
                 self.buyprice = order.executed.price
                 self.buycomm = order.executed.comm
             elif order.issell():
                 # Sell order executed
                 self.log(
-                    'SELL EXECUTED, Price: %.2f, Cost: %.2f, Comm: %.2f' % 
-                    (order.executed.price,
-                     order.executed.value,
-                     order.executed.comm)
+                    'SELL EXECUTED, Price: %.2f, Cost: %.2f, Comm: %.2f',
+                    order.executed.price,
+                    order.executed.value,
+                    order.executed.comm
                 )
             # Keep a reference of the system clock when an order is executed.
             # The bar_executed can be understood as the elapsed periods
             # since the backtesting started.
             self.bar_executed = len(self)
-            self.log("ORDER EXECUTED at %i-th bar" % self.bar_executed)
+            self.log("ORDER EXECUTED at %i-th bar", self.bar_executed)
         elif order.status in [order.Canceled, order.Margin, order.Rejected]:
             self.log("Order Canceled/Margin/Rejected")
         # Set the pending order to none when the order status is Completed,
@@ -258,9 +297,11 @@ class MaStrategy(bt.Strategy):
         """
         if not trade.isclosed:
             return
+        if self.journal is not None:
+            self.journal.trade(self, trade)
         self.log(
-            "Operation profit, Gross %.2f, Net %.2f" %
-            (trade.pnl, trade.pnlcomm)
+            "Operation profit, Gross %.2f, Net %.2f",
+            trade.pnl, trade.pnlcomm
         )
 
     def next(self):
@@ -272,7 +313,7 @@ class MaStrategy(bt.Strategy):
         ---------
         * What is the system clock?
         """
-        self.log("Close, %.2f" % self.dataclose[0])
+        self.log("Close, %.2f", self.dataclose[0])
         if self.order is not None:
             # Do nothing at the bar when there is a pending order.
             # The order can be a buy or a sell order.
@@ -281,29 +322,50 @@ class MaStrategy(bt.Strategy):
             # Only buy in when hold no shares of this stock.
             if self.dataclose[0] > self.sma[0]:
                 # Current close is above the 15 day moving average.
-                    self.log("BUY CREATE, %.2f" % self.dataclose[0])
+                    self.log("BUY CREATE, %.2f", self.dataclose[0])
                     self.order = self.buy()
         else:
             # Check if the exit criteria is met when hold shares.
             if self.dataclose[0] < self.sma[0]:
                 # Current close is below the 15 day moving average.
-                self.log("SELL CREATED. %.2f" % self.dataclose[0])
+                self.log("SELL CREATED. %.2f", self.dataclose[0])
                 self.order = self.sell()
 
     def stop(self):
-        """"""
-        self.log('(MA Period %2d) Ending Value %.2f' %
-                 (self.params.maperiod, self.broker.getvalue()), doprint=True)
+        """Print the ending value and write the trade journal."""
+        self.log('(MA Period %2d) Ending Value %.2f',
+                 self.params.maperiod, self.broker.getvalue(), doprint=True)
+        if self.journal is not None:
+            self.journal.flush()
 
 class KDJStrategy(bt.Strategy):
     """KDJ Strategy."""
+    # Parameters
+    params = (
+        # Period of the highest high and lowest low
+        ('period', 9),
+        # Period of the K line EMA
+        ('period_k', 3),
+        # Period of the D line EMA
+        ('period_d', 3),
+        ('printlog', True),
+        # Path of the JSON lines trade journal (see journal.Journal)
+        ('journal', None),
+    )
+    # Parameter grid of run(optimize=1)
+    optgrid = {'period': range(5, 16)}
+
     @staticmethod
     def percent(today, yesterday):
         return float(today - yesterday) / today
     
     def __init__(self):
         self.logger = logging.getLogger(__name__)
-        self.logger.setLevel(LOG_LEVEL)
+        self.logger.setLevel(LOG_LEVEL if self.params.printlog else logging.WARNING)
+        # Skip the per-bar log calls when nothing is logged.
+        self.printlog = self.logger.isEnabledFor(logging.INFO)
+        # Trade journal
+        self.journal = Journal(self.params.journal) if self.params.journal else None
 
         self.data_close = self.datas[0].close
         self.volume = self.datas[0].volume
@@ -312,36 +374,44 @@ class KDJStrategy(bt.Strategy):
         self.buyprice = None
         self.buycomm = None
 
+        if indicator_cache.cacheable(self.datas[0]):
+            # Same lines, computed once per data and parameters
+            self.K, self.D, self.J = indicator_cache.kdj(
+                self.datas[0], self.params.period, self.params.period_k, self.params.period_d
+            )
+            return
         # Highest high in 9 days
-        self.high_nine = bt.indicators.Highest(self.data.high, period=9)
+        self.high_nine = bt.indicators.Highest(self.data.high, period=self.params.period)
         # Lowest low in 9 days
-        self.low_nine = bt.indicators.Lowest(self.data.low, period=9)
+        self.low_nine = bt.indicators.Lowest(self.data.low, period=self.params.period)
         # Relative Strength Value (RSV)
         self.rsv = 100 * bt.DivByZero(self.data_close - self.low_nine, self.high_nine - self.low_nine)
         # K is 3-period EMA of RSV
-        self.K = bt.indicators.ExponentialMovingAverage(self.rsv, period=3)
+        self.K = bt.indicators.ExponentialMovingAverage(self.rsv, period=self.params.period_k)
         # D is 3-period EMA of K
-        self.D = bt.indicators.ExponentialMovingAverage(self.K, period=3)
+        self.D = bt.indicators.ExponentialMovingAverage(self.K, period=self.params.period_d)
         # J = 3*K+2*D
         self.J = 3 * self.K - 2 * self.D
     
     def notify_order(self, order):
         """A callback function after order is completed."""
+        if self.journal is not None:
+            self.journal.order(self, order)
         if order.status in [order.Submitted, order.Accepted]:
             return
         elif order.status in [order.Completed]:
             if order.isbuy():
                 self.logger.info(
-                    "BUY EXECUTED, Price: %.2f, Cost: %.2f, Comm %.2f" 
-                     % (order.executed.price, order.executed.value, order.executed.comm)
+                    "BUY EXECUTED, Price: %.2f, Cost: %.2f, Comm %.2f",
+                    order.executed.price, order.executed.value, order.executed.comm
                 )
                 self.buyprice = order.executed.price
                 self.buycomm = order.executed.comm
                 self.bar_executed_close = self.data_close[0]
             else:
                 self.logger.info(
-                    "SELL EXECUTED, Price: %.2f, Cost: %.2f, Comm %.2f"
-                    % (order.executed.price, order.executed.value, order.executed.comm)
+                    "SELL EXECUTED, Price: %.2f, Cost: %.2f, Comm %.2f",
+                    order.executed.price, order.executed.value, order.executed.comm
                 )
             self.bar_executed = len(self)
         elif order.status in [order.Canceled, order.Margin, order.Rejected]:
@@ -351,10 +421,13 @@ class KDJStrategy(bt.Strategy):
     def notify_trade(self, trade):
         if not trade.isclosed:
             return
-        self.logger.info("OPERATION PROFIT, GROSS %.2f, NET %.2f" % (trade.pnl, trade.pnlcomm))
+        if self.journal is not None:
+            self.journal.trade(self, trade)
+        self.logger.info("OPERATION PROFIT, GROSS %.2f, NET %.2f", trade.pnl, trade.pnlcomm)
     
     def next(self):
-        self.logger.info("Close, %.2f" % self.data_close[0])
+        if self.printlog:
+            self.logger.info("Close, %.2f", self.data_close[0])
         if self.order:
             return
         condition1 = self.J[-1] - self.D[-1]
@@ -362,91 +435,235 @@ class KDJStrategy(bt.Strategy):
         if not self.position:
             # J - D
             if condition1 < 0 and condition2 > 0:
-                self.logger.info("BUY CREATE, %.2f" % self.data_close[0])
+                self.logger.info("BUY CREATE, %.2f", self.data_close[0])
                 self.order = self.buy()
         else:
             if condition1 > 0 or condition2 < 0:
-                self.logger.info("SELL CREATED. %.2f" % self.data_close[0])
+                self.logger.info("SELL CREATED. %.2f", self.data_close[0])
                 self.order = self.sell()
 
-def run(strategy, dataname, plot=0, optimize=0):
+    def stop(self):
+        """Write the trade journal."""
+        if self.journal is not None:
+            self.journal.flush()
+
+
+class MomentumStrategy(bt.Strategy):
+    """Cross-sectional momentum strategy for several datas. Every `rebalance`
+    bars the datas are ranked by their return over `lookback` bars, the `topn`
+    best are bought and the `topn` worst are sold short with equal weights.
+    """
+    # Parameters
+    params = (
+        # Bars of the ranked returns
+        ('lookback', 252),
+        # Bars between two rebalances
+        ('rebalance', 21),
+        # Number of datas bought and number of datas sold short
+        ('topn', 50),
+        ('printlog', True),
+    )
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(LOG_LEVEL if self.params.printlog else logging.WARNING)
+        # One indicator per data, read in one pass over the datas per rebalance
+        self.returns = [bt.indicators.RateOfChange(data.close, period=self.params.lookback)
+                        for data in self.datas]
+
+    def next(self):
+        if len(self) % self.params.rebalance != 0:
+            return
+        returns = np.array([roc[0] for roc in self.returns])
+        # NaN returns, e.g. missing bars of an outer join, are not traded.
+        valid = np.flatnonzero(~np.isnan(returns))
+        ranked = valid[np.argsort(returns[valid], kind="stable")]
+        topn = min(self.params.topn, ranked.shape[0] // 2)
+        weights = np.zeros(len(self.datas))
+        if topn > 0:
+            weights[ranked[-topn:]] = 0.5 / topn
+            weights[ranked[:topn]] = -0.5 / topn
+        self.logger.info("REBALANCE, %i long, %i short", topn, topn)
+        value = self.broker.getvalue()
+        held = np.array([self.getposition(data).size * data.close[0] for data in self.datas]) / value
+        # Sell first, so the cash is freed before the buys.
+        for i in np.argsort(weights - held, kind="stable"):
+            if weights[i] != 0 or held[i] != 0:
+                self.order_target_percent(self.datas[i], target=weights[i])
+
+
+def _datapath(name:str) -> str:
+    """Path of a data file name, or of the newest daily csv file of a ticker
+    downloaded with `utils.download_yf`, e.g. 'data/tenb_*_1d.csv' of 'TENB'."""
+    if name.endswith(".csv"):
+        return os.path.join(_PROJECT_FOLDER, "data", name)
+    paths = glob.glob(os.path.join(_PROJECT_FOLDER, "data", "%s_*_1d.csv" % name.lower()))
+    if not paths:
+        raise FileNotFoundError("No data file of %s" % name)
+    return max(paths, key=os.path.getmtime)
+
+
+def run(strategy, dataname, plot=0, optimize=0, sizer="fixed",
+        fromdate=datetime(2021, 5, 27), todate=datetime(2023, 5, 26), profile=0, pstats=None,
+        budget=None, timeframe=None, compression=None):
     """Test run a strategy.
     
     Parameters
     ----------
     strategy: class
         The strategy class
-    dataname: str
+    dataname: str, list or pandas.DataFrame
         File name of the test data, e.g. 'TENB_20210527_20230526_1d.csv'. Only 
-        YahooFinance csv files are supported.
+        YahooFinance csv files are supported. A list of file names or tickers,
+        or a frame of `utils.download_many`, adds one data per ticker, loaded
+        with `feeds.load_panel` as float32 arrays sharing the dates of all the
+        tickers.
+    plot: int
+        Plot the backtest when not 0.
+    optimize: int
+        Backtest every combination of `strategy.optgrid` with `sweep.sweep` when
+        not 0.
+    sizer: str
+        'fixed' to trade 10 shares per order or 'kelly' to size the orders to
+        the rolling Kelly fraction of the portfolio (see kelly.KellySizer).
+    fromdate: datetime
+        Do not pass values before this date. No bar is dropped if None.
+    todate: datetime
+        Do not pass values after this date. No bar is dropped if None.
+    profile: int
+        Print the time of the data load, the indicators, the event loop and
+        the next() calls when not 0 (see profiling.profile_run).
+    pstats: str
+        Path of a cProfile stats file to write when profiling.
+    budget: int
+        Memory budget in MB of the lines of the datas. When preloading the
+        lines as float64 arrays would exceed it, the bars are delivered one by
+        one from the float32 arrays and Cerebro keeps only the bars needed by
+        the indicators (exactbars=1), which rules out plotting.
+    timeframe: int
+        Backtrader timeframe of the bars, e.g. bt.TimeFrame.Minutes. Defaults
+        to the interval in the file name, e.g. Minutes of a '_5m.csv' file of
+        `resample.resample` (see `feeds.file_timeframe`).
+    compression: int
+        Bars per timeframe unit, e.g. 5 for 5 minute bars. Defaults to the
+        interval in the file name.
     
     Returns
     -------
     None
     """
     # Data file
-    # Create Cerebro engine.
-    cerebro = bt.Cerebro()
     if optimize != 0:
-        # Optimize strategy
-        cerebro.optstrategy(strategy, maperiod=range(10, 31))
+        if not isinstance(dataname, str):
+            raise ValueError("Only a single data file can be optimized")
+        # Optimize strategy over its parameter grid on a process pool.
+        from src.sweep import sweep
+        results = sweep(
+            strategy, strategy.optgrid,
+            [os.path.join(_PROJECT_FOLDER, "data", dataname)]
+        )
+        print(results.sort_values("value", ascending=False).to_string(index=False))
+        return
+    # Timeframe of the bars from the interval in the (first) file name
+    first_name = dataname if isinstance(dataname, str) else \
+        None if isinstance(dataname, pd.DataFrame) else dataname[0]
+    interval = file_timeframe(first_name) if first_name is not None else (bt.TimeFrame.Days, 1)
+    timeframe = interval[0] if timeframe is None else timeframe
+    compression = interval[1] if compression is None else compression
+    if isinstance(dataname, str):
+        # Crate a data object from local CSV data downloaded from YahooFinance.
+        # The YahooFinanceCSVData does not comply with today's YahooFinance data,
+        # and GenericCSVData parses every line on every run. ArrayData compiles
+        # the csv file into NumPy arrays once and preloads them without parsing.
+        filepath = os.path.join(_PROJECT_FOLDER, "data", dataname)
+        datas = [ArrayData(
+            dataname=filepath,
+            # Do not pass values before this date.
+            fromdate=fromdate,
+            # Do not pass values after this date.
+            todate=todate,
+            # Intraday bars keep their time, daily bars end with the session.
+            timeframe=timeframe,
+            compression=compression,
+        )]
+        first, last = bar_window(compile_yahoo_csv(filepath, daily=timeframe >= bt.TimeFrame.Days)[0],
+                                 fromdate, todate)
+        bars = last - first
     else:
-        # Add a strategy
-        cerebro.addstrategy(strategy)
-    # Crate a data object from local CSV data downloaded from YahooFinance.
-    # The YahooFinanceCSVData does not comply with today's YahooFinance data.
-    # Hence use GenericCSVData instead.
-    data = bt.feeds.GenericCSVData(
-        dataname=os.path.join(_PROJECT_FOLDER, "data", dataname),
-        # Datetime format
-        dtformat='%Y-%m-%d %H:%M:%S%z',
-        # Do not pass values before this date.
-        fromdate=datetime(2021, 5, 27),
-        # Do not pass values after this date.
-        todate=datetime(2023, 5, 26),
-        # Datetime column position
-        datetime=0,
-        # Time column not exist (-1)
-        time=-1,
-        # Open column position
-        open=1,
-        # High column position
-        high=2,
-        # Low column position
-        low=3,
-        # Close column position
-        close=4,
-        # Volume column position
-        volume=5,
-        # Reverse ordered
-        reverse=False
-    )
-    # Add data object to the Cerebro engine.
-    cerebro.adddata(data)
+        # One date index and one float32 (datas, 5, bars) array for all tickers
+        if not isinstance(dataname, pd.DataFrame):
+            dataname = [_datapath(name) for name in dataname]
+        names, index, values = load_panel(dataname, fromdate=fromdate, todate=todate)
+        datas = [ArrayData(dataname=(index, panel.T), name=name,
+                           timeframe=timeframe, compression=compression)
+                 for name, panel in zip(names, values)]
+        bars = index.shape[0]
+    # Bytes of the 7 float64 lines of the preloaded datas
+    exactbars = 0
+    if budget is not None and len(datas) * bars * 7 * 8 > budget * 2 ** 20:
+        exactbars = 1
+    # Create Cerebro engine.
+    cerebro = bt.Cerebro(exactbars=exactbars)
+    # Add a strategy
+    cerebro.addstrategy(strategy)
+    # Add data objects to the Cerebro engine.
+    for data in datas:
+        cerebro.adddata(data)
     # Set the initial cash value.
     cerebro.broker.setcash(1e5)
     # Sizer seems to be the amount of shares to buy or sell per order.
-    cerebro.addsizer(bt.sizers.FixedSize, stake=10)
+    if sizer == "kelly":
+        # Imported on demand, scipy takes longer to import than a short backtest.
+        from src.kelly import KellySizer
+        cerebro.addsizer(KellySizer)
+    else:
+        cerebro.addsizer(bt.sizers.FixedSize, stake=10)
     # Set the commision to be 0.1%. Degiro has a fixed 2$ commission per transaction for US stocks.
     cerebro.broker.setcommission(commission=1e-3)
+    # Bar returns of the portfolio for the performance metrics
+    cerebro.addanalyzer(analytics.ReturnsAnalyzer, _name="returns")
     # Run backtesting
     print("Starting Portfolio Value: %.2f" % cerebro.broker.getvalue())
-    cerebro.run()
+    if profile != 0:
+        from src.profiling import format_report, profile_run
+        report = profile_run(cerebro, pstats)
+    else:
+        cerebro.run()
     print("Final Portfolio Value: %.2f" % cerebro.broker.getvalue())
+    analysis = cerebro.runstrats[0][0].analyzers.returns.get_analysis()
+    metrics = analytics.summary(analysis["returns"], analysis["traded"],
+                                periods=analytics.periods_per_year(timeframe, compression)).iloc[0]
+    print("Sharpe: %.2f, Sortino: %.2f, Max Drawdown: %.2f%% (%i bars), Turnover: %.2f" % (
+        metrics["sharpe"], metrics["sortino"], 100 * metrics["max_drawdown"],
+        metrics["drawdown_duration"], metrics["turnover"]
+    ))
+    if profile != 0:
+        print(format_report(report))
     if plot != 0:
-        cerebro.plot()
+        if exactbars:
+            logger.warning("Cannot plot the bars dropped to stay within the memory budget")
+        else:
+            cerebro.plot()
 
 if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument("--strategy", type=str)
-    parser.add_argument("--dataname", type=str)
+    parser.add_argument("--dataname", nargs="+", help="Data file, or data files or tickers")
     parser.add_argument("--optimize", default=0, type=int)
     parser.add_argument("--plot", default=0, type=int)
+    parser.add_argument("--sizer", default="fixed", choices=["fixed", "kelly"])
+    parser.add_argument("--profile", default=0, type=int)
+    parser.add_argument("--pstats", type=str)
+    parser.add_argument("--budget", type=int, help="Memory budget of the datas in MB")
     args = parser.parse_args()
     class_ = getattr(sys.modules[__name__], args.strategy)
     run(
         strategy=class_, 
-        dataname=args.dataname,
+        dataname=args.dataname[0] if len(args.dataname) == 1 else args.dataname,
         plot=args.plot,
-        optimize=args.optimize
+        optimize=args.optimize,
+        sizer=args.sizer,
+        profile=args.profile,
+        pstats=args.pstats,
+        budget=args.budget
     )
\ No newline at end of file
@@ -0,0 +1,203 @@
+"""Parameter sweeps
+* Run a strategy over every combination of a parameter grid and a list of data
+  files on a process pool.
+* Each data file is parsed once by the parent process and written as NumPy arrays
+  to a temporary folder (in /dev/shm when available). The workers memory map the
+  arrays, so the pages are shared between the processes instead of re-parsing
+  the csv file per worker.
+* Optionally the workers share an indicator cache (see `indicator_cache.py`)
+  in the same folder, so an indicator is computed once per data file and
+  parameters across all the backtests of the sweep.
+* The workers return the bar returns of the backtests and the metrics of all
+  the backtests are computed at once by `analytics.summary`.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import product
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+import backtrader as bt
+
+from src.feeds import OHLCV, ArrayData, load_yahoo_csv
+from src import analytics, indicator_cache, vectorized
+
+# Data frames of the memory mapped data files, keyed by the data file name.
+# Filled by _init_worker in every worker process.
+_FRAMES = {}
+
+
+def _dump(df:pd.DataFrame, folder:str, key:int) -> dict:
+    """Write the index and the OHLCV block of a frame as .npy files."""
+    paths = {
+        "index": os.path.join(folder, "%i_index.npy" % key),
+        "values": os.path.join(folder, "%i_values.npy" % key),
+    }
+    np.save(paths["index"], df.index.values.astype("datetime64[ns]"))
+    np.save(paths["values"], np.ascontiguousarray(df.loc[:, OHLCV].values, dtype=float))
+    return paths
+
+
+def _attach(paths:dict) -> pd.DataFrame:
+    """Memory map the arrays written by _dump back into a frame."""
+    index = np.load(paths["index"], mmap_mode="r")
+    values = np.load(paths["values"], mmap_mode="r")
+    return pd.DataFrame(
+        values, index=pd.DatetimeIndex(np.asarray(index), name="datetime"),
+        columns=OHLCV, copy=False
+    )
+
+
+def _init_worker(specs:dict, cachedir:str=None) -> None:
+    """Attach all data files once per worker process and turn the shared
+    indicator cache on."""
+    _FRAMES.clear()
+    for dataname, paths in specs.items():
+        _FRAMES[dataname] = _attach(paths)
+    indicator_cache.set_cache(
+        indicator_cache.IndicatorCache(cachedir) if cachedir is not None else None
+    )
+
+
+def backtest_cerebro(strategy, df:pd.DataFrame, params:dict, history:pd.DataFrame=None) -> tuple:
+    """Backtest a strategy with the Cerebro engine and the broker settings of `strategies.run`.
+
+    `history` is the frame `df` is a window of, see `feeds.ArrayData`.
+
+    Returns
+    -------
+    tuple
+        (final portfolio value, portfolio value of every bar, number of closed
+        trades, traded value of every bar as a fraction of the portfolio value)
+    """
+    params = dict(params)
+    if "printlog" in strategy.params._getkeys():
+        # The backtests of a sweep do not log every bar, unless asked to.
+        params.setdefault("printlog", False)
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.addstrategy(strategy, **params)
+    cerebro.adddata(ArrayData(dataname=df, history=history))
+    cerebro.broker.setcash(vectorized.CASH)
+    cerebro.addsizer(bt.sizers.FixedSize, stake=vectorized.STAKE)
+    cerebro.broker.setcommission(commission=vectorized.COMMISSION)
+    cerebro.addanalyzer(analytics.ReturnsAnalyzer, _name="returns")
+    cerebro.addanalyzer(bt.analyzers.TradeAnalyzer, _name="trades")
+    result = cerebro.run()[0]
+    analysis = result.analyzers.returns.get_analysis()
+    trades = result.analyzers.trades.get_analysis()
+    closed = trades.get("total", {}).get("closed", 0)
+    traded = np.zeros(analysis["values"].shape[0])
+    traded[1:] = analysis["traded"]
+    return cerebro.broker.getvalue(), analysis["values"], closed, traded
+
+
+def backtest_vectorized(strategy, df:pd.DataFrame, params:dict) -> tuple:
+    """Backtest a strategy with the vectorized engine, see `backtest_cerebro`."""
+    result = vectorized.backtest(strategy, df, **params)
+    values = result.equity.values
+    traded = np.zeros(values.shape[0])
+    trades = result.trades
+    np.add.at(traded, trades["entry_bar"].values, trades["size"].values * trades["entry_price"].values)
+    np.add.at(traded, trades["exit_bar"].values, trades["size"].values * trades["exit_price"].values)
+    return result.value, values, trades.shape[0], traded / values
+
+
+# Backtest function of every engine, called with (strategy, df, params) and
+# returning the tuple of `backtest_cerebro`
+ENGINES = {
+    "cerebro": backtest_cerebro,
+    "vectorized": backtest_vectorized,
+}
+
+
+def _run_job(job:tuple) -> dict:
+    """Run one (data file, parameters) combination in a worker."""
+    strategy, engine, dataname, params = job
+    cache = indicator_cache.get_cache()
+    before = cache.stats() if cache is not None else None
+    value, values, trades, traded = ENGINES[engine](strategy, _FRAMES[dataname], params)
+    row = {"dataname": dataname}
+    row.update(params)
+    row.update({"value": value, "trades": trades})
+    # Bar to bar returns, the metrics are computed for all the rows at once.
+    row["_returns"] = values[1:] / values[:-1] - 1
+    row["_traded"] = traded[1:]
+    if cache is not None:
+        after = cache.stats()
+        row["_cache"] = (after["hits"] - before["hits"], after["misses"] - before["misses"])
+    return row
+
+
+def sweep(strategy, grid:dict, datanames:list, processes:int=None, engine:str="cerebro",
+          fromdate:datetime=vectorized.FROMDATE, todate:datetime=vectorized.TODATE,
+          cache:bool=False) -> pd.DataFrame:
+    """Backtest a strategy for every combination of parameters and data files.
+
+    Parameters
+    ----------
+    strategy: class
+        The strategy class, e.g. `strategies.MaStrategy`.
+    grid: dict
+        Values to test per parameter, e.g. {'maperiod': range(10, 31)}.
+    datanames: list
+        Paths of YahooFinance csv files.
+    processes: int
+        Number of worker processes. Defaults to the number of CPUs. With 1 the
+        backtests run in the calling process.
+    engine: str
+        'cerebro' to run the backtrader engine or 'vectorized' to use the array
+        based engine of `vectorized.py` (only for the strategies it implements).
+    fromdate: datetime
+        Do not pass values before this date.
+    todate: datetime
+        Do not pass values after this date.
+    cache: bool
+        Share the indicators of the cerebro backtests through an indicator
+        cache. Worth it when the grid repeats indicator parameters, e.g.
+        KDJStrategy over period_k, or on long data.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per combination with the data file name, the parameters, the
+        final portfolio value, the number of closed trades and the metrics of
+        `analytics.summary`, e.g. the annualized Sharpe ratio. The hits and misses of the indicator cache are in
+        `attrs['indicator_cache']`.
+    """
+    if engine not in ENGINES:
+        raise ValueError("Unknown engine %s, expected one of %s" % (engine, list(ENGINES)))
+    names = list(grid)
+    combinations = [dict(zip(names, values)) for values in product(*(grid[name] for name in names))]
+    jobs = [(strategy, engine, dataname, params) for dataname in datanames for params in combinations]
+    processes = processes or os.cpu_count()
+    shm = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    with tempfile.TemporaryDirectory(dir=shm) as folder:
+        specs = {
+            dataname: _dump(load_yahoo_csv(dataname, fromdate=fromdate, todate=todate), folder, key)
+            for key, dataname in enumerate(dict.fromkeys(datanames))
+        }
+        cachedir = os.path.join(folder, "indicators") if cache else None
+        if processes == 1:
+            previous = indicator_cache.get_cache()
+            _init_worker(specs, cachedir)
+            rows = [_run_job(job) for job in jobs]
+            _FRAMES.clear()
+            indicator_cache.set_cache(previous)
+        else:
+            chunksize = max(1, len(jobs) // (processes * 4))
+            with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                     initargs=(specs, cachedir)) as executor:
+                rows = list(executor.map(_run_job, jobs, chunksize=chunksize))
+    counters = [row.pop("_cache") for row in rows if "_cache" in row]
+    metrics = analytics.summary(
+        [row.pop("_returns") for row in rows], [row.pop("_traded") for row in rows],
+        periods=analytics.TRADING_DAYS
+    )
+    df = pd.DataFrame(rows, columns=["dataname"] + names + ["value", "trades"])
+    df = pd.concat([df, metrics.drop(columns="return")], axis=1)
+    df.attrs["indicator_cache"] = {
+        "hits": sum(hits for hits, _ in counters),
+        "misses": sum(misses for _, misses in counters),
+    }
+    return df
@@ -1,67 +1,123 @@
+import glob
 import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import numpy as np
 import pandas as pd
+import matplotlib.dates as mdates
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection, PolyCollection
+from matplotlib.figure import Figure
 import yfinance as yf
 
-def plot_candle_stick(df:pd.DataFrame, price_col:list=["Open", "High", "Low", "Close"], **kwargs) -> None:
+from src.cache import _INTERVALS, OHLCCache, period_start
+
+def decimate_ohlc(x:np.ndarray, ohlc:np.ndarray, buckets:int) -> tuple:
+    """Aggregate bars into at most `buckets` equal spans of x, e.g. one span per
+    pixel of the axis: open is the first open, high the highest high, low the
+    lowest low and close the last close of the span.
+
+    Parameters
+    ----------
+    x: numpy.ndarray
+        Increasing positions of the bars.
+    ohlc: numpy.ndarray
+        (bars, 4) open, high, low and close.
+    buckets: int
+        Number of spans.
+
+    Returns
+    -------
+    tuple
+        (x, ohlc, width) of the non-empty spans, x being the middle of the span
+        and width the length of a span. The bars are returned as they are when
+        there are no more bars than spans.
+    """
+    if x.shape[0] <= buckets:
+        width = np.median(np.diff(x)) if x.shape[0] > 1 else 1.0
+        return x, ohlc, width
+    width = (x[-1] - x[0]) / buckets
+    keys = np.minimum(((x - x[0]) / width).astype(np.int64), buckets - 1)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], keys.shape[0]] - 1
+    out = np.column_stack([
+        ohlc[starts, 0],
+        np.maximum.reduceat(ohlc[:, 1], starts),
+        np.minimum.reduceat(ohlc[:, 2], starts),
+        ohlc[ends, 3],
+    ])
+    return x[0] + (keys[starts] + 0.5) * width, out, width
+
+def plot_candle_stick(df:pd.DataFrame, price_col:list=["Open", "High", "Low", "Close"],
+                      filepath:str=None, **kwargs):
     """Plot the candle stick chart.
+
+    The bodies and the wicks are drawn as two collections, and long histories
+    are decimated to one candle per pixel of the axis (see `decimate_ohlc`), so
+    the time to render does not grow with the number of bars.
     
     Parameters
     ----------
     df: pandas.DataFrame
-        The data.
+        The data, with increasing index.
     price_col: list
         The column name for Open, High, Low and Close in sequence.
+    filepath: str
+        Save the chart to this file, e.g. a .png or .svg file, without a GUI
+        backend. If not specified then the chart is shown with `plt.show()`.
+    kwargs:
+        figsize, title and dpi of the figure.
     
     Returns
     -------
-    None
+    matplotlib.axes.Axes
     """
-    stock_prices = df.copy()
-    stock_prices.rename({
-        price_col[0]:"open",
-        price_col[1]:"high",
-        price_col[2]:"low",
-        price_col[3]:"close"
-    }, axis=1, inplace=True)
     # Keyword arguments
     figsize=[10, 5] if "figsize" not in kwargs else kwargs["figsize"]
     title='Stock Prices' if "title" not in kwargs else kwargs["title"]
-    # Plot
-    plt.figure(figsize=figsize)
-    # Create a new DataFrame called "up" that stores the stock_prices
-    # when the closing stock price is greater than or equal to the opening stock price
-    up = stock_prices[stock_prices.close >= stock_prices.open]
-    # Create a new DataFrame called "down" that stores the stock_prices
-    # when the closing stock price is lesser than the opening stock price
-    down = stock_prices[stock_prices.close < stock_prices.open]
-    # When the stock prices have decreased, then it
-    # will be represented by red color candlestick
-    col1 = 'red'
-    # When the stock prices have increased, then it
-    # will be represented by green color candlestick
-    col2 = 'green'
-    # Set the width of candlestick elements
-    width = 0.4
-    width2 = 0.05
-    # Plot the up prices of the stock
-    plt.bar(up.index, up.close-up.open, width, bottom=up.open, color=col2)
-    plt.bar(up.index, up.high-up.close, width2, bottom=up.close, color=col2)
-    plt.bar(up.index, up.low-up.open, width2, bottom=up.open, color=col2)
-    # Plot the down prices of the stock
-    plt.bar(down.index, down.close-down.open, width, bottom=down.open, color=col1)
-    plt.bar(down.index, down.high-down.open, width2, bottom=down.open, color=col1)
-    plt.bar(down.index, down.low-down.close, width2, bottom=down.close, color=col1)
+    dpi=100 if "dpi" not in kwargs else kwargs["dpi"]
+    # A figure without pyplot needs no display and is not kept by pyplot.
+    fig = Figure(figsize=figsize, dpi=dpi) if filepath is not None else plt.figure(figsize=figsize, dpi=dpi)
+    ax = fig.add_subplot()
+    index = df.index
+    if isinstance(index, pd.DatetimeIndex):
+        # Local wall clock times, like the labels of the downloads
+        x = mdates.date2num((index.tz_localize(None) if index.tz is not None else index).values)
+    else:
+        x = np.asarray(index, dtype=float)
+    ohlc = np.column_stack([np.asarray(df[column], dtype=float) for column in price_col])
+    valid = ~np.isnan(ohlc).any(axis=1)
+    x, ohlc, width = decimate_ohlc(x[valid], ohlc[valid], max(1, int(ax.get_window_extent().width)))
+    # Green candle stick when the price has increased, red otherwise
+    colors = np.where(ohlc[:, 3] >= ohlc[:, 0], "green", "red")
+    wicks = np.stack([np.column_stack([x, ohlc[:, 2]]), np.column_stack([x, ohlc[:, 1]])], axis=1)
+    ax.add_collection(LineCollection(wicks, colors=colors, linewidths=0.5))
+    left, right = x - 0.4 * width, x + 0.4 * width
+    bodies = np.stack([
+        np.column_stack([left, ohlc[:, 0]]), np.column_stack([left, ohlc[:, 3]]),
+        np.column_stack([right, ohlc[:, 3]]), np.column_stack([right, ohlc[:, 0]]),
+    ], axis=1)
+    # The edges keep the bodies of less than a pixel visible.
+    ax.add_collection(PolyCollection(bodies, facecolors=colors, edgecolors=colors, linewidths=0.5))
+    ax.autoscale_view()
+    if isinstance(index, pd.DatetimeIndex):
+        ax.xaxis_date()
     # Rotate the x-axis tick labels at 45 degrees towards right
-    plt.xticks(rotation=45, ha='right')
-    # Display the candlestick chart of stock data
-    plt.title(title)
-    plt.xlabel('Date')
-    plt.ylabel('Price (USD)')
-    plt.show()
-
-def download_yf(ticker:str, period:str, interval:str="1d", path:str=None) -> pd.DataFrame:
+    for label in ax.get_xticklabels():
+        label.set_rotation(45)
+        label.set_ha("right")
+    ax.set_title(title)
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Price (USD)')
+    if filepath is not None:
+        fig.savefig(filepath, bbox_inches="tight")
+    else:
+        plt.show()
+    return ax
+
+def download_yf(ticker:str, period:str, interval:str="1d", path:str=None, cache:str=None) -> pd.DataFrame:
     """Download OHLC data from yahoo finance.
 
     Parameters
@@ -75,18 +131,151 @@ def download_yf(ticker:str, period:str, interval:str="1d", path:str=None) -> pd.
     path: str
         The path to save the data. The data is saved as CSV. If not specified then
         the data is not saved.
+    cache: str
+        Folder of the on-disk OHLC cache (see `cache.OHLCCache`). If specified
+        then only the bars after the last cached bar are downloaded, and nothing
+        is downloaded when the cache is up to date.
 
     Returns
     -------
     pandas.DataFrame
     """
     tenb_ticker = yf.Ticker(ticker)
-    tenb_df = tenb_ticker.history(period=period, interval=interval, auto_adjust=True)
+    if cache is None:
+        tenb_df = tenb_ticker.history(period=period, interval=interval, auto_adjust=True)
+    else:
+        tenb_df = OHLCCache(cache).history(tenb_ticker, ticker, period, interval)
     if path is not None:
         # Save to local
-        first_date = datetime.strftime(tenb_df.index.min(), "%Y%m%d")
-        last_date = datetime.strftime(tenb_df.index.max(), "%Y%m%d")
-        filename = "%s_%s_%s_%s.csv" % (ticker.lower(), first_date, last_date, interval.lower())
-        filepath = os.path.join(path, filename)
-        tenb_df.to_csv(filepath, index=True)
-    return tenb_df
\ No newline at end of file
+        tenb_df.to_csv(_csv_path(ticker, tenb_df, interval, path), index=True)
+    return tenb_df
+
+def _csv_path(ticker:str, df:pd.DataFrame, interval:str, path:str) -> str:
+    """Path of the csv file of `download_yf`, e.g. 'tenb_20210527_20230526_1d.csv'."""
+    first_date = datetime.strftime(df.index.min(), "%Y%m%d")
+    last_date = datetime.strftime(df.index.max(), "%Y%m%d")
+    filename = "%s_%s_%s_%s.csv" % (ticker.lower(), first_date, last_date, interval.lower())
+    return os.path.join(path, filename)
+
+def _latest_csv(ticker:str, interval:str, path:str) -> str:
+    """Most recently written csv file of `download_yf` of a ticker, None if there is none."""
+    pattern = re.compile(r"^%s_\d{8}_\d{8}_%s\.csv$" % (re.escape(ticker.lower()), re.escape(interval.lower())))
+    filepaths = [
+        filepath for filepath in glob.glob(os.path.join(glob.escape(path), "*.csv"))
+        if pattern.match(os.path.basename(filepath))
+    ]
+    return max(filepaths, key=os.path.getmtime) if filepaths else None
+
+def _download_csv(ticker:str, period:str, interval:str="1d", path:str=None) -> pd.DataFrame:
+    """Return the bars of a period from the csv file of a previous `download_yf`
+    under `path`, downloading only what the file does not have.
+
+    * Nothing is downloaded when the file covers the period and was written
+      less than one interval ago.
+    * Otherwise the bars from the last bar of the file on are downloaded and
+      appended, and the file is replaced by one with the new date range.
+    * Everything is downloaded again when there is no file, when the file does
+      not reach back to the start of the period or when the close of its last
+      bar changed, e.g. because of a dividend adjustment.
+
+    The index is in UTC, whether the bars are read from the file or downloaded.
+    """
+    filepath = _latest_csv(ticker, interval, path)
+    now = pd.Timestamp.now(tz="UTC")
+    start = period_start(period, now)
+    df = None
+    if filepath is not None:
+        df = pd.read_csv(filepath, index_col=0)
+        df.index = pd.DatetimeIndex(pd.to_datetime(df.index, utc=True), name=df.index.name)
+        # A few days of slack for the weekends and holidays at the start of the period
+        if df.shape[0] == 0 or (start is not None and df.index[0] > start + pd.Timedelta(days=7)):
+            df = None
+    written = None
+    if df is None:
+        df = download_yf(ticker, period, interval, path=path)
+        written = _csv_path(ticker, df, interval, path)
+    elif now - pd.Timestamp(os.path.getmtime(filepath), unit="s", tz="UTC") >= \
+            _INTERVALS.get(interval, pd.Timedelta(minutes=1)):
+        anchor = df.index[-1]
+        new = yf.Ticker(ticker).history(start=anchor, interval=interval, auto_adjust=True)
+        new = new[new.index >= anchor]
+        if new.shape[0] > 0 and new.index[0] == anchor and not np.isclose(
+                new["Close"].iloc[0], df["Close"].iloc[-1]):
+            # The history was adjusted, download it again.
+            df = download_yf(ticker, period, interval, path=path)
+        else:
+            if new.shape[0] > 0:
+                new.index = new.index.tz_convert("UTC")
+                df = pd.concat([df[df.index < new.index[0]], new.loc[:, df.columns]])
+            df.to_csv(_csv_path(ticker, df, interval, path), index=True)
+        written = _csv_path(ticker, df, interval, path)
+    if filepath is not None and written is not None and written != filepath:
+        # Replaced by the file with the new date range
+        os.remove(filepath)
+    df = df.tz_convert("UTC")
+    return df if start is None else df[df.index >= start]
+
+def _download_retry(ticker:str, retries:int, backoff:float, **kwargs) -> pd.DataFrame:
+    """Call `download_yf`, or `_download_csv` when the bars are saved as csv
+    files without cache, retrying with exponential backoff on errors and empty
+    data."""
+    download = download_yf
+    if kwargs.get("path") is not None and kwargs.get("cache") is None:
+        kwargs.pop("cache", None)
+        download = _download_csv
+    for attempt in range(retries + 1):
+        try:
+            df = download(ticker, **kwargs)
+            if df.shape[0] > 0:
+                return df
+            error = ValueError("No data downloaded for %s" % ticker)
+        except Exception as e:
+            error = e
+        if attempt < retries:
+            time.sleep(backoff * 2 ** attempt)
+    raise error
+
+def download_many(tickers:list, period:str, interval:str="1d", column:str=None, path:str=None,
+                  cache:str=None, max_workers:int=8, retries:int=3, backoff:float=1.0,
+                  join:str="inner") -> pd.DataFrame:
+    """Download OHLC data of several tickers concurrently into one aligned frame.
+
+    Parameters
+    ----------
+    tickers: list
+        Tickers, e.g. ['SPY', 'OIH', 'IAT', 'XRT'].
+    period: str
+        Length of the data, e.g. '2y', '1mo'.
+    interval: str
+        Data interval, e.g. '1d' for daily data.
+    column: str
+        Keep only this column, e.g. 'Close', and return one column per ticker.
+        If not specified then the columns are a (ticker, column) MultiIndex.
+    path: str
+        The path to save the data, see `download_yf`. Without `cache` the csv
+        files of earlier downloads in this folder are read, and only the bars
+        they do not have are downloaded.
+    cache: str
+        Folder of the on-disk OHLC cache, see `download_yf`.
+    max_workers: int
+        Maximum number of concurrent downloads.
+    retries: int
+        Number of retries per ticker.
+    backoff: float
+        Seconds to wait before the first retry. The wait doubles after every retry.
+    join: str
+        'inner' keeps the dates of all tickers like `pd.merge`, 'outer' keeps
+        the dates of any ticker.
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    kwargs = dict(period=period, interval=interval, path=path, cache=cache)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tickers)))) as executor:
+        frames = list(executor.map(
+            lambda ticker: _download_retry(ticker, retries, backoff, **kwargs), tickers
+        ))
+    if column is not None:
+        frames = [df[column] for df in frames]
+    return pd.concat(frames, axis=1, keys=tickers, join=join).sort_index()
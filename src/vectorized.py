@@ -0,0 +1,296 @@
+"""Vectorized backtests
+* Array based counterparts of the strategies in src.strategies. The signals are
+  computed with NumPy for the whole history at once and the orders are filled the
+  way the Cerebro engine of `strategies.run` fills them: market orders created at
+  a bar are executed at the open of the next bar, with a fixed stake and a
+  percentage commission.
+* Only the strategy logic is replicated. Use `strategies.run` for plotting and
+  for strategies that are not listed in `SIGNALS`.
+"""
+from collections import namedtuple
+from datetime import datetime
+import math
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from src.feeds import load_yahoo_csv
+
+# Broker settings used by strategies.run
+CASH = 1e5
+STAKE = 10
+COMMISSION = 1e-3
+# Date range used by strategies.run
+FROMDATE = datetime(2021, 5, 27)
+TODATE = datetime(2023, 5, 26)
+# The informational indicators of MaStrategy delay the first call of next()
+# until MACDHisto (26 + 9 - 1 bars) is available.
+_MA_INFO_MINPERIOD = 34
+
+BacktestResult = namedtuple("BacktestResult", ["value", "trades", "equity"])
+
+
+def sma(x:np.ndarray, period:int) -> np.ndarray:
+    """Simple moving average. The first `period - 1` values are NaN."""
+    out = np.full(x.shape[0], np.nan)
+    if x.shape[0] >= period:
+        out[period - 1:] = sliding_window_view(x, period).sum(axis=1) / period
+    return out
+
+
+def ema(x:np.ndarray, period:int) -> np.ndarray:
+    """Exponential moving average seeded with the simple moving average of the
+    first `period` valid values, as `bt.indicators.ExponentialMovingAverage` does.
+    """
+    out = np.full(x.shape[0], np.nan)
+    valid = np.flatnonzero(~np.isnan(x))
+    if valid.shape[0] < period:
+        return out
+    first = valid[0] + period - 1
+    alpha = 2.0 / (1 + period)
+    out[first] = math.fsum(x[valid[0]:first + 1]) / period
+    if first + 1 < x.shape[0]:
+        # Imported on demand, scipy.signal takes about a second to import.
+        from scipy.signal import lfilter
+        # y[i] = (1 - alpha) * y[i - 1] + alpha * x[i]
+        zi = [(1 - alpha) * out[first]]
+        out[first + 1:], _ = lfilter([alpha], [1, -(1 - alpha)], x[first + 1:], zi=zi)
+    return out
+
+
+def rolling_max(x:np.ndarray, period:int) -> np.ndarray:
+    """Highest value in the last `period` bars. The first `period - 1` values are NaN."""
+    out = np.full(x.shape[0], np.nan)
+    if x.shape[0] >= period:
+        out[period - 1:] = sliding_window_view(x, period).max(axis=1)
+    return out
+
+
+def rolling_min(x:np.ndarray, period:int) -> np.ndarray:
+    """Lowest value in the last `period` bars. The first `period - 1` values are NaN."""
+    out = np.full(x.shape[0], np.nan)
+    if x.shape[0] >= period:
+        out[period - 1:] = sliding_window_view(x, period).min(axis=1)
+    return out
+
+
+def kdj(high:np.ndarray, low:np.ndarray, close:np.ndarray,
+        period:int=9, period_k:int=3, period_d:int=3) -> tuple:
+    """K, D and J lines of the KDJ indicator as computed in `KDJStrategy`.
+
+    Returns
+    -------
+    tuple
+        (K, D, J) arrays.
+    """
+    return kdj_from_range(rolling_max(high, period), rolling_min(low, period), close,
+                          period_k=period_k, period_d=period_d)
+
+
+def kdj_from_range(high_n:np.ndarray, low_n:np.ndarray, close:np.ndarray,
+                   period_k:int=3, period_d:int=3) -> tuple:
+    """K, D and J lines from the highest high and lowest low of the period.
+
+    Returns
+    -------
+    tuple
+        (K, D, J) arrays.
+    """
+    num = close - low_n
+    den = high_n - low_n
+    # bt.DivByZero returns 0 when the denominator is 0
+    rsv = 100 * np.divide(num, den, out=np.zeros_like(num), where=den != 0)
+    rsv[np.isnan(den)] = np.nan
+    K = ema(rsv, period_k)
+    D = ema(K, period_d)
+    J = 3 * K - 2 * D
+    return K, D, J
+
+
+def _previous(x:np.ndarray, ago:int) -> np.ndarray:
+    """Value `ago` bars ago. Like the preloaded backtrader lines, the first bars
+    wrap around to the end of the data.
+    """
+    return np.roll(x, ago)
+
+
+def test_strategy_signals(df:pd.DataFrame, exitbars:int=5) -> dict:
+    """Signals of `TestStrategy`: buy after two consecutive falling closes and
+    sell `exitbars` bars after the buy is executed.
+    """
+    close = df["close"].values
+    close1 = _previous(close, 1)
+    close2 = _previous(close, 2)
+    entry = (close < close1) & (close1 < close2)
+    return {"start": 0, "entry": entry, "exit": None, "exitbars": exitbars}
+
+
+def ma_strategy_signals(df:pd.DataFrame, maperiod:int=15) -> dict:
+    """Signals of `MaStrategy`: buy when the close is above its simple moving
+    average and sell when it is below.
+    """
+    close = df["close"].values
+    ma = sma(close, maperiod)
+    with np.errstate(invalid="ignore"):
+        entry = close > ma
+        exit_ = close < ma
+    start = max(maperiod, _MA_INFO_MINPERIOD) - 1
+    return {"start": start, "entry": entry, "exit": exit_, "exitbars": None}
+
+
+def kdj_strategy_signals(df:pd.DataFrame, period:int=9, period_k:int=3, period_d:int=3) -> dict:
+    """Signals of `KDJStrategy`: buy when J crosses above D and sell when J is
+    below D or was above D on the previous bar.
+    """
+    _, D, J = kdj(df["high"].values, df["low"].values, df["close"].values,
+                  period=period, period_k=period_k, period_d=period_d)
+    diff = J - D
+    diff1 = _previous(diff, 1)
+    with np.errstate(invalid="ignore"):
+        entry = (diff1 < 0) & (diff > 0)
+        exit_ = (diff1 > 0) | (diff < 0)
+    start = period + period_k + period_d - 3
+    return {"start": start, "entry": entry, "exit": exit_, "exitbars": None}
+
+
+# Signal functions keyed by the name of the strategy class in src.strategies
+SIGNALS = {
+    "TestStrategy": test_strategy_signals,
+    "MaStrategy": ma_strategy_signals,
+    "KDJStrategy": kdj_strategy_signals,
+}
+
+
+def simulate(df:pd.DataFrame, start:int, entry:np.ndarray, exit:np.ndarray=None,
+             exitbars:int=None, cash:float=CASH, stake:int=STAKE,
+             commission:float=COMMISSION) -> BacktestResult:
+    """Fill long only market orders the way the backtrader broker does.
+
+    An order created at bar i is executed at the open of bar i + 1. While an
+    order is pending no new order is created. A buy is rejected (margin) when the
+    cash does not cover the stake at the close of the creating bar.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        OHLCV data as returned by `feeds.load_yahoo_csv`.
+    start: int
+        Index of the first bar at which the strategy makes decisions.
+    entry: numpy.ndarray
+        Boolean array, buy when flat.
+    exit: numpy.ndarray
+        Boolean array, sell when long. Ignored if `exitbars` is specified.
+    exitbars: int
+        Sell this many bars after the buy is executed.
+    cash: float
+        Starting cash.
+    stake: int
+        Number of shares per order.
+    commission: float
+        Commission as a fraction of the order value.
+
+    Returns
+    -------
+    BacktestResult
+        Final portfolio value, trade list and the portfolio value of every bar.
+    """
+    open_ = df["open"].values
+    close = df["close"].values
+    n = close.shape[0]
+    entries = np.flatnonzero(entry)
+    exits = np.flatnonzero(exit) if exit is not None else None
+    # Cash and position changes at the bar when the orders are executed
+    dcash = np.zeros(n)
+    dpos = np.zeros(n)
+    trades = []
+    balance = cash
+    i = start
+    while True:
+        k = np.searchsorted(entries, i)
+        if k == entries.shape[0]:
+            break
+        signal = entries[k]
+        fill = signal + 1
+        if fill >= n:
+            break
+        if balance - stake * close[signal] * (1 + commission) < 0:
+            # Margin, the order is not accepted
+            i = signal + 1
+            continue
+        entry_price = open_[fill]
+        entry_comm = stake * entry_price * commission
+        dcash[fill] -= stake * entry_price + entry_comm
+        balance += dcash[fill]
+        dpos[fill] += stake
+        # next() already runs with the position at the bar of the fill
+        if exitbars is not None:
+            signal = fill + exitbars
+        else:
+            k = np.searchsorted(exits, fill)
+            signal = exits[k] if k < exits.shape[0] else n
+        if signal + 1 >= n:
+            break
+        fill_exit = signal + 1
+        exit_price = open_[fill_exit]
+        exit_comm = stake * exit_price * commission
+        dcash[fill_exit] += stake * exit_price - exit_comm
+        balance += stake * exit_price - exit_comm
+        dpos[fill_exit] -= stake
+        pnl = stake * (exit_price - entry_price)
+        trades.append((df.index[fill], fill, entry_price, df.index[fill_exit], fill_exit,
+                       exit_price, stake, pnl, pnl - entry_comm - exit_comm))
+        i = fill_exit
+    equity = pd.Series(cash + np.cumsum(dcash) + np.cumsum(dpos) * close, index=df.index)
+    trades = pd.DataFrame(trades, columns=[
+        "entry_date", "entry_bar", "entry_price", "exit_date", "exit_bar",
+        "exit_price", "size", "pnl", "pnlcomm"
+    ])
+    value = equity.iloc[-1] if n > 0 else cash
+    return BacktestResult(value, trades, equity)
+
+
+def backtest(strategy, df:pd.DataFrame, **params) -> BacktestResult:
+    """Backtest a strategy on OHLCV data.
+
+    Parameters
+    ----------
+    strategy: class or str
+        The strategy class in src.strategies, or its name.
+    df: pandas.DataFrame
+        OHLCV data as returned by `feeds.load_yahoo_csv`.
+    params:
+        Strategy parameters, e.g. `exitbars` or `maperiod`.
+
+    Returns
+    -------
+    BacktestResult
+    """
+    name = getattr(strategy, "__name__", strategy)
+    if name not in SIGNALS:
+        raise ValueError("No vectorized implementation of strategy %s" % name)
+    return simulate(df, **SIGNALS[name](df, **params))
+
+
+def run(strategy, filepath:str, fromdate:datetime=FROMDATE, todate:datetime=TODATE,
+        **params) -> BacktestResult:
+    """Vectorized counterpart of `strategies.run`.
+
+    Parameters
+    ----------
+    strategy: class or str
+        The strategy class in src.strategies, or its name.
+    filepath: str
+        Path of a YahooFinance csv file.
+    fromdate: datetime
+        Do not pass values before this date.
+    todate: datetime
+        Do not pass values after this date.
+    params:
+        Strategy parameters.
+
+    Returns
+    -------
+    BacktestResult
+    """
+    df = load_yahoo_csv(filepath, fromdate=fromdate, todate=todate)
+    return backtest(strategy, df, **params)
@@ -0,0 +1,291 @@
+"""Walk-forward evaluation
+* Split the bars into consecutive train and test folds, rolling or anchored,
+  instead of one fixed training set of 252 * 2 days or the fixed date range of
+  `strategies.run`.
+* The parameters are optimized on every train fold and evaluated on the test
+  fold that follows it, which gives one row of out-of-sample metrics per fold.
+* Works for the strategies of `strategies.py`, with the Cerebro or the
+  vectorized engine, and for the vectorized models of `pairs.py` and
+  `kelly.py` (see `pairs_model` and `kelly_model`).
+* The (fold, parameters) backtests run on a process pool. The data is written
+  once as NumPy arrays (in /dev/shm when available) and memory mapped by the
+  workers, and every fold is a view of the arrays instead of a copy.
+* The indicators of the Cerebro backtests are computed once per parameter set
+  on the whole series and sliced per fold (see `indicator_cache`).
+
+python -m src.walkforward --strategy KDJStrategy --dataname data/tenb_*_1d.csv --train 504 --test 126
+"""
+from argparse import ArgumentParser
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import product
+import glob
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+import backtrader as bt
+
+from src.feeds import load_yahoo_csv
+from src import analytics, indicator_cache, kelly, pairs, sweep
+
+# Positions of the first train bar, the first test bar and the end (exclusive)
+# of the test bars of a fold.
+Fold = namedtuple("Fold", ["train_start", "test_start", "test_end"])
+
+# Data of the workers, set by _init_worker
+_DATA = None
+
+
+def folds(bars:int, train:int=252 * 2, test:int=126, anchored:bool=False, step:int=None) -> list:
+    """Train and test folds of a series of bars.
+
+    Parameters
+    ----------
+    bars: int
+        Number of bars.
+    train: int
+        Bars of the train folds. With `anchored` the bars of the first one.
+    test: int
+        Bars of the test folds. The last fold is shorter when the bars run out.
+    anchored: bool
+        Every train fold starts at the first bar and grows with the folds.
+        Otherwise the train folds roll forward with a fixed length.
+    step: int
+        Bars between the starts of two test folds. Defaults to `test`, so the
+        test folds do not overlap.
+
+    Returns
+    -------
+    list
+        Fold tuples.
+    """
+    step = step or test
+    out = []
+    for test_start in range(train, bars, step):
+        out.append(Fold(0 if anchored else test_start - train, test_start, min(test_start + test, bars)))
+    return out
+
+
+def metrics(returns:np.ndarray) -> dict:
+    """Total return, annualized Sharpe ratio and maximum drawdown of bar returns."""
+    returns = np.nan_to_num(np.asarray(returns, dtype=float))
+    return {
+        "return": np.prod(1 + returns) - 1,
+        "sharpe": analytics.sharpe(returns, periods=analytics.TRADING_DAYS)[0],
+        "max_drawdown": analytics.drawdown(returns)[0][0],
+    }
+
+
+def _returns(values:np.ndarray) -> np.ndarray:
+    """Bar returns of a portfolio value series, 0 for the first bar."""
+    values = np.asarray(values, dtype=float)
+    out = np.zeros(values.shape[0])
+    out[1:] = values[1:] / values[:-1] - 1
+    return out
+
+
+def pairs_model(prices:pd.DataFrame, train:slice, pairs_list:list, window:int=30, entry:float=1,
+                exit:float=0.5, hedge_window:int=None) -> np.ndarray:
+    """Daily returns of the pair trading strategy, equally weighted over the
+    pairs, see `pairs.spread_positions`. Without `hedge_window` the hedge
+    ratios are fitted on the train bars, like the notebook does on its
+    training set."""
+    result = pairs.spread_positions(prices, pairs_list, window=window, entry=entry, exit=exit,
+                                    hedge_window=hedge_window,
+                                    train=None if hedge_window else np.arange(train.start, train.stop))
+    pnl = result.pnl.values
+    # Mean over the pairs with a P&L, 0 on the days without any
+    count = np.sum(~np.isnan(pnl), axis=1)
+    return np.nansum(pnl, axis=1) / np.maximum(count, 1)
+
+
+def kelly_model(prices:pd.DataFrame, train:slice, **params) -> np.ndarray:
+    """Daily returns of the rolling Kelly allocation, with the fractions of a
+    day earning the returns of the next day, see `kelly.allocate`."""
+    dailyret = prices.pct_change()
+    fractions = kelly.allocate(dailyret, **params).values
+    out = np.zeros(prices.shape[0])
+    out[1:] = np.nansum(fractions[:-1] * dailyret.values[1:], axis=1)
+    return out
+
+
+def _share(df:pd.DataFrame, folder:str) -> dict:
+    """Write the index and the values of a frame as .npy files."""
+    spec = {
+        "index": os.path.join(folder, "index.npy"),
+        "values": os.path.join(folder, "values.npy"),
+        "columns": list(df.columns),
+    }
+    np.save(spec["index"], df.index.values.astype("datetime64[ns]"))
+    np.save(spec["values"], np.ascontiguousarray(df.values, dtype=float))
+    return spec
+
+
+def _attach(spec:dict) -> pd.DataFrame:
+    """Memory map the arrays written by _share back into a frame."""
+    index = np.load(spec["index"], mmap_mode="r")
+    values = np.load(spec["values"], mmap_mode="r")
+    return pd.DataFrame(values, index=pd.DatetimeIndex(np.asarray(index), name="datetime"),
+                        columns=spec["columns"], copy=False)
+
+
+def _init_worker(spec:dict, cachedir:str=None) -> None:
+    """Attach the data once per worker process and turn the indicator cache
+    on, shared by the workers when `cachedir` is specified."""
+    global _DATA
+    _DATA = _attach(spec)
+    indicator_cache.configure(cachedir)
+
+
+def _is_strategy(target) -> bool:
+    return isinstance(target, type) and issubclass(target, bt.Strategy)
+
+
+def _run_job(job:tuple) -> dict:
+    """Backtest one (fold, parameters) combination over the train and test
+    bars of the fold."""
+    target, engine, i, fold, params = job
+    df = _DATA.iloc[fold.train_start:fold.test_end]
+    split = fold.test_start - fold.train_start
+    if _is_strategy(target) and engine == "cerebro":
+        # The indicators are computed on the whole series once and sliced per fold.
+        returns = _returns(sweep.backtest_cerebro(target, df, params, history=_DATA)[1])
+    elif _is_strategy(target):
+        returns = _returns(sweep.ENGINES[engine](target, df, params)[1])
+    else:
+        returns = target(df, slice(0, split), **params)
+    row = {"fold": i, "params": params}
+    row.update({"train_" + key: value for key, value in metrics(returns[1:split]).items()})
+    row.update({"test_" + key: value for key, value in metrics(returns[split:]).items()})
+    return row
+
+
+def walk_forward(target, grid:dict, data, train:int=252 * 2, test:int=126, anchored:bool=False,
+                 step:int=None, metric:str="sharpe", engine:str="cerebro", processes:int=None,
+                 fromdate:datetime=None, todate:datetime=None, cache:bool=False) -> pd.DataFrame:
+    """Walk-forward optimization and out-of-sample evaluation.
+
+    Every combination of `grid` is backtested once per fold over the train and
+    test bars of the fold. The combination with the best `metric` on the train
+    bars is selected and its metrics on the test bars are the out-of-sample
+    metrics of the fold. The strategies and models only use past bars, so the
+    train metrics do not depend on the test bars. The positions at the end of
+    the train bars are carried into the test bars, and the indicators are
+    warmed up on the train bars.
+
+    Parameters
+    ----------
+    target: class or callable
+        A strategy class of `strategies.py`, or a model function like
+        `pairs_model` taking (prices, train slice, **params) and returning the
+        returns of every bar.
+    grid: dict
+        Values to test per parameter, e.g. {'period': range(5, 16)}. Fixed
+        parameters are lists of one value, e.g. {'pairs_list': [[('GLD', 'GDX')]]}.
+    data: str or pandas.DataFrame
+        Path of a YahooFinance csv file or OHLCV frame of `feeds.load_yahoo_csv`
+        for a strategy, frame of close prices for a model.
+    train: int
+        Bars of the train folds, see `folds`.
+    test: int
+        Bars of the test folds.
+    anchored: bool
+        Anchored instead of rolling train folds.
+    step: int
+        Bars between two test folds. Defaults to `test`.
+    metric: str
+        'sharpe' or 'return', the train metric that selects the parameters.
+    engine: str
+        'cerebro' or 'vectorized' for a strategy, see `sweep.sweep`.
+    processes: int
+        Number of worker processes. Defaults to the number of CPUs. With 1 the
+        backtests run in the calling process.
+    fromdate: datetime
+        Drop the bars of the csv file before this datetime.
+    todate: datetime
+        Drop the bars of the csv file after this datetime.
+    cache: bool
+        Share the indicators of the Cerebro backtests between the worker
+        processes through a folder, see `sweep.sweep`. Every worker computes
+        the indicators of a parameter set once on the whole series and slices
+        them per fold either way.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per fold with the dates of the fold, the selected parameters,
+        their train metric and their test return, Sharpe ratio and maximum
+        drawdown.
+    """
+    if metric not in ("sharpe", "return"):
+        raise ValueError("Unknown metric %s, expected 'sharpe' or 'return'" % metric)
+    if _is_strategy(target) and engine not in ("cerebro", "vectorized"):
+        raise ValueError("Unknown engine %s, expected 'cerebro' or 'vectorized'" % engine)
+    if isinstance(data, str):
+        data = load_yahoo_csv(data, fromdate=fromdate, todate=todate)
+    splits = folds(data.shape[0], train, test, anchored, step)
+    if len(splits) == 0:
+        raise ValueError("%i bars are not enough for a train fold of %i bars" % (data.shape[0], train))
+    names = list(grid)
+    combinations = [dict(zip(names, values)) for values in product(*(grid[name] for name in names))]
+    jobs = [(target, engine, i, fold, params) for i, fold in enumerate(splits) for params in combinations]
+    processes = processes or os.cpu_count()
+    shm = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    with tempfile.TemporaryDirectory(dir=shm) as folder:
+        spec = _share(data, folder)
+        cachedir = os.path.join(folder, "indicators") if cache else None
+        if processes == 1:
+            global _DATA
+            previous = indicator_cache.get_cache()
+            _init_worker(spec, cachedir)
+            rows = [_run_job(job) for job in jobs]
+            _DATA = None
+            indicator_cache.set_cache(previous)
+        else:
+            chunksize = max(1, len(jobs) // (processes * 4))
+            with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                     initargs=(spec, cachedir)) as executor:
+                rows = list(executor.map(_run_job, jobs, chunksize=chunksize))
+    table = []
+    for i, fold in enumerate(splits):
+        candidates = [row for row in rows if row["fold"] == i]
+        # NaN metrics, e.g. no trade at all, are never selected over a number.
+        best = max(candidates, key=lambda row: np.nan_to_num(row["train_" + metric], nan=-np.inf))
+        out = {
+            "fold": i,
+            "train_start": data.index[fold.train_start],
+            "test_start": data.index[fold.test_start],
+            "test_end": data.index[fold.test_end - 1],
+        }
+        out.update(best["params"])
+        out["train_" + metric] = best["train_" + metric]
+        out.update({key: value for key, value in best.items() if key.startswith("test_")})
+        table.append(out)
+    return pd.DataFrame(table)
+
+
+if __name__ == '__main__':
+    from src import strategies
+    parser = ArgumentParser()
+    parser.add_argument("--strategy", type=str)
+    parser.add_argument("--dataname", type=str, help="csv file or glob pattern")
+    parser.add_argument("--train", default=252 * 2, type=int)
+    parser.add_argument("--test", default=126, type=int)
+    parser.add_argument("--anchored", default=0, type=int)
+    parser.add_argument("--metric", default="sharpe", choices=["sharpe", "return"])
+    parser.add_argument("--engine", default="cerebro", choices=["cerebro", "vectorized"])
+    parser.add_argument("--processes", type=int)
+    args = parser.parse_args()
+    strategy = getattr(strategies, args.strategy)
+    paths = glob.glob(args.dataname)
+    if len(paths) == 0:
+        parser.error("No file matches --dataname %s" % args.dataname)
+    table = walk_forward(
+        strategy, strategy.optgrid, max(paths, key=os.path.getmtime),
+        train=args.train, test=args.test, anchored=args.anchored != 0, metric=args.metric,
+        engine=args.engine, processes=args.processes
+    )
+    print(table.to_string(index=False))
+    print("Out-of-sample return: %.4f" % (np.prod(1 + table["test_return"].values) - 1))
@@ -0,0 +1,22 @@
+"""Fixtures shared by the tests."""
+import pandas as pd
+import pytest
+
+
+class _CountingTicker:
+    """Stand-in for `yf.Ticker` serving the bars of `df` and counting the fetches."""
+    def __init__(self, df:pd.DataFrame):
+        self.df = df
+        self.fetches = []
+
+    def history(self, period:str=None, interval:str="1d", start=None, **kwargs) -> pd.DataFrame:
+        self.fetches.append("start" if start is not None else "period")
+        if start is not None:
+            return self.df[self.df.index >= start].copy()
+        return self.df.copy()
+
+
+@pytest.fixture
+def counting_ticker():
+    """Class of the stub tickers, called with the bars they serve."""
+    return _CountingTicker
@@ -0,0 +1,83 @@
+"""`utils.download_yf` with the on-disk OHLC cache against a stub ticker."""
+import json
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import utils
+from src.bench import synthetic_ohlcv
+from src.cache import OHLCCache
+
+
+@pytest.fixture
+def stub(monkeypatch, counting_ticker):
+    ticker = counting_ticker(synthetic_ohlcv(300))
+    monkeypatch.setattr(utils.yf, "Ticker", lambda symbol: ticker)
+    return ticker
+
+
+def _expire(root:str, ticker:str="SYN", interval:str="1d") -> None:
+    """Make the last download of the cache older than one interval."""
+    path = os.path.join(root, ticker, interval, "meta.json")
+    with open(path) as f:
+        meta = json.load(f)
+    meta["fetched_at"] = 0
+    with open(path, "w") as f:
+        json.dump(meta, f)
+
+
+def _ns(index:pd.DatetimeIndex) -> list:
+    return list(index.tz_convert("UTC").astype("datetime64[ns, UTC]"))
+
+
+def _assert_same(df:pd.DataFrame, expected:pd.DataFrame) -> None:
+    """Same bars, the cache stores the index in nanoseconds and the columns as floats."""
+    assert _ns(df.index) == _ns(expected.index)
+    assert list(df.columns) == list(expected.columns)
+    np.testing.assert_allclose(np.asarray(df.values, dtype=float),
+                               np.asarray(expected.values, dtype=float), rtol=1e-12)
+
+
+def _download(root) -> pd.DataFrame:
+    return utils.download_yf("SYN", "max", cache=str(root))
+
+
+def test_cold_fill(stub, tmp_path):
+    df = _download(tmp_path)
+    assert stub.fetches == ["period"]
+    _assert_same(df, stub.df)
+    assert OHLCCache(str(tmp_path)).meta("SYN", "1d")["rows"] == 300
+
+
+def test_warm_read_does_not_fetch(stub, tmp_path):
+    _download(tmp_path)
+    stub.fetches.clear()
+    df = _download(tmp_path)
+    assert stub.fetches == []
+    _assert_same(df, stub.df)
+
+
+def test_incremental_append(stub, tmp_path):
+    full = stub.df
+    stub.df = full.iloc[:250]
+    _download(tmp_path)
+    stub.df = full
+    stub.fetches.clear()
+    _expire(str(tmp_path))
+    df = _download(tmp_path)
+    # Only the bars from the second last cached bar on are downloaded.
+    assert stub.fetches == ["start"]
+    _assert_same(df, full)
+
+
+def test_adjusted_close_downloads_again(stub, tmp_path):
+    _download(tmp_path)
+    adjusted = stub.df.copy()
+    adjusted[["Open", "High", "Low", "Close"]] *= 0.98
+    stub.df = adjusted
+    stub.fetches.clear()
+    _expire(str(tmp_path))
+    df = _download(tmp_path)
+    assert stub.fetches == ["start", "period"]
+    _assert_same(df, adjusted)
@@ -0,0 +1,49 @@
+"""Positions of `factor_model.positions_table` against the loop of the Statistical
+Factor Model notebook."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import factor_model
+
+LOOKBACK = 60
+NUM_FACTORS = 5
+TOP_N = 10
+
+
+def _notebook_positions(dailyret:pd.DataFrame) -> np.ndarray:
+    """The principal component regression loop of the notebook."""
+    sm = pytest.importorskip("statsmodels.api")
+    PCA = pytest.importorskip("sklearn.decomposition").PCA
+    LinearRegression = pytest.importorskip("sklearn.linear_model").LinearRegression
+    positionsTable = np.zeros(dailyret.shape)
+    for t in np.arange(LOOKBACK + 1, dailyret.shape[0]):
+        R = dailyret.iloc[t - LOOKBACK + 1:t, ].T
+        hasData = np.where(R.notna().all(axis=1))[0]
+        R = R.dropna()
+        X = PCA().fit_transform(R.T)[:, :NUM_FACTORS]
+        X = sm.add_constant(X)
+        clf = LinearRegression(fit_intercept=False).fit(X, R.T)
+        Rexp = np.sum(clf.predict(X), axis=0)
+        idxSort = Rexp.argsort()
+        positionsTable[t, hasData[idxSort[np.arange(0, TOP_N)]]] = -1
+        positionsTable[t, hasData[idxSort[np.arange(-TOP_N, -1)]]] = 1
+    return positionsTable
+
+
+def test_same_positions_as_the_notebook():
+    rng = np.random.default_rng(0)
+    days, assets = 160, 60
+    # A few common factors and missing values: stocks listed late, delisted
+    # early and with gaps.
+    returns = rng.normal(0, 1e-2, (days, 3)) @ rng.normal(0, 1, (3, assets)) \
+        + rng.normal(0, 1e-2, (days, assets))
+    returns[:90, 0] = np.nan
+    returns[120:, 1] = np.nan
+    returns[70:75, 2] = np.nan
+    dailyret = pd.DataFrame(returns)
+    expected = _notebook_positions(dailyret)
+    positions = factor_model.positions_table(dailyret, lookback=LOOKBACK, topN=TOP_N)
+    np.testing.assert_array_equal(positions, expected)
+    np.testing.assert_allclose(factor_model.portfolio_returns(positions, dailyret),
+                               factor_model.portfolio_returns(expected, dailyret))
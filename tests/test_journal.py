@@ -0,0 +1,26 @@
+"""Trade journal of the strategies."""
+import json
+import backtrader as bt
+
+from src import strategies
+from src.bench import synthetic_ohlcv
+from src.feeds import ArrayData
+
+
+def test_orders_are_created_the_bar_before_the_fill(tmp_path):
+    filepath = tmp_path / "syn_19700102_19710101_1d.csv"
+    synthetic_ohlcv(250).to_csv(filepath)
+    journal = tmp_path / "journal.jsonl"
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.addstrategy(strategies.TestStrategy, printlog=False, journal=str(journal))
+    cerebro.adddata(ArrayData(dataname=str(filepath)))
+    cerebro.run()
+    events = [json.loads(line) for line in journal.read_text().splitlines()]
+    created = [event for event in events if event["kind"] == "created"]
+    filled = [event for event in events if event["kind"] == "filled"]
+    assert len(created) == len(filled) > 0
+    for order, fill in zip(created, filled):
+        # Market orders are filled at the open of the next bar.
+        assert fill["bar"] == order["bar"] + 1
+        assert order["datetime"] < fill["datetime"]
+        assert order["datetime"].startswith("19")
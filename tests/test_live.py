@@ -0,0 +1,67 @@
+"""Streaming signals of `live` against the strategies run by Cerebro."""
+import threading
+import time
+import backtrader as bt
+import pytest
+
+from src import live, strategies
+from src.bench import synthetic_ohlcv
+from src.feeds import ArrayData
+
+
+class _RecordedKDJ(strategies.KDJStrategy):
+    """KDJStrategy recording the date and side of the orders it creates."""
+    def __init__(self):
+        super(_RecordedKDJ, self).__init__()
+        self.decisions = []
+
+    def buy(self, *args, **kwargs):
+        self.decisions.append((self.datetime.date(0), live.BUY))
+        return super(_RecordedKDJ, self).buy(*args, **kwargs)
+
+    def sell(self, *args, **kwargs):
+        self.decisions.append((self.datetime.date(0), live.SELL))
+        return super(_RecordedKDJ, self).sell(*args, **kwargs)
+
+
+@pytest.fixture(scope="module")
+def filepath(tmp_path_factory):
+    filepath = tmp_path_factory.mktemp("data") / "syn_19700102_19711231_1d.csv"
+    synthetic_ohlcv(500).to_csv(filepath)
+    return str(filepath)
+
+
+def test_replay_gives_the_decisions_of_kdj_strategy(filepath):
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.addstrategy(_RecordedKDJ, printlog=False)
+    cerebro.adddata(ArrayData(dataname=filepath))
+    expected = cerebro.run()[0].decisions
+    decisions = [(decision.datetime.date(), decision.side)
+                 for decision in live.stream(live.replay(filepath), live.KDJSignal())]
+    assert len(expected) > 10
+    assert decisions == expected
+
+
+def test_tail_follows_appended_lines(filepath, tmp_path):
+    with open(filepath) as f:
+        lines = f.readlines()
+    path = tmp_path / "syn_19700102_19711231_1d.csv"
+    path.write_text("".join(lines[:101]))
+
+    def append():
+        for start in range(101, len(lines), 100):
+            time.sleep(0.05)
+            with open(path, "a") as f:
+                # The last line of a write can be incomplete.
+                f.write("".join(lines[start:start + 100])[:-5])
+                f.flush()
+                time.sleep(0.02)
+                f.write("".join(lines[start:start + 100])[-5:])
+
+    writer = threading.Thread(target=append)
+    writer.start()
+    bars = list(live.tail_csv(str(path), poll=0.01, timeout=0.5))
+    writer.join()
+    replayed = list(live.replay(filepath))
+    assert [bar.datetime for bar in bars] == [bar.datetime for bar in replayed]
+    assert [bar.close for bar in bars] == [bar.close for bar in replayed]
@@ -0,0 +1,64 @@
+"""`pairs.spread_positions` against the Bollinger band loop of the pair-trading
+notebook."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import pairs
+
+WINDOW, ENTRY, EXIT = 30, 1, 0.5
+
+
+def _notebook(history:pd.DataFrame, trainset:np.ndarray) -> tuple:
+    """Positions and P&L of the Bollinger band strategy of the notebook."""
+    sm = pytest.importorskip("statsmodels.api")
+    hedge_ratio = sm.OLS(
+        history.loc[:, "Close_GLD"].iloc[trainset],
+        history.loc[:, "Close_GDX"].iloc[trainset]
+    ).fit().params["Close_GDX"]
+    spread = history.loc[:, "Close_GLD"] - hedge_ratio * history.loc[:, "Close_GDX"]
+    dailyret = history.loc[:, ("Close_GLD", "Close_GDX")].pct_change()
+    columns = ["Positions_GLD_Short", "Positions_GDX_Short", "Positions_GLD_Long", "Positions_GDX_Long"]
+    bollinger = history.copy()
+    bollinger.loc[:, "Spread"] = spread
+    bollinger.loc[:, "Spread_SMA"] = bollinger.loc[:, "Spread"].rolling(window=WINDOW).mean().values
+    bollinger.loc[:, "Spread_STD"] = bollinger.loc[:, "Spread"].rolling(window=WINDOW).std().values
+    bollinger = bollinger.eval("zscore = (Spread - Spread_SMA) / Spread_STD")
+    bollinger.loc[bollinger.zscore >= ENTRY, columns[:2]] = [-1, 1]
+    bollinger.loc[bollinger.zscore <= -ENTRY, columns[2:]] = [1, -1]
+    bollinger.loc[bollinger.zscore <= EXIT, columns[:2]] = [0, 0]
+    bollinger.loc[bollinger.zscore >= -EXIT, columns[2:]] = [0, 0]
+    bollinger.loc[:, columns] = bollinger.loc[:, columns].ffill().fillna(0)
+    bollinger = bollinger.eval('''
+      Positions_GLD = Positions_GLD_Short + Positions_GLD_Long
+      Positions_GDX = Positions_GDX_Short + Positions_GDX_Long
+    ''')
+    positions = bollinger.loc[:, ["Positions_GLD", "Positions_GDX"]]
+    pnl = (np.array(positions.shift()) * np.array(dailyret)).sum(axis=1)
+    return positions, pnl
+
+
+def test_same_positions_and_sharpe_as_the_notebook():
+    rng = np.random.default_rng(0)
+    days = 756
+    gdx = 30 * np.exp(np.cumsum(rng.normal(0, 1e-2, days)))
+    # Mean reverting residual, so the pair is cointegrated.
+    residual = np.zeros(days)
+    for t in range(1, days):
+        residual[t] = 0.9 * residual[t - 1] + rng.normal(0, 0.5)
+    gld = 2 * gdx + 60 + residual
+    history = pd.DataFrame({"Close_GLD": gld, "Close_GDX": gdx},
+                           index=pd.bdate_range("2020-01-01", periods=days))
+    trainset = np.arange(0, 252 * 2)
+    testset = np.arange(trainset.shape[0], days)
+    positions, pnl = _notebook(history, trainset)
+
+    result = pairs.spread_positions(history, [("Close_GLD", "Close_GDX")], window=WINDOW,
+                                    entry=ENTRY, exit=EXIT, train=trainset)
+    np.testing.assert_array_equal(result.positions_y.values[:, 0], positions["Positions_GLD"].values)
+    np.testing.assert_array_equal(result.positions_x.values[:, 0], positions["Positions_GDX"].values)
+    np.testing.assert_allclose(result.pnl.values[1:, 0], pnl[1:], rtol=1e-12, atol=1e-15)
+    expected = np.sqrt(252) * np.mean(pnl[testset]) / np.std(pnl[testset])
+    sharpe = pairs.sharpe_ratio(result.pnl, rows=testset).iloc[0]
+    assert sharpe == pytest.approx(expected, rel=1e-9)
+    assert (positions["Positions_GLD"] != 0).any()
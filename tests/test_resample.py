@@ -0,0 +1,71 @@
+"""Minute bar resampling, against pandas and through ArrayData and Cerebro."""
+import numpy as np
+import pandas as pd
+import pytest
+import backtrader as bt
+
+from src.bench import synthetic_ohlcv
+from src.feeds import ArrayData, file_timeframe
+from src.resample import csv_chunks, resample
+
+
+class _Datetimes(bt.Strategy):
+    """Datetime of every bar."""
+    def start(self):
+        self.datetimes = []
+
+    def next(self):
+        self.datetimes.append(self.data.datetime.datetime(0))
+
+
+# pandas rule and offset of the buckets of every timeframe, aligned to 9:30
+RULES = {"5m": ("5min", None), "1h": ("1h", "30min"), "1d": ("1D", None)}
+
+
+@pytest.fixture(scope="module")
+def minutes(tmp_path_factory):
+    """Minute bars of 8 sessions around the start of the daylight saving time."""
+    source = tmp_path_factory.mktemp("source") / "syn_20230308_20230317_1m.csv"
+    synthetic_ohlcv(8 * 390, freq="1m", start="2023-03-08").to_csv(source)
+    return str(source)
+
+
+@pytest.mark.parametrize("chunksize", [37, 390, 200000])
+def test_same_bars_as_pandas(minutes, tmp_path, chunksize):
+    files = resample(csv_chunks(minutes, chunksize=chunksize), "SYN", str(tmp_path), list(RULES))
+    source = pd.read_csv(minutes, index_col=0)
+    source.index = pd.to_datetime(source.index.str.slice(0, 19))
+    for timeframe, (rule, offset) in RULES.items():
+        expected = source.resample(rule, offset=offset).agg({
+            "Open": "first", "High": "max", "Low": "min", "Close": "last", "Volume": "sum",
+        }).dropna(subset=["Open"])
+        df = pd.read_csv(files[timeframe], index_col=0)
+        stamps = df.index.str.slice(0, 19)
+        assert list(pd.to_datetime(stamps)) == list(expected.index), timeframe
+        np.testing.assert_allclose(df.loc[:, expected.columns].values, expected.values, rtol=1e-12)
+        # The UTC offset of the bars follows the change to the daylight saving time.
+        assert set(df.index.str.slice(19)) == {"-05:00", "-04:00"}
+
+
+@pytest.fixture(scope="module")
+def files(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("data")
+    source = folder / "syn_20230501_20230505_1m.csv"
+    synthetic_ohlcv(5 * 390, freq="1m", start="2023-05-01").to_csv(source)
+    return resample(csv_chunks(str(source)), "SYN", str(folder), ["5m", "15m", "1h", "1d"])
+
+
+@pytest.mark.parametrize("interval", ["5m", "15m", "1h", "1d"])
+def test_distinct_increasing_datetimes(files, interval):
+    filepath = files[interval]
+    timeframe, compression = file_timeframe(filepath)
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.addstrategy(_Datetimes)
+    cerebro.adddata(ArrayData(dataname=filepath, timeframe=timeframe, compression=compression))
+    datetimes = np.array(cerebro.run()[0].datetimes, dtype="datetime64[us]")
+    rows = pd.read_csv(filepath).shape[0]
+    assert datetimes.shape[0] == rows
+    assert (np.diff(datetimes) > np.timedelta64(0)).all()
+    if interval == "1d":
+        # Daily bars end with the session, up to the float rounding of the dates.
+        assert (datetimes - datetimes.astype("datetime64[D]") > np.timedelta64(86399, "s")).all()
@@ -0,0 +1,33 @@
+"""Result cache of `screener.screen`."""
+import json
+import numpy as np
+import pandas as pd
+
+from src import screener
+
+
+def _prices(days:int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    base = 50 * np.exp(np.cumsum(rng.normal(0, 1e-2, days)))
+    return pd.DataFrame({
+        "A": base + rng.normal(0, 0.2, days),
+        "B": 2 * base + rng.normal(0, 0.2, days),
+        "C": base + 10 + rng.normal(0, 0.2, days),
+    }, index=pd.bdate_range("2020-01-01", periods=days))
+
+
+def test_rolling_screens_keep_the_last_results(tmp_path):
+    cache = str(tmp_path / "coint.json")
+    prices = _prices(400)
+    first = screener.screen(prices.iloc[:300], window=252, threshold=0.5, processes=1, cache=cache)
+    assert len(first) == 3
+    with open(cache) as f:
+        assert len(json.load(f)) == 3
+    # The next day moves the window, the results of the previous window are dropped.
+    for day in range(301, 311):
+        screener.screen(prices.iloc[:day], window=252, threshold=0.5, processes=1, cache=cache)
+        with open(cache) as f:
+            assert len(json.load(f)) == 3
+    again = screener.screen(prices.iloc[:310], window=252, threshold=0.5, processes=1, cache=cache)
+    expected = screener.screen(prices.iloc[:310], window=252, threshold=0.5, processes=1)
+    pd.testing.assert_frame_equal(again, expected)
@@ -0,0 +1,47 @@
+"""`utils.download_many` against stub tickers."""
+import os
+import time
+import numpy as np
+import pytest
+
+from src import utils
+from src.bench import synthetic_ohlcv
+
+
+@pytest.fixture
+def stubs(monkeypatch, counting_ticker):
+    tickers = {ticker: counting_ticker(synthetic_ohlcv(300, seed=seed)) for seed, ticker in enumerate("ABCD")}
+    monkeypatch.setattr(utils.yf, "Ticker", lambda symbol: tickers[symbol])
+    return tickers
+
+
+def _fetches(stubs) -> list:
+    return [fetch for stub in stubs.values() for fetch in stub.fetches]
+
+
+def test_csv_files_are_reused(stubs, tmp_path):
+    first = utils.download_many(list(stubs), "max", path=str(tmp_path))
+    assert _fetches(stubs) == ["period"] * 4
+    second = utils.download_many(list(stubs), "max", path=str(tmp_path))
+    assert _fetches(stubs) == ["period"] * 4
+    assert second.index.equals(first.index)
+    np.testing.assert_allclose(second.values, first.values)
+
+
+def test_stale_csv_files_are_extended(stubs, tmp_path):
+    full = {ticker: stub.df for ticker, stub in stubs.items()}
+    for ticker, stub in stubs.items():
+        stub.df = full[ticker].iloc[:250]
+    utils.download_many(list(stubs), "max", path=str(tmp_path))
+    for ticker, stub in stubs.items():
+        stub.df = full[ticker]
+        stub.fetches.clear()
+    past = time.time() - 7 * 86400
+    for filename in os.listdir(tmp_path):
+        os.utime(tmp_path / filename, (past, past))
+    df = utils.download_many(list(stubs), "max", path=str(tmp_path), column="Close")
+    assert _fetches(stubs) == ["start"] * 4
+    # The extended files replace the old ones.
+    assert len(os.listdir(tmp_path)) == 4
+    for ticker in stubs:
+        np.testing.assert_allclose(df[ticker].values, full[ticker]["Close"].values)
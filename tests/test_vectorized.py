@@ -0,0 +1,50 @@
+"""Parity of the vectorized backtests with the Cerebro engine of `strategies.run`."""
+import numpy as np
+import pytest
+import backtrader as bt
+
+from src import strategies, vectorized
+from src.bench import synthetic_ohlcv
+from src.feeds import ArrayData, load_yahoo_csv
+
+
+class _ClosedTrades(bt.Analyzer):
+    """pnlcomm of the closed trades, in closing order."""
+    def start(self):
+        self.pnlcomm = []
+
+    def notify_trade(self, trade):
+        if trade.isclosed:
+            self.pnlcomm.append(trade.pnlcomm)
+
+    def get_analysis(self):
+        return self.pnlcomm
+
+
+@pytest.fixture(scope="module")
+def df(tmp_path_factory):
+    filepath = tmp_path_factory.mktemp("data") / "syn_20210527_20230526_1d.csv"
+    synthetic_ohlcv(600, start="2021-05-20").to_csv(filepath)
+    return load_yahoo_csv(str(filepath), fromdate=vectorized.FROMDATE, todate=vectorized.TODATE)
+
+
+def _cerebro(strategy, df) -> tuple:
+    cerebro = bt.Cerebro(stdstats=False)
+    params = {"printlog": False} if "printlog" in strategy.params._getkeys() else {}
+    cerebro.addstrategy(strategy, **params)
+    cerebro.adddata(ArrayData(dataname=df))
+    cerebro.broker.setcash(vectorized.CASH)
+    cerebro.addsizer(bt.sizers.FixedSize, stake=vectorized.STAKE)
+    cerebro.broker.setcommission(commission=vectorized.COMMISSION)
+    cerebro.addanalyzer(_ClosedTrades, _name="trades")
+    result = cerebro.run()[0]
+    return cerebro.broker.getvalue(), result.analyzers.trades.get_analysis()
+
+
+@pytest.mark.parametrize("strategy", [strategies.TestStrategy, strategies.MaStrategy, strategies.KDJStrategy])
+def test_parity_with_cerebro(strategy, df):
+    value, pnlcomm = _cerebro(strategy, df)
+    result = vectorized.backtest(strategy, df)
+    assert len(pnlcomm) > 0
+    assert result.value == pytest.approx(value, rel=1e-9)
+    np.testing.assert_allclose(result.trades["pnlcomm"].values, pnlcomm, rtol=1e-9, atol=1e-9)